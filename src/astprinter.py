@@ -0,0 +1,148 @@
+import json
+import sys
+from json.encoder import encode_basestring
+from nodes import *
+from sourcepos import SourceFile
+from symbol import Symbol
+from typesystem import Type
+
+def text_value(value):
+    if isinstance(value, SourceFile):
+        return repr(value.filename)
+    return repr(value)
+
+def json_scalar(value):
+    # Strings and flags are most of the fields, they skip the generic json.dumps
+    if type(value) is str:
+        return encode_basestring(value)
+    if value is None:
+        return "null"
+    if value is True or value is False:
+        return "true" if value else "false"
+    return json.dumps(value, default=json_value)
+
+def json_value(value):
+    # json.dumps calls this for everything it can't encode itself
+    if isinstance(value, SourceFile):
+        return value.filename
+    if isinstance(value, Symbol):
+        return {"type": value.type.name}
+    return str(value)
+
+def sexpr_value(value):
+    if value is None:
+        return "nil"
+    if value is True or value is False:
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return "(" + " ".join(sexpr_value(item) for item in value) + ")"
+    if isinstance(value, dict):
+        return "(" + " ".join(f"({sexpr_value(name)} {sexpr_value(item)})" for name, item in value.items()) + ")"
+    if isinstance(value, Symbol):
+        return sexpr_value(value.type)
+    if isinstance(value, Type):
+        return sexpr_value(value.name)
+    if isinstance(value, SourceFile):
+        return sexpr_value(value.filename)
+    return json.dumps(str(value))
+
+class ASTPrinter:
+    # Writes an AST to a file-like object in a single walk over the nodes. Every piece of
+    # text is written once when the walk reaches it, so a dump costs time linear in its size
+    # and is never held in memory as a whole. The walk keeps an explicit stack of pending
+    # text and nodes, deep trees don't run into the recursion limit.
+    #
+    # Formats: text (one node per line, indented), json (nested objects with a "node" key
+    # holding the class name) and sexpr (the fields of a node in node_layouts order).
+    def __init__(self, file=None, format="text"):
+        self.file = file if file is not None else sys.stdout
+        self.format = format
+        self.expand = getattr(self, f"expand_{format}")
+
+    def print(self, node):
+        write = self.file.write
+        stack = [(node, 0, "")]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                write(item)
+            else:
+                parts = self.expand(*item)
+                parts.reverse()
+                stack.extend(parts)
+        if self.format != "text":
+            write("\n")
+
+    # The expand methods turn a node into its text and its children, in output order.
+    # Children are (node, depth, prefix) items, the prefix is written right before the node.
+
+    def expand_text(self, node, depth, prefix):
+        indent = '    ' * depth
+        layout = node_layouts[type(node)]
+        values = ", ".join(f"{name}={text_value(getattr(node, name))}" for name, how in layout if how == VALUE)
+        parts = [f"{indent}{prefix}{type(node).__name__}({values})\n"]
+        for name, how in layout:
+            value = getattr(node, name)
+            if how == NODE:
+                if value is not None:
+                    parts.append((value, depth + 1, f"{name}: "))
+            elif how == NODES:
+                for index, child in enumerate(value):
+                    parts.append((child, depth + 1, f"{name}[{index}]: "))
+            elif how == PAIRS:
+                for index, pair in enumerate(value):
+                    for position, child in enumerate(pair):
+                        parts.append((child, depth + 1, f"{name}[{index}][{position}]: "))
+        return parts
+
+    def expand_json(self, node, depth, prefix):
+        parts = [f'{prefix}{{"node": "{type(node).__name__}", "offset": {node.offset}']
+        for name, how in node_layouts[type(node)]:
+            value = getattr(node, name)
+            if how == VALUE:
+                parts.append(f', "{name}": {json_scalar(value)}')
+            elif how == NODE:
+                if value is None:
+                    parts.append(f', "{name}": null')
+                else:
+                    parts.append((value, depth + 1, f', "{name}": '))
+            elif how == NODES:
+                parts.append(f', "{name}": [')
+                for index, child in enumerate(value):
+                    parts.append((child, depth + 1, ", " if index else ""))
+                parts.append("]")
+            else:
+                parts.append(f', "{name}": [')
+                for index, (first, second) in enumerate(value):
+                    parts.append((first, depth + 1, ", [" if index else "["))
+                    parts.append((second, depth + 1, ", "))
+                    parts.append("]")
+                parts.append("]")
+        parts.append("}")
+        return parts
+
+    def expand_sexpr(self, node, depth, prefix):
+        parts = [f"{prefix}({type(node).__name__}"]
+        for name, how in node_layouts[type(node)]:
+            value = getattr(node, name)
+            if how == VALUE:
+                parts.append(f" {sexpr_value(value)}")
+            elif how == NODE:
+                if value is None:
+                    parts.append(" nil")
+                else:
+                    parts.append((value, depth + 1, " "))
+            elif how == NODES:
+                parts.append(" (")
+                for index, child in enumerate(value):
+                    parts.append((child, depth + 1, " " if index else ""))
+                parts.append(")")
+            else:
+                parts.append(" (")
+                for index, (first, second) in enumerate(value):
+                    parts.append((first, depth + 1, " (" if index else "("))
+                    parts.append((second, depth + 1, " "))
+                    parts.append(")")
+                parts.append(")")
+        parts.append(")")
+        return parts
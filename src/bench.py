@@ -0,0 +1,630 @@
+import argparse
+import cProfile
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from lexer import Lexer
+from loops import LoopOptimizer
+from astprinter import ASTPrinter
+from boundscheck import BoundsChecker
+from codegen import CodeGenerator
+from deadcode import DeadCodeEliminator
+from diagnostics import Diagnostics
+from escape import EscapeAnalyzer
+from fastlexer import FastLexer
+from flatast import FlatAST, kind_codes
+from folder import ConstantFolder
+from inliner import Inliner
+from layout import LayoutPlanner
+from nodes import BinOpNode, UnaryOpNode, FunctionCallNode, ProcNode, TypeNode, node_layouts, NODE, NODES, PAIRS
+from parser import Parser
+from semanter import Semanter
+from tokentype import TokenType
+
+lexers = {
+    "classic": Lexer,
+    "fast": FastLexer
+}
+
+# Generates a FlatBasic program of roughly the given number of lines
+def generate_source(lines):
+    chunks = []
+    for i in range(lines // 10):
+        chunks.append(
+            f"# generated block {i}\n"
+            f"proc calc{i}(a: int, b: int): int\n"
+            f"    let r{i}: int = (a + b) * {i} - a / 2\n"
+            f"    if r{i} >= {i} and a != b then\n"
+            f"        r{i} = r{i} + 1\n"
+            f"    endif\n"
+            f"    return r{i}\n"
+            f"pend\n"
+            f"let v{i}: int = calc{i}({i}, {i + 1})\n"
+            f"let s{i}: string = \"value {i}\"\n"
+        )
+    return "".join(chunks)
+
+# Generates one let statement per line with expressions of mixed size
+def generate_expressions(lines):
+    expressions = [
+        "{i}",
+        "a + {i}",
+        "(a + b) * {i} - c / 2",
+        "a < b and b <= c or !(a == {i})",
+        "-a * (b + (c - (a * {i}))) >= b + c * a - {i}",
+    ]
+    chunks = ["let a: int = 1\nlet b: int = 2\nlet c: int = 3\n"]
+    for i in range(lines):
+        chunks.append(f"let v{i}: int = {expressions[i % len(expressions)].format(i=i)}\n")
+    return "".join(chunks)
+
+# Deeply nested programs, each shape takes the nesting depth
+nesting_shapes = {
+    "or chain": lambda depth: "let x: int = a" + " or a" * depth + "\n",
+    "parentheses": lambda depth: "let x: int = " + "(" * depth + "a" + ")" * depth + "\n",
+    "unary": lambda depth: "let x: int = " + "-" * depth + "a\n",
+    "calls": lambda depth: "let x: int = " + "f(" * depth + "a" + ")" * depth + "\n",
+    "if blocks": lambda depth: "if a then\n" * depth + "a = 1\n" + "endif\n" * depth,
+    "while blocks": lambda depth: "while a < 1\n" * depth + "a = 1\n" + "wend\n" * depth,
+}
+
+def generate_nesting(shape, depth):
+    return "proc f(v: int): int\n    return v\npend\nlet a: int = 1\n" + nesting_shapes[shape](depth)
+
+def time_lexer(lexer_class, code):
+    start = time.perf_counter()
+    lexer = lexer_class(code, "bench.mb")
+    count = 0
+    while lexer.get_next_token().type is not TokenType.EOF:
+        count += 1
+    return time.perf_counter() - start, count
+
+def bench_lexers(args):
+    code = generate_source(args.lines)
+    print(f"{args.lines} lines, {len(code)} bytes")
+    for name, lexer_class in lexers.items():
+        seconds, count = time_lexer(lexer_class, code)
+        print(f"  {name:<10} {count} tokens in {seconds:.3f}s ({count / seconds:,.0f} tokens/s)")
+
+def bench_token_memory(args):
+    code = generate_source(args.lines)
+    print(f"{args.lines} lines, {len(code)} bytes")
+    for name, lexer_class in lexers.items():
+        tracemalloc.start()
+        tokens = lexer_class(code, "bench.mb").tokenize()
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {name:<10} {len(tokens)} tokens, {size / 2**20:.1f} MiB retained ({size / len(tokens):.0f} bytes/token), {peak / 2**20:.1f} MiB peak")
+
+def bench_expressions(args):
+    code = generate_expressions(args.lines)
+    start = time.perf_counter()
+    Parser(FastLexer(code, "bench.mb")).parse()
+    seconds = time.perf_counter() - start
+    profile = cProfile.Profile()
+    profile.runcall(Parser(FastLexer(code, "bench.mb")).parse)
+    stats = pstats.Stats(profile).stats
+    parser_calls = sum(calls for (filename, _, _), (_, calls, _, _, _) in stats.items() if filename.endswith("parser.py"))
+    print(f"{args.lines} expression statements, lexed and parsed in {seconds:.3f}s")
+    print(f"  {parser_calls} parser calls, {parser_calls / args.lines:.1f} per statement")
+
+def count_tree_nodes(root, node_class):
+    # The same walk a pass over the object AST does, node by node through the references
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if type(node) is node_class:
+            count += 1
+        for name, how in node_layouts[type(node)]:
+            value = getattr(node, name)
+            if how == NODE:
+                if value is not None:
+                    stack.append(value)
+            elif how == NODES:
+                stack.extend(value)
+            elif how == PAIRS:
+                for pair in value:
+                    stack.extend(pair)
+    return count
+
+def count_flat_nodes(flat, node_class):
+    count = 0
+    kind = kind_codes[node_class]
+    for node_kind in flat.kinds:
+        if node_kind == kind:
+            count += 1
+    return count
+
+def bench_ast_memory(args):
+    # About 9.6 nodes per generated line
+    code = generate_expressions(args.nodes * 10 // 96)
+    tracemalloc.start()
+    tree = Parser(FastLexer(code, "bench.mb")).parse()
+    tree_size, _ = tracemalloc.get_traced_memory()
+    flat = FlatAST.from_tree(tree)
+    flat_size = tracemalloc.get_traced_memory()[0] - tree_size
+    tracemalloc.stop()
+    nodes = len(flat)
+    print(f"{nodes} nodes")
+    print(f"  objects    {tree_size / 2**20:.1f} MiB ({tree_size / nodes:.0f} bytes/node)")
+    print(f"  flat       {flat_size / 2**20:.1f} MiB ({flat_size / nodes:.0f} bytes/node)")
+    for name, count, ast in (("objects", count_tree_nodes, tree), ("flat", count_flat_nodes, flat)):
+        start = time.perf_counter()
+        count(ast, BinOpNode)
+        print(f"  {name:<10} walked in {time.perf_counter() - start:.3f}s")
+
+def bench_dump(args):
+    programs = [
+        (f"{args.lines} lines", generate_expressions(args.lines)),
+        (f"{args.lines} unary operators deep", generate_nesting("unary", args.lines)),
+    ]
+    with open(os.devnull, "w") as output:
+        for name, code in programs:
+            ast = Parser(FastLexer(code, "bench.mb"), nonrecursive=True).parse()
+            for format in ["text", "json", "sexpr"]:
+                start = time.perf_counter()
+                ASTPrinter(output, format).print(ast)
+                print(f"  {name:<28} {format:<6} {time.perf_counter() - start:.3f}s")
+
+def collect_nodes(root):
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        for name, how in node_layouts[type(node)]:
+            value = getattr(node, name)
+            if how == NODE:
+                if value is not None:
+                    stack.append(value)
+            elif how == NODES:
+                stack.extend(value)
+            elif how == PAIRS:
+                for pair in value:
+                    stack.extend(pair)
+    return nodes
+
+def bench_visitor(args):
+    ast = Parser(FastLexer(generate_expressions(args.lines), "bench.mb")).parse()
+    nodes = collect_nodes(ast)
+    semanter = Semanter()
+    print(f"{len(nodes)} nodes")
+
+    # Handler lookup alone, the way Semanter used to find it and through the class cache
+    start = time.perf_counter()
+    for node in nodes:
+        getattr(semanter, f'visit_{type(node).__name__}', semanter.generic_visit)
+    seconds = time.perf_counter() - start
+    print(f"  getattr lookup  {len(nodes) / seconds:,.0f} lookups/s")
+    handlers = semanter.handlers
+    start = time.perf_counter()
+    for node in nodes:
+        handlers.get(type(node)) or semanter.resolve(type(node))
+    seconds = time.perf_counter() - start
+    print(f"  cached lookup   {len(nodes) / seconds:,.0f} lookups/s")
+
+    # A whole pass, every node visited once
+    start = time.perf_counter()
+    semanter.analyze(ast)
+    seconds = time.perf_counter() - start
+    print(f"  semanter        {len(nodes) / seconds:,.0f} visits/s")
+
+def bench_nesting(args):
+    print(f"recursion limit {sys.getrecursionlimit()}")
+    for shape in nesting_shapes:
+        for depth in args.depths:
+            code = generate_nesting(shape, depth)
+            for nonrecursive in (False, True):
+                start = time.perf_counter()
+                try:
+                    Semanter().analyze(Parser(FastLexer(code, "bench.mb"), nonrecursive=nonrecursive).parse())
+                    result = f"{time.perf_counter() - start:.3f}s"
+                except RecursionError:
+                    result = "RecursionError"
+                mode = "nonrecursive" if nonrecursive else "recursive"
+                print(f"  {shape:<13} depth {depth:<7} {mode:<13} {result}")
+
+def bench_procs(args):
+    # One proc per 10 lines, their bodies checked in this process and by process pools
+    ast = Parser(FastLexer(generate_source(args.lines), "bench.mb")).parse()
+    procs = sum(1 for statement in ast.statements if type(statement) is ProcNode)
+    print(f"{procs} procs, {os.cpu_count()} cpus")
+    for jobs in args.jobs:
+        start = time.perf_counter()
+        Semanter(jobs=jobs).analyze(ast)
+        print(f"  jobs {jobs:<4} {time.perf_counter() - start:.3f}s")
+
+def bench_fold(args):
+    # Operators left for the generated code to compute, before and after constant folding
+    programs = [
+        (f"{args.lines} expression lines", generate_expressions(args.lines)),
+        (f"{args.lines} lines with procs", generate_source(args.lines)),
+    ]
+    for name, code in programs:
+        ast = Parser(FastLexer(code, "bench.mb")).parse()
+        Semanter().analyze(ast)
+        before = count_tree_nodes(ast, BinOpNode) + count_tree_nodes(ast, UnaryOpNode)
+        start = time.perf_counter()
+        ConstantFolder(Diagnostics()).fold(ast)
+        seconds = time.perf_counter() - start
+        after = count_tree_nodes(ast, BinOpNode) + count_tree_nodes(ast, UnaryOpNode)
+        print(f"  {name:<28} {before} operators, {after} after folding in {seconds:.3f}s")
+
+# Small helper procs and callers of them, with arguments that aren't constant
+def generate_helpers(lines):
+    chunks = []
+    for i in range(lines // 10):
+        chunks.append(
+            f"proc scale{i}(x: int): int\n"
+            f"    return x * {i} + 1\n"
+            f"pend\n"
+            f"proc use{i}(a: int, b: int): int\n"
+            f"    let sum{i}: int = scale{i}(a) + scale{i}(b)\n"
+            f"    return sum{i} / 2\n"
+            f"pend\n"
+            f"let v{i}: int = 0\n"
+            f"v{i} = use{i}(v{i}, v{i} + {i})\n"
+        )
+    return "".join(chunks)
+
+def bench_inline(args):
+    ast = Parser(FastLexer(generate_helpers(args.lines), "bench.mb")).parse()
+    Semanter().analyze(ast)
+    before = count_tree_nodes(ast, FunctionCallNode)
+    start = time.perf_counter()
+    inlined = Inliner().inline(ast)
+    seconds = time.perf_counter() - start
+    print(f"{inlined} calls inlined in {seconds:.3f}s, {before} calls before, {count_tree_nodes(ast, FunctionCallNode)} after")
+
+# Procs of which only every tenth is called, with statements after their return
+def generate_dead_code(lines):
+    chunks = []
+    for i in range(lines // 10):
+        chunks.append(
+            f"proc calc{i}(a: int): int\n"
+            f"    if {i % 2} then\n"
+            f"        return a + {i}\n"
+            f"    endif\n"
+            f"    return a * {i}\n"
+            f"    let unreachable{i}: int = a - 1\n"
+            f"    return unreachable{i}\n"
+            f"pend\n"
+        )
+        if i % 10 == 0:
+            chunks.append(f"let v{i}: int = calc{i}({i})\n")
+    return "".join(chunks)
+
+def compile_c(ast):
+    # Size of the generated C and the seconds the C compiler takes for it, if there is one
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.c")
+        with open(path, "w") as output:
+            CodeGenerator(output).generate(ast)
+        size = os.path.getsize(path)
+        compiler = shutil.which("cc") or shutil.which("gcc")
+        if compiler is None:
+            return size, None
+        start = time.perf_counter()
+        subprocess.run([compiler, "-c", "-o", os.path.join(directory, "bench.o"), path], check=True)
+        return size, time.perf_counter() - start
+
+def bench_deadcode(args):
+    ast = Parser(FastLexer(generate_dead_code(args.lines), "bench.mb")).parse()
+    Semanter().analyze(ast)
+    ConstantFolder(Diagnostics()).fold(ast)
+    results = [(len(collect_nodes(ast)),) + compile_c(ast)]
+    start = time.perf_counter()
+    DeadCodeEliminator().eliminate(ast)
+    seconds = time.perf_counter() - start
+    results.append((len(collect_nodes(ast)),) + compile_c(ast))
+    print(f"dead code eliminated in {seconds:.3f}s")
+    for name, (nodes, size, compile_seconds) in zip(["before", "after"], results):
+        compiled = f", compiled in {compile_seconds:.3f}s" if compile_seconds is not None else ""
+        print(f"  {name:<7} {nodes} nodes, {size / 1e6:.2f} MB of C{compiled}")
+
+# A select with the given number of cases, run for every loop iteration
+def generate_select(kind, cases, iterations):
+    chunks = ["proc dispatch(k: " + ("string" if kind == "strings" else "int") + "): int\n    select case k\n"]
+    for j in range(cases):
+        value = f'"op{j}"' if kind == "strings" else j * 37 if kind == "sparse" else j
+        chunks.append(f"        case {value}\n            return {j + 1}\n")
+    chunks.append("        else\n            return 0\n    end select\n    return 0\npend\n")
+    chunks.append("let total: long = 0\n")
+    if kind == "strings":
+        chunks.append(f"dim names[{cases}]: string\n")
+        chunks.extend(f'names[{j}] = "op{j}"\n' for j in range(cases))
+        argument = f"names[i - (i / {cases}) * {cases}]"
+    else:
+        argument = f"(i - (i / {cases}) * {cases}) * {37 if kind == 'sparse' else 1}"
+    chunks.append(f"for i = 1 to {iterations}\n    total = total + dispatch({argument})\nnext\n")
+    return "".join(chunks)
+
+def run_c(ast, lower_selects=True, optimization="-O0", pools=True, reorder_fields=True):
+    # Seconds the compiled program takes, by default without optimizations, which would hide
+    # the difference between the ways a select is translated
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.c")
+        with open(path, "w") as output:
+            CodeGenerator(output, lower_selects=lower_selects, pools=pools, reorder_fields=reorder_fields).generate(ast)
+        program = os.path.join(directory, "bench")
+        subprocess.run([shutil.which("cc") or shutil.which("gcc"), optimization, "-o", program, path], check=True)
+        start = time.perf_counter()
+        subprocess.run([program])
+        return time.perf_counter() - start
+
+def bench_select(args):
+    if shutil.which("cc") is None and shutil.which("gcc") is None:
+        print("needs a C compiler on the PATH")
+        return
+    for kind in ["dense", "sparse", "strings"]:
+        for cases in args.cases:
+            ast = Parser(FastLexer(generate_select(kind, cases, args.iterations), "bench.mb")).parse()
+            Semanter().analyze(ast)
+            chain, lowered = run_c(ast, False), run_c(ast, True)
+            print(f"  {kind:<8} {cases:<5} cases  if chain {chain:.3f}s  lowered {lowered:.3f}s")
+
+# Loops over an array whose length is a parameter, every index is in bounds
+def generate_array_loops(length, rounds):
+    return (
+        "proc work(n: int, rounds: int): int\n"
+        "    dim a[n]: int\n"
+        "    for r = 1 to rounds\n"
+        "        for i = 1 to n - 1\n"
+        "            a[i] = a[i - 1] + a[i] - r\n"
+        "        next\n"
+        "    next\n"
+        "    return a[n - 1]\n"
+        "pend\n"
+        f"return work({length}, {rounds})\n"
+    )
+
+def bench_bounds(args):
+    if shutil.which("cc") is None and shutil.which("gcc") is None:
+        print("needs a C compiler on the PATH")
+        return
+    ast = Parser(FastLexer(generate_array_loops(args.length, args.rounds), "bench.mb")).parse()
+    Semanter().analyze(ast)
+    checked = run_c(ast, optimization="-O2")
+    bounds_checker = BoundsChecker(Diagnostics())
+    bounds_checker.check(ast)
+    elided = run_c(ast, optimization="-O2")
+    print(f"  {bounds_checker.proven} of {bounds_checker.proven + bounds_checker.checked} accesses proven in bounds")
+    print(f"  every index checked {checked:.3f}s  proven checks elided {elided:.3f}s")
+
+# Nested loops with a field chain, indices that are multiples of the loop variable and a
+# short inner loop
+def generate_loops(length, rounds):
+    return (
+        "type Engine\n    field speed: int = 3\ntend\n"
+        "type Car\n    field engine: ptr Engine\ntend\n"
+        "let car: ptr Car = new ptr Car\n"
+        "car.engine = new ptr Engine\n"
+        f"dim a[{length * 4}]: int\n"
+        f"for r = 1 to {rounds}\n"
+        f"    for i = 0 to {length - 1}\n"
+        "        for k = 0 to 3\n"
+        "            a[i * 4 + k] = a[i * 4 + k] + car.engine.speed * r\n"
+        "        next\n"
+        "    next\n"
+        "next\n"
+        "return a[1]\n"
+    )
+
+def bench_loops(args):
+    if shutil.which("cc") is None and shutil.which("gcc") is None:
+        print("needs a C compiler on the PATH")
+        return
+    code = generate_loops(args.length, args.rounds)
+    results = []
+    for optimize in [False, True]:
+        ast = Parser(FastLexer(code, "bench.mb")).parse()
+        Semanter().analyze(ast)
+        BoundsChecker(Diagnostics()).check(ast)
+        if optimize:
+            optimizer = LoopOptimizer()
+            optimizer.optimize(ast)
+        results.append(run_c(ast))
+    print(f"  {optimizer.hoisted} hoisted, {optimizer.reduced} reduced, {optimizer.unrolled} unrolled")
+    print(f"  as written {results[0]:.3f}s  loops optimized {results[1]:.3f}s")
+
+# Rounds that make count small records in a list and free them again, one by one or all of
+# them at once with the arena they were made in
+def generate_allocations(count, rounds, arena):
+    placement = " in scratch" if arena else ""
+    free_record = "" if arena else "    free record\n"
+    free_arena = "    free scratch\n" if arena else ""
+    return (
+        "type Record\n    field value: long = 1\n    field weight: double\n    field link: ptr Record\ntend\n"
+        "let total: long = 0\n"
+        "let scratch: arena = new arena\n"
+        "let head: ptr Record = new ptr Record\n"
+        "proc push(i: int): void\n"
+        f"    let record: ptr Record = new ptr Record{placement}\n"
+        "    record.value = record.value + i\n"
+        "    record.link = head\n"
+        "    head = record\n"
+        "pend\n"
+        "proc pop(): long\n"
+        "    let record: ptr Record = head\n"
+        "    let value: long = record.value\n"
+        "    head = record.link\n"
+        f"{free_record}"
+        "    return value\n"
+        "pend\n"
+        "proc cycle(n: int): void\n"
+        "    for i = 1 to n\n        push(i)\n    next\n"
+        "    for i = 1 to n\n        total = total + pop()\n    next\n"
+        f"{free_arena}"
+        "pend\n"
+        f"for r = 1 to {rounds}\n    cycle({count})\nnext\n"
+        "return total / 1000000\n"
+    )
+
+def bench_alloc(args):
+    if shutil.which("cc") is None and shutil.which("gcc") is None:
+        print("needs a C compiler on the PATH")
+        return
+    results = []
+    for name, arena, pools in [("malloc", False, False), ("pool", False, True), ("arena", True, True)]:
+        ast = Parser(FastLexer(generate_allocations(args.count, args.rounds, arena), "bench.mb")).parse()
+        Semanter().analyze(ast)
+        results.append(f"{name} {run_c(ast, optimization='-O2', pools=pools):.3f}s")
+    print(f"  {args.rounds} x {args.count} records  " + "  ".join(results))
+
+# A proc that keeps its intermediate result in a record that never leaves it, called in a loop
+def generate_temporaries(calls):
+    return (
+        "type Point\n    field x: long\n    field y: long\ntend\n"
+        "proc advance(i: int): long\n"
+        "    let point: ptr Point = new ptr Point\n"
+        "    point.x = i\n"
+        "    point.y = point.x + 1\n"
+        "    return point.x * 2 + point.y\n"
+        "pend\n"
+        "let total: long = 0\n"
+        f"for i = 1 to {calls}\n    total = total + advance(i)\nnext\n"
+        "return total / 1000000\n"
+    )
+
+def bench_escape(args):
+    if shutil.which("cc") is None and shutil.which("gcc") is None:
+        print("needs a C compiler on the PATH")
+        return
+    results = []
+    for analyzed in [False, True]:
+        ast = Parser(FastLexer(generate_temporaries(args.calls), "bench.mb")).parse()
+        Semanter().analyze(ast)
+        if analyzed:
+            escape_analyzer = EscapeAnalyzer(Diagnostics())
+            escape_analyzer.analyze(ast)
+        results.append(run_c(ast, optimization="-O2"))
+    print(f"  {escape_analyzer.stack} instances on the stack, {escape_analyzer.heap} on the heap")
+    print(f"  every instance in a pool {results[0]:.3f}s  escape analyzed {results[1]:.3f}s")
+
+# A list of records whose fields of different sizes alternate, made in an arena, so they are
+# next to each other in memory, and summed up over and over
+def generate_records(count, rounds):
+    return (
+        "type Record\n"
+        "    field flag: char\n    field weight: double\n    field kind: char\n    field count: long\n"
+        "    field mark: char\n    field id: int\n    field state: char\n    field link: ptr Record\n"
+        "tend\n"
+        "let scratch: arena = new arena\n"
+        "let head: ptr Record = new ptr Record in scratch\n"
+        "let cursor: ptr Record = head\n"
+        "proc push(i: int): void\n"
+        "    let record: ptr Record = new ptr Record in scratch\n"
+        "    record.count = i\n"
+        "    record.link = head\n"
+        "    head = record\n"
+        "pend\n"
+        "proc take(): long\n"
+        "    let value: long = cursor.count\n"
+        "    cursor = cursor.link\n"
+        "    return value\n"
+        "pend\n"
+        "proc sum(n: int): long\n"
+        "    let total: long = 0\n"
+        "    cursor = head\n"
+        "    for i = 1 to n\n        total = total + take()\n    next\n"
+        "    return total\n"
+        "pend\n"
+        f"for i = 1 to {count}\n    push(i)\nnext\n"
+        "let result: long = 0\n"
+        f"for r = 1 to {rounds}\n    result = result + sum({count})\nnext\n"
+        "return result / 1000000\n"
+    )
+
+def bench_layout(args):
+    if shutil.which("cc") is None and shutil.which("gcc") is None:
+        print("needs a C compiler on the PATH")
+        return
+    ast = Parser(FastLexer(generate_records(args.count, args.rounds), "bench.mb")).parse()
+    Semanter().analyze(ast)
+    structs = [node.struct_type for node in collect_nodes(ast) if type(node) is TypeNode]
+    declared, reordered = (LayoutPlanner(reorder).plan(structs)[structs[0]].size for reorder in [False, True])
+    results = [run_c(ast, optimization="-O2", reorder_fields=reorder) for reorder in [False, True]]
+    print(f"  record of {declared} bytes in declared order, {reordered} bytes reordered")
+    print(f"  declared order {results[0]:.3f}s  reordered {results[1]:.3f}s")
+
+class CountingFile:
+    # Stands in for the output file, only counts what is written to it
+    def __init__(self):
+        self.size = 0
+        self.writes = 0
+
+    def write(self, text):
+        self.size += len(text)
+        self.writes += 1
+
+def bench_codegen(args):
+    # The C output is streamed, the memory it takes stays small however long the program is
+    programs = [
+        (f"{args.lines} lines", generate_source(args.lines)),
+        (f"{args.lines} unary operators deep", generate_nesting("unary", args.lines)),
+    ]
+    for name, code in programs:
+        ast = Parser(FastLexer(code, "bench.mb"), nonrecursive=True).parse()
+        Semanter().analyze(ast)
+        output = CountingFile()
+        tracemalloc.start()
+        start = time.perf_counter()
+        CodeGenerator(output).generate(ast)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  {name:<28} {elapsed:.3f}s {output.size / 1e6:.1f} MB of C in {output.writes} writes, peak {peak / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="FlatBasic compiler benchmarks")
+    arg_parser.add_argument("--lines", type=int, default=100000, help="size of the generated source")
+    subparsers = arg_parser.add_subparsers(dest="benchmark", required=True)
+    subparsers.add_parser("lexer", help="classic vs. fast lexer").set_defaults(run=bench_lexers)
+    subparsers.add_parser("memory", help="memory held by the token list").set_defaults(run=bench_token_memory)
+    subparsers.add_parser("expr", help="parser calls on an expression heavy program").set_defaults(run=bench_expressions)
+    ast_parser = subparsers.add_parser("ast", help="memory of the object and the flat AST")
+    ast_parser.add_argument("--nodes", type=int, default=500000)
+    ast_parser.set_defaults(run=bench_ast_memory)
+    subparsers.add_parser("visit", help="visitor dispatch and semanter visits per second").set_defaults(run=bench_visitor)
+    subparsers.add_parser("dump", help="AST printer on a long and a deep program").set_defaults(run=bench_dump)
+    nesting_parser = subparsers.add_parser("nesting", help="parse and check deeply nested programs")
+    nesting_parser.add_argument("--depths", type=int, nargs="+", default=[1000, 10000, 100000])
+    nesting_parser.set_defaults(run=bench_nesting)
+    procs_parser = subparsers.add_parser("procs", help="semanter with proc bodies checked in process pools")
+    procs_parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4])
+    procs_parser.set_defaults(run=bench_procs)
+    subparsers.add_parser("fold", help="operators left after constant folding").set_defaults(run=bench_fold)
+    subparsers.add_parser("inline", help="calls of small procs expanded in place").set_defaults(run=bench_inline)
+    subparsers.add_parser("deadcode", help="generated C before and after dead code elimination").set_defaults(run=bench_deadcode)
+    select_parser = subparsers.add_parser("select", help="compiled select dispatch, cases tried in order vs. lowered")
+    select_parser.add_argument("--cases", type=int, nargs="+", default=[4, 16, 64, 256])
+    select_parser.add_argument("--iterations", type=int, default=10000000)
+    select_parser.set_defaults(run=bench_select)
+    bounds_parser = subparsers.add_parser("bounds", help="compiled array loops with every index checked vs. proven checks elided")
+    bounds_parser.add_argument("--length", type=int, default=10000)
+    bounds_parser.add_argument("--rounds", type=int, default=100000)
+    bounds_parser.set_defaults(run=bench_bounds)
+    loops_parser = subparsers.add_parser("loops", help="compiled nested loops as written vs. optimized")
+    loops_parser.add_argument("--length", type=int, default=1000)
+    loops_parser.add_argument("--rounds", type=int, default=20000)
+    loops_parser.set_defaults(run=bench_loops)
+    alloc_parser = subparsers.add_parser("alloc", help="compiled allocations with calloc and free vs. pools vs. arenas")
+    alloc_parser.add_argument("--count", type=int, default=100000)
+    alloc_parser.add_argument("--rounds", type=int, default=100)
+    alloc_parser.set_defaults(run=bench_alloc)
+    escape_parser = subparsers.add_parser("escape", help="compiled calls with a temporary record in a pool vs. on the stack")
+    escape_parser.add_argument("--calls", type=int, default=5000000)
+    escape_parser.set_defaults(run=bench_escape)
+    layout_parser = subparsers.add_parser("layout", help="compiled walks over records with fields in declared order vs. reordered")
+    layout_parser.add_argument("--count", type=int, default=2000000)
+    layout_parser.add_argument("--rounds", type=int, default=20)
+    layout_parser.set_defaults(run=bench_layout)
+    subparsers.add_parser("codegen", help="C code generation on a long and a deep program").set_defaults(run=bench_codegen)
+    args = arg_parser.parse_args()
+    args.run(args)
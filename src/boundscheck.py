@@ -0,0 +1,214 @@
+from nodes import *
+from visitor import NodeVisitor
+
+class ArrayFacts:
+    # What is known about the length of an array where it is accessed
+    def __init__(self, length, size_symbol):
+        self.length = length # Constant length or None
+        self.size_symbol = size_symbol # Variable the length was read from, its value doesn't change
+
+class BoundsChecker(NodeVisitor):
+    # The generated code checks every array index at runtime, unless this pass proves it is
+    # always in bounds. It marks those accesses with in_bounds, the code generator leaves out
+    # their check. Proven are indices whose range is known from constants and from the loop
+    # variables of for loops with a constant step, as long as the variable isn't assigned
+    # in the body:
+    #
+    #   dim a[10]: int             a[3] and a[i] for i = 0 to 9
+    #   dim a[n]: int              a[i] for i = 0 to n - 1, or from n - 1 to 0 step -1
+    #
+    # The length of an array is known after its dim in the same proc or in main, a global
+    # array may not be allocated yet when a proc runs. A size variable only counts if it is
+    # never assigned and its value is set before the dim. A constant index out of a constant
+    # length is an error, with report every access gets a note whether it was proven.
+    def __init__(self, diagnostics, report=False):
+        self.diagnostics = diagnostics
+        self.report = report
+        self.source = None
+        self.assigned = set() # Symbols that are assigned somewhere after their declaration
+        self.globals = set() # Symbols of the global lets and dims
+        self.arrays = {} # Array symbol -> ArrayFacts, for the arrays dimensioned so far
+        self.loops = {} # Loop variable symbol -> range of its value in the loop body
+        self.initialized = set() # Globals whose let already ran in main
+        self.proc = None # Proc being checked, None in main
+        self.proven = 0
+        self.checked = 0
+
+    def check(self, program):
+        self.source = program.source
+        self.assigned = {node.var_name.symbol for node in walk(program) if type(node) is AssignmentNode and type(node.var_name) is IdentifierNode}
+        self.globals = {statement.symbol for statement in program.statements if type(statement) is LetNode or type(statement) is DimNode}
+        self.visit(program)
+
+    def is_fixed(self, symbol):
+        # True if the variable has the same value wherever it can be read from here
+        if symbol is None or symbol in self.assigned:
+            return False
+        return symbol not in self.globals or (self.proc is None and symbol in self.initialized)
+
+    def value_range(self, node):
+        # Lowest and highest value of an integer expression, None where unknown. The highest
+        # value is an int or a (symbol, k) pair meaning the value of the variable plus k.
+        if type(node) is NumberNode and type(node.number) is int:
+            return node.number, node.number
+        if type(node) is IdentifierNode:
+            if node.symbol in self.loops:
+                return self.loops[node.symbol]
+            # Unsigned values wrap around below 0, n - 1 isn't less than n for all of them
+            if self.is_fixed(node.symbol) and node.type.range is not None and node.type.range[0] < 0:
+                return None, (node.symbol, 0)
+            return None
+        if type(node) is BinOpNode and node.op in ('+', '-'):
+            constant, other = (node.right, node.left) if type(node.right) is NumberNode else (node.left, node.right)
+            if type(constant) is not NumberNode or type(constant.number) is not int or (node.op == '-' and constant is node.left):
+                return None
+            shift = constant.number if node.op == '+' else -constant.number
+            other_range = self.value_range(other)
+            if other_range is None:
+                return None
+            low, high = other_range
+            if type(high) is tuple:
+                high = (high[0], high[1] + shift)
+            elif high is not None:
+                high += shift
+            return (low + shift if low is not None else None), high
+        return None
+
+    def loop_range(self, node):
+        # Range of the loop variable in the body, the step decides which bound is which
+        if node.symbol in self.assigned or type(node.step_value) is not NumberNode or not node.step_value.number:
+            return None
+        first, last = (node.start_value, node.end_value) if node.step_value.number > 0 else (node.end_value, node.start_value)
+        first, last = self.value_range(first), self.value_range(last)
+        if first is None or last is None or first[0] is None:
+            return None
+        return first[0], last[1]
+
+    def access(self, node, name):
+        facts = self.arrays.get(node.symbol)
+        index_range = self.value_range(node.index)
+        node.in_bounds = False
+        if facts is not None and index_range is not None:
+            low, high = index_range
+            if facts.length is not None and type(high) is int and low == high and not 0 <= low < facts.length:
+                self.diagnostics.error(f"Array index {low} out of bounds for array '{name}' of size {facts.length}", self.source.srcpos(node.offset))
+                return
+            if low is not None and low >= 0 and high is not None:
+                if type(high) is int:
+                    node.in_bounds = facts.length is not None and high < facts.length
+                else:
+                    node.in_bounds = high[0] is facts.size_symbol and high[1] < 0
+        if node.in_bounds:
+            self.proven += 1
+        else:
+            self.checked += 1
+        if self.report:
+            message = "proven in bounds, not checked" if node.in_bounds else "checked at runtime"
+            self.diagnostics.note(f"Index of array '{name}' {message}", self.source.srcpos(node.offset))
+
+    # Expressions
+
+    def visit_ArrayAccessNode(self, node):
+        yield node.index
+        self.access(node, node.name)
+
+    def visit_leaf(self, node):
+        pass
+
+    visit_NumberNode = visit_StringNode = visit_IdentifierNode = visit_ErrorNode = visit_leaf
+
+    def visit_NewInstanceNode(self, node):
+        if node.arena is not None:
+            yield node.arena
+
+    def visit_UnaryOpNode(self, node):
+        yield node.expr
+
+    def visit_BinOpNode(self, node):
+        yield node.left
+        yield node.right
+
+    def visit_FunctionCallNode(self, node):
+        for argument in node.arguments:
+            yield argument
+
+    def visit_FieldAccessNode(self, node):
+        yield node.instance
+
+    # Statements
+
+    def visit_ProgramNode(self, node):
+        yield node.statements
+
+    def visit_ProcNode(self, node):
+        outer = self.proc, self.arrays, self.loops
+        self.proc, self.arrays, self.loops = node, {}, {}
+        yield node.body_statements
+        self.proc, self.arrays, self.loops = outer
+
+    def visit_TypeNode(self, node):
+        # Defaults are evaluated wherever an instance is made, nothing known here holds there
+        outer = self.proc, self.arrays, self.loops
+        self.proc, self.arrays, self.loops = node, {}, {}
+        for field in node.fields.values():
+            if field.default_value is not None:
+                yield field.default_value
+        self.proc, self.arrays, self.loops = outer
+
+    def visit_DimNode(self, node):
+        yield node.size
+        size_range = self.value_range(node.size)
+        length = size_range[0] if size_range is not None and size_range[0] == size_range[1] else None
+        size_symbol = node.size.symbol if type(node.size) is IdentifierNode and size_range is not None else None
+        self.arrays[node.symbol] = ArrayFacts(length, size_symbol)
+
+    def visit_LetNode(self, node):
+        yield node.expr
+        if self.proc is None:
+            self.initialized.add(node.symbol)
+
+    def visit_AssignmentNode(self, node):
+        yield node.var_name
+        yield node.value
+
+    def visit_ReturnNode(self, node):
+        yield node.value
+
+    def visit_FreeNode(self, node):
+        yield node.expr
+
+    def visit_IfNode(self, node):
+        yield node.condition
+        yield [node.true_branch]
+        if node.false_branch:
+            yield [node.false_branch]
+
+    def visit_ForNode(self, node):
+        yield node.start_value
+        yield node.end_value
+        yield node.step_value
+        loop_range = self.loop_range(node)
+        if loop_range is not None:
+            self.loops[node.symbol] = loop_range
+        yield [node.loop_body]
+        self.loops.pop(node.symbol, None)
+
+    def visit_WhileNode(self, node):
+        yield node.condition
+        yield [node.body]
+
+    def visit_DoWhileNode(self, node):
+        yield [node.body]
+        yield node.condition
+
+    def visit_DoUntilNode(self, node):
+        yield [node.body]
+        yield node.condition
+
+    def visit_SelectCaseNode(self, node):
+        yield node.expr
+        for value, body in node.cases:
+            yield value
+            yield [body]
+        if node.default_case:
+            yield [node.default_case]
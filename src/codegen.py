@@ -0,0 +1,740 @@
+import os
+from layout import LayoutPlanner
+from nodes import *
+from typesystem import PRIMITIVE, POINTER, STRUCT, PROC, string_type, void_type, arena_type
+from visitor import NodeVisitor
+
+# FlatBasic primitive types in C, numbers map to the fixed width types of <stdint.h>
+c_primitive_types = {
+    "void": "void",
+    "char": "int8_t",
+    "uchar": "uint8_t",
+    "short": "int16_t",
+    "ushort": "uint16_t",
+    "int": "int32_t",
+    "uint": "uint32_t",
+    "long": "int64_t",
+    "ulong": "uint64_t",
+    "size": "size_t",
+    "float": "float",
+    "double": "double",
+    "string": "const char *",
+    "arena": "struct fb_arena *",
+}
+
+c_operators = {"and": "&&", "or": "||"}
+
+# Names a FlatBasic name can't have in C: keywords, what the generated code uses itself and
+# the fb_ prefix of the generated helpers
+c_reserved_names = {
+    "auto", "break", "case", "char", "const", "continue", "default", "do", "double", "else", "enum",
+    "extern", "float", "for", "goto", "if", "inline", "int", "long", "register", "restrict", "return",
+    "short", "signed", "sizeof", "static", "struct", "switch", "typedef", "union", "unsigned", "void",
+    "volatile", "while", "main", "calloc", "free", "abort", "memset", "strcmp", "NULL", "offsetof",
+    "size_t", "ptrdiff_t", "wchar_t", "max_align_t", "int8_t", "uint8_t", "int16_t", "uint16_t",
+    "int32_t", "uint32_t", "int64_t", "uint64_t", "intptr_t", "uintptr_t", "intmax_t", "uintmax_t",
+}
+
+def c_name(name):
+    # Clashing names get a '_' appended, and so do names ending in '_', which keeps the
+    # mapping one to one
+    if name in c_reserved_names or name.startswith("fb_") or name.endswith("_"):
+        return name + "_"
+    return name
+
+def c_declaration(var_type, declarator=""):
+    # C declares from the inside out, the declarator is wrapped in what the type adds to it.
+    # Variables of a proc type are function pointers.
+    if var_type.kind is PROC:
+        params = ", ".join(c_declaration(param) for param in var_type.params) or "void"
+        return c_declaration(var_type.return_type, f"(*{declarator})({params})")
+    if var_type.kind is POINTER:
+        return c_declaration(var_type.target, "*" + declarator)
+    base = c_primitive_types[var_type.name] if var_type.kind is PRIMITIVE else f"struct {c_name(var_type.name)}"
+    if not declarator or base.endswith("*"):
+        return base + declarator
+    return f"{base} {declarator}"
+
+def c_type(var_type):
+    # Type name as used in casts and sizeof
+    return c_declaration(var_type)
+
+def c_string(value):
+    # The text of a FlatBasic string literal, which has no escapes of its own, as C literal
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+    return f'"{escaped}"'
+
+def c_number(value):
+    # An integer as C literal
+    if value > 9223372036854775807:
+        return f"{value}u" # Only fits uint64_t
+    if value == -9223372036854775808:
+        return "(-9223372036854775807 - 1)" # The literal without the minus doesn't fit int64_t
+    return str(value)
+
+def string_hash(text):
+    # 32 bit FNV-1a of the UTF-8 bytes, the same as fb_hash in the generated code
+    hash = 2166136261
+    for byte in text.encode("utf-8"):
+        hash = ((hash ^ byte) * 16777619) & 0xFFFFFFFF
+    return hash
+
+# Pools, arenas and the other helpers of the generated code, copied to the start of every C file
+runtime_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runtime.h")
+runtime_source = None
+
+def runtime():
+    global runtime_source
+    if runtime_source is None:
+        with open(runtime_path, encoding="utf-8") as file:
+            runtime_source = file.read()
+    return runtime_source
+
+# A select becomes a C switch if at least this part of the range of its case values are cases
+min_switch_density = 0.5
+
+# Cases a branch of a binary search compares one by one
+search_leaf_size = 3
+
+# Levels of nesting that are indented, the ones below stay at this level
+max_indent = 32
+
+class CodeWriter:
+    # Collects the generated text and hands it to the file in blocks of about limit
+    # characters, so the output is written with few calls and never held as a whole
+    def __init__(self, file, limit=1 << 16):
+        self.file = file
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.limit:
+            self.flush()
+
+    def flush(self):
+        self.file.write("".join(self.parts))
+        self.parts.clear()
+        self.size = 0
+
+class CodeGenerator(NodeVisitor):
+    # Translates an analyzed AST to C, reading the types and symbols the semanter put on the
+    # nodes. Expressions are written piece by piece as the walk reaches them, the generator
+    # doesn't build strings of nested code, so its time is linear in the size of the output.
+    #
+    # The C file has the structs of the program, its globals, its procs (procs in blocks
+    # are moved out to file scope) and main, which runs the statements of the program.
+    # Global lets and dims are declared at file scope and assigned where they appear.
+    #
+    # Every array index is checked against the length of the array at runtime, fb_check
+    # aborts the program if it is out of bounds. The check is left out where the bounds
+    # checker proved the index in bounds. A constant length of a local array is used as is,
+    # other lengths are kept in a variable fb_length_<array> next to the array.
+    #
+    # The helpers the code calls come from runtime.h at the start of the file. An instance
+    # made by new ptr Type is taken from the pool of the type, or from an arena with in. One
+    # that doesn't escape its proc is a variable fb_stack_<n> of the C function instead.
+    def __init__(self, file, lower_selects=True, pools=True, reorder_fields=True):
+        self.out = CodeWriter(file)
+        self.lower_selects = lower_selects # Off tries the cases of every select in order
+        self.pools = pools # Off makes every instance with calloc and frees it with free
+        self.reorder_fields = reorder_fields # Off keeps the fields of structs in declared order
+        self.depth = 0 # Indentation level
+        self.temp_count = 0 # Numbers the fb_ temporaries
+        self.global_nodes = set()
+        self.lengths = {} # Array symbol -> C expression of its length
+        self.proc = None # Proc being written, None in main
+
+    def generate(self, program):
+        write = self.out.write
+        types = []
+        procs = []
+        self.global_nodes = {node for node in program.statements if type(node) is LetNode or type(node) is DimNode}
+        for node in walk(program):
+            if type(node) is TypeNode:
+                types.append(node)
+            elif type(node) is ProcNode:
+                procs.append(node)
+            elif type(node) is DimNode:
+                if type(node.size) is NumberNode and node not in self.global_nodes:
+                    self.lengths[node.symbol] = c_number(node.size.number)
+                else:
+                    self.lengths[node.symbol] = f"fb_length_{c_name(node.name)}"
+        structs = [node.struct_type for node in types]
+
+        write(f"/* Generated by the FlatBasic compiler from {program.source.filename} */\n")
+        write("#include <stddef.h>\n#include <stdint.h>\n\n")
+        write(runtime())
+        write("\n")
+
+        if structs:
+            for struct in structs:
+                write(f"struct {c_name(struct.name)};\n")
+            write("\n")
+            layouts = LayoutPlanner(self.reorder_fields).plan(structs)
+            for struct, layout in layouts.items():
+                write(f"struct {c_name(struct.name)} {{\n")
+                for name, field_type, _ in layout.fields:
+                    write(f"    {c_declaration(field_type, c_name(name))};\n")
+                write("};\n\n")
+            for struct, layout in layouts.items():
+                self.emit_layout_tables(struct, layout)
+
+        for node in program.statements:
+            if type(node) is LetNode:
+                write(f"{c_declaration(node.symbol.type, c_name(node.var_name))};\n")
+            elif type(node) is DimNode:
+                # Its length is 0 until the dim runs, every checked access fails before
+                write(f"{c_type(node.array_type)} *{c_name(node.name)};\nsize_t {self.lengths[node.symbol]};\n")
+        write("\n")
+        for proc in procs:
+            write(f"{self.proc_header(proc)};\n")
+        write("\n")
+
+        # The helpers of a struct can use the ones of any other, declared after it or not
+        for node in types:
+            for header in self.struct_helper_headers(c_name(node.struct_type.name)):
+                write(f"{header};\n")
+        if types:
+            write("\n")
+        for node in types:
+            self.emit_struct_helpers(node)
+        for proc in procs:
+            self.proc = proc
+            write(f"{self.proc_header(proc)}\n{{\n")
+            for instance in proc.stack_instances:
+                write(f"    {c_declaration(instance.instance_type.target, f'fb_stack_{instance.stack_index}')};\n")
+            self.emit_statements(proc.body_statements)
+            write("}\n\n")
+        self.proc = None
+
+        write("int main(void)\n{\n")
+        self.emit_statements(program.statements)
+        write("    return 0;\n}\n")
+        self.out.flush()
+
+    def emit_layout_tables(self, struct, layout):
+        # Size and field offsets for C code that works with the struct, the offsets in the
+        # order the fields are declared. The array type of the check has a negative size,
+        # which doesn't compile, if the C compiler lays out the struct differently.
+        write = self.out.write
+        name = c_name(struct.name)
+        write(f"const size_t fb_size_{name} = {layout.size};\n")
+        if struct.fields:
+            offsets = ", ".join(str(layout.offsets[field_name]) for field_name in struct.fields)
+            write(f"const size_t fb_offsets_{name}[] = {{{offsets}}};\n")
+        checks = [f"sizeof(struct {name}) == {layout.size}"]
+        checks.extend(f"offsetof(struct {name}, {c_name(field_name)}) == {offset}" for field_name, _, offset in layout.fields)
+        write(f"typedef char fb_layout_{name}[{' && '.join(checks)} ? 1 : -1];\n\n")
+
+    def proc_header(self, proc):
+        params = ", ".join(c_declaration(param_type, c_name(name)) for name, param_type in proc.params) or "void"
+        return c_declaration(proc.return_type, f"{c_name(proc.name)}({params})")
+
+    def struct_helper_headers(self, name):
+        return (f"static inline void fb_init_{name}(struct {name} *fb_instance)",
+                f"static inline struct {name} *fb_new_{name}(void)",
+                f"static inline struct {name} *fb_arena_new_{name}(struct fb_arena *fb_arena)",
+                f"static inline struct {name} fb_make_{name}(void)")
+
+    def emit_struct_helpers(self, node):
+        # fb_init_X sets the defaults of a struct, fb_new_X makes an instance in the pool of
+        # the type, fb_arena_new_X in an arena and fb_make_X by value
+        write = self.out.write
+        name = c_name(node.struct_type.name)
+        init, new, arena_new, make = self.struct_helper_headers(name)
+        write(f"{init}\n{{\n")
+        for field_name, field in node.fields.items():
+            if field.default_value is not None:
+                write(f"    fb_instance->{c_name(field_name)} = ")
+                self.visit(field.default_value)
+                write(";\n")
+            elif field.type.kind is STRUCT:
+                write(f"    fb_init_{c_name(field.type.name)}(&fb_instance->{c_name(field_name)});\n")
+        write("}\n\n")
+        if self.pools:
+            write(f"static struct fb_pool fb_pool_of_{name};\n\n")
+            allocation = f"fb_pool_alloc(&fb_pool_of_{name}, sizeof(struct {name}))"
+        else:
+            allocation = f"fb_alloc(sizeof(struct {name}))"
+        write(f"{new}\n{{\n"
+              f"    struct {name} *fb_instance = {allocation};\n"
+              f"    fb_init_{name}(fb_instance);\n    return fb_instance;\n}}\n\n")
+        write(f"{arena_new}\n{{\n"
+              f"    struct {name} *fb_instance = fb_arena_alloc(fb_arena, sizeof(struct {name}));\n"
+              f"    fb_init_{name}(fb_instance);\n    return fb_instance;\n}}\n\n")
+        write(f"{make}\n{{\n    struct {name} fb_instance;\n    memset(&fb_instance, 0, sizeof fb_instance);\n"
+              f"    fb_init_{name}(&fb_instance);\n    return fb_instance;\n}}\n\n")
+
+    def emit_statements(self, statements):
+        self.depth += 1
+        for statement in statements:
+            if isinstance(statement, ExprNode):
+                self.indent()
+                self.visit(statement)
+                self.out.write(";\n")
+            else:
+                self.visit(statement)
+        self.depth -= 1
+
+    def statement(self, node):
+        # A call is the one expression that can stand as a statement
+        if isinstance(node, ExprNode):
+            self.indent()
+            yield node
+            self.out.write(";\n")
+        else:
+            yield node
+
+    def indent(self):
+        # Capped, deeper nesting would make the output grow with the square of the input
+        self.out.write("    " * min(self.depth, max_indent))
+
+    def temporary(self, kind):
+        self.temp_count += 1
+        return f"fb_{kind}_{self.temp_count}"
+
+    def block(self, statement):
+        # A nested statement in braces, one level deeper
+        self.out.write("{\n")
+        self.depth += 1
+        yield from self.statement(statement)
+        self.depth -= 1
+        self.indent()
+        self.out.write("}")
+
+    # Statements
+
+    def visit_ProcNode(self, node):
+        pass # Written at file scope by generate
+
+    def visit_TypeNode(self, node):
+        pass # Written at file scope by generate
+
+    def visit_ErrorNode(self, node):
+        pass # Never reached, programs with errors aren't translated
+
+    def visit_LetNode(self, node):
+        self.indent()
+        if node in self.global_nodes:
+            self.out.write(f"{c_name(node.var_name)} = ")
+        else:
+            self.out.write(f"{c_declaration(node.symbol.type, c_name(node.var_name))} = ")
+        yield node.expr
+        self.out.write(";\n")
+
+    def visit_DimNode(self, node):
+        self.indent()
+        element = c_type(node.array_type)
+        name = c_name(node.name)
+        length = self.lengths[node.symbol]
+        if type(node.size) is not NumberNode or node in self.global_nodes:
+            if node not in self.global_nodes:
+                self.out.write("size_t ")
+            self.out.write(f"{length} = (size_t)(")
+            yield node.size
+            self.out.write(");\n")
+            self.indent()
+        if node in self.global_nodes:
+            self.out.write(f"{name} = fb_alloc(sizeof({element}) * {length});\n")
+        else:
+            self.out.write(f"{element} {name}[{length}];\n")
+            self.indent()
+            self.out.write(f"memset({name}, 0, sizeof {name});\n")
+
+    def visit_AssignmentNode(self, node):
+        self.indent()
+        yield node.var_name
+        self.out.write(" = ")
+        yield node.value
+        self.out.write(";\n")
+
+    def array_index(self, node):
+        # Index and closing bracket of an access, checked unless it is proven in bounds
+        if node.in_bounds:
+            yield node.index
+            self.out.write("]")
+        else:
+            self.out.write("fb_check(")
+            yield node.index
+            self.out.write(f", {self.lengths[node.symbol]})]")
+
+    def visit_ReturnNode(self, node):
+        self.indent()
+        proc = self.proc
+        if proc is None:
+            self.out.write("return (int)(")
+            yield node.value
+            self.out.write(");\n")
+        elif proc.return_type is void_type:
+            self.out.write("(void)(")
+            yield node.value
+            self.out.write(");\n")
+            self.indent()
+            self.out.write("return;\n")
+        else:
+            self.out.write("return ")
+            yield node.value
+            self.out.write(";\n")
+
+    def visit_FreeNode(self, node):
+        self.indent()
+        expr_type = node.expr.type
+        if expr_type is arena_type:
+            self.out.write("fb_arena_free(")
+        elif expr_type.target.kind is STRUCT and self.pools:
+            self.out.write(f"fb_pool_free(&fb_pool_of_{c_name(expr_type.target.name)}, ")
+        else:
+            self.out.write("free(")
+        yield node.expr
+        self.out.write(");\n")
+
+    def visit_IfNode(self, node):
+        self.indent()
+        self.out.write("if (")
+        yield node.condition
+        self.out.write(") ")
+        yield from self.block(node.true_branch)
+        if node.false_branch:
+            self.out.write(" else ")
+            yield from self.block(node.false_branch)
+        self.out.write("\n")
+
+    def visit_ForNode(self, node):
+        # Start, end and step are evaluated once in this order when the loop starts, the sign
+        # of the step decides the direction. Literal bounds are used in place.
+        write = self.out.write
+        var_type = node.symbol.type
+        var = c_name(node.var_name)
+        self.indent()
+        write("{\n")
+        self.depth += 1
+        self.indent()
+        write(f"{c_declaration(var_type, var)} = ")
+        yield node.start_value
+        write(";\n")
+        end = node.end_value.value if type(node.end_value) is NumberNode else self.temporary("end")
+        if type(node.end_value) is not NumberNode:
+            self.indent()
+            write(f"{c_declaration(var_type, end)} = ")
+            yield node.end_value
+            write(";\n")
+        direction = self.constant_sign(node.step_value)
+        step = None if direction is not None else self.temporary("step")
+        if step is not None:
+            self.indent()
+            write(f"{c_declaration(var_type, step)} = ")
+            yield node.step_value
+            write(";\n")
+        yield from self.invariants(node)
+        # Induction variables start at the value of their expression for the start value
+        for induction in node.inductions:
+            self.indent()
+            write(f"int64_t fb_induction_{induction.index} = ")
+            yield induction.expr
+            write(";\n")
+        self.indent()
+        if direction is None:
+            write(f"for (; {step} > 0 ? {var} <= {end} : {var} >= {end}; {var} += {step}) ")
+        else:
+            write(f"for (; {var} {'<=' if direction > 0 else '>='} {end}; {var} += ")
+            yield node.step_value
+            for induction in node.inductions:
+                write(f", fb_induction_{induction.index} += {c_number(induction.increment)}")
+            write(") ")
+        yield from self.block(node.loop_body)
+        write("\n")
+        self.depth -= 1
+        self.indent()
+        write("}\n")
+
+    def invariants(self, node):
+        # Variables of the expressions the loop optimizer moved out of the loop
+        for hoisted in node.invariants:
+            self.indent()
+            self.out.write(f"{c_declaration(hoisted.type, f'fb_invariant_{hoisted.index}')} = ")
+            yield hoisted.expr
+            self.out.write(";\n")
+
+    def loop_scope(self, node):
+        # A loop with invariants is put in a block with their variables
+        if node.invariants:
+            self.indent()
+            self.out.write("{\n")
+            self.depth += 1
+            yield from self.invariants(node)
+
+    def loop_scope_end(self, node):
+        if node.invariants:
+            self.depth -= 1
+            self.indent()
+            self.out.write("}\n")
+
+    def visit_BlockNode(self, node):
+        if not node.statements:
+            return # A loop that never runs
+        self.indent()
+        self.out.write("{\n")
+        self.depth += 1
+        for statement in node.statements:
+            yield from self.statement(statement)
+        self.depth -= 1
+        self.indent()
+        self.out.write("}\n")
+
+    def constant_sign(self, node):
+        if type(node) is NumberNode:
+            return -1 if node.value.startswith("-") else 1
+        if type(node) is UnaryOpNode and node.op == "-" and type(node.expr) is NumberNode:
+            return -1
+        return None
+
+    def visit_WhileNode(self, node):
+        yield from self.loop_scope(node)
+        self.indent()
+        self.out.write("while (")
+        yield node.condition
+        self.out.write(") ")
+        yield from self.block(node.body)
+        self.out.write("\n")
+        self.loop_scope_end(node)
+
+    def visit_DoWhileNode(self, node):
+        yield from self.loop_scope(node)
+        self.indent()
+        self.out.write("do ")
+        yield from self.block(node.body)
+        self.out.write(" while (")
+        yield node.condition
+        self.out.write(");\n")
+        self.loop_scope_end(node)
+
+    def visit_DoUntilNode(self, node):
+        yield from self.loop_scope(node)
+        self.indent()
+        self.out.write("do ")
+        yield from self.block(node.body)
+        self.out.write(" while (!(")
+        yield node.condition
+        self.out.write("));\n")
+        self.loop_scope_end(node)
+
+    def visit_SelectCaseNode(self, node):
+        # The value is evaluated once. When every case is a distinct integer or string
+        # literal, which the folder makes of constant expressions, the case is found without
+        # trying them in order: dense integers become a C switch, sparse ones a binary search
+        # and strings a binary search over their hashes, computed here already.
+        write = self.out.write
+        temp = self.temporary("select")
+        self.indent()
+        write("{\n")
+        self.depth += 1
+        self.indent()
+        write(f"{c_declaration(node.expr.type, temp)} = ")
+        yield node.expr
+        write(";\n")
+
+        cases = self.literal_cases(node) if self.lower_selects else None
+        if cases is None:
+            yield from self.select_chain(node, temp)
+        elif node.expr.type is not string_type and len(cases) >= (max(cases) - min(cases) + 1) * min_switch_density:
+            yield from self.select_switch(node, temp, cases)
+        else:
+            yield from self.select_search(node, temp, cases)
+
+        self.depth -= 1
+        self.indent()
+        write("}\n")
+
+    def literal_cases(self, node):
+        # Literal -> index of the first case with it, None if not every case is a literal
+        cases = {}
+        if node.expr.type.is_integer:
+            for index, (value, _) in enumerate(node.cases):
+                if type(value) is not NumberNode or type(value.number) is not int:
+                    return None
+                cases.setdefault(value.number, index)
+        elif node.expr.type is string_type:
+            for index, (value, _) in enumerate(node.cases):
+                if type(value) is not StringNode:
+                    return None
+                cases.setdefault(value.value, index)
+        return cases or None
+
+    def select_chain(self, node, temp):
+        # The cases are tried in order
+        write = self.out.write
+        self.indent()
+        for index, (value, body) in enumerate(node.cases):
+            write("if (" if index == 0 else " else if (")
+            if node.expr.type is string_type:
+                write(f"strcmp({temp}, ")
+                yield value
+                write(") == 0")
+            else:
+                write(f"{temp} == ")
+                yield value
+            write(") ")
+            yield from self.block(body)
+        if node.default_case:
+            if node.cases:
+                write(" else ")
+            yield from self.block(node.default_case)
+        write("\n")
+
+    def select_switch(self, node, temp, cases):
+        write = self.out.write
+        self.indent()
+        write(f"switch ({temp}) {{\n")
+        for value, index in cases.items():
+            self.indent()
+            write(f"case {c_number(value)}: ")
+            yield from self.block(node.cases[index][1])
+            write(" break;\n")
+        if node.default_case:
+            self.indent()
+            write("default: ")
+            yield from self.block(node.default_case)
+            write(" break;\n")
+        self.indent()
+        write("}\n")
+
+    def select_search(self, node, temp, cases):
+        # A tree of comparisons jumps to the case bodies, which follow it
+        write = self.out.write
+        labels = {index: f"{temp}_case_{index}" for index in cases.values()}
+        default = f"{temp}_default" if node.default_case else f"{temp}_end"
+        if node.expr.type is string_type:
+            buckets = {}
+            for text, index in cases.items():
+                buckets.setdefault(string_hash(text), []).append((text, index))
+            self.indent()
+            write(f"uint32_t {temp}_hash = fb_hash({temp});\n")
+            actions = {
+                hash: "".join(f"if (strcmp({temp}, {c_string(text)}) == 0) goto {labels[index]}; " for text, index in bucket) + f"goto {default};"
+                for hash, bucket in buckets.items()
+            }
+            self.search_tree(f"{temp}_hash", sorted(actions.items()), default)
+        else:
+            self.search_tree(temp, sorted((value, f"goto {labels[index]};") for value, index in cases.items()), default)
+
+        for index, label in labels.items():
+            write(f"{label}:\n")
+            self.indent()
+            yield from self.block(node.cases[index][1])
+            write("\n")
+            self.indent()
+            write(f"goto {temp}_end;\n")
+        if node.default_case:
+            write(f"{default}:\n")
+            self.indent()
+            yield from self.block(node.default_case)
+            write("\n")
+        write(f"{temp}_end:;\n")
+
+    def search_tree(self, temp, entries, default):
+        # Binary search over the sorted (value, action) entries, the depth is log2 of their number
+        write = self.out.write
+        if len(entries) <= search_leaf_size:
+            for value, action in entries:
+                self.indent()
+                write(f"if ({temp} == {c_number(value)}) {{ {action} }}\n")
+            self.indent()
+            write(f"goto {default};\n")
+            return
+        middle = len(entries) // 2
+        self.indent()
+        write(f"if ({temp} < {c_number(entries[middle][0])}) {{\n")
+        self.depth += 1
+        self.search_tree(temp, entries[:middle], default)
+        self.depth -= 1
+        self.indent()
+        write("}\n")
+        self.search_tree(temp, entries[middle:], default)
+
+    # Expressions
+
+    def visit_FunctionCallNode(self, node):
+        self.out.write(f"{c_name(node.name)}(")
+        for index, argument in enumerate(node.arguments):
+            if index:
+                self.out.write(", ")
+            yield argument
+        self.out.write(")")
+
+    def visit_BinOpNode(self, node):
+        if node.left.type is string_type and node.op in ("==", "!=", "<", "<=", ">", ">="):
+            self.out.write("(strcmp(")
+            yield node.left
+            self.out.write(", ")
+            yield node.right
+            self.out.write(f") {node.op} 0)")
+            return
+        self.out.write("(")
+        yield node.left
+        self.out.write(f" {c_operators.get(node.op, node.op)} ")
+        yield node.right
+        self.out.write(")")
+
+    def visit_UnaryOpNode(self, node):
+        self.out.write(f"({node.op}")
+        yield node.expr
+        self.out.write(")")
+
+    def visit_NumberNode(self, node):
+        self.out.write(c_number(node.number) if type(node.number) is int else node.value)
+
+    def visit_StringNode(self, node):
+        self.out.write(c_string(node.value))
+
+    def visit_IdentifierNode(self, node):
+        self.out.write(c_name(node.name))
+
+    def visit_HoistedNode(self, node):
+        self.out.write(f"fb_invariant_{node.index}")
+
+    def visit_InductionNode(self, node):
+        self.out.write(f"fb_induction_{node.index}")
+
+    def visit_ArrayAccessNode(self, node):
+        self.out.write(f"{c_name(node.name)}[")
+        yield from self.array_index(node)
+
+    def visit_FieldAccessNode(self, node):
+        yield node.instance
+        self.out.write(f"{'->' if node.instance.type.is_pointer else '.'}{c_name(node.name)}")
+
+    def visit_NewInstanceNode(self, node):
+        instance_type = node.instance_type
+        if node.stack_index is not None:
+            # The variable is made anew every time the new runs, with the defaults
+            target = instance_type.target
+            variable = f"fb_stack_{node.stack_index}"
+            if target.kind is STRUCT:
+                self.out.write(f"({variable} = fb_make_{c_name(target.name)}(), &{variable})")
+            else:
+                self.out.write(f"(({c_type(instance_type)})memset(&{variable}, 0, sizeof {variable}))")
+        elif node.arena is not None:
+            target = instance_type.target
+            if target.kind is STRUCT:
+                self.out.write(f"fb_arena_new_{c_name(target.name)}(")
+                yield node.arena
+                self.out.write(")")
+            else:
+                self.out.write(f"(({c_type(instance_type)})fb_arena_alloc(")
+                yield node.arena
+                self.out.write(f", sizeof({c_type(target)})))")
+        elif instance_type.kind is POINTER:
+            target = instance_type.target
+            if target.kind is STRUCT:
+                self.out.write(f"fb_new_{c_name(target.name)}()")
+            else:
+                self.out.write(f"(({c_type(instance_type)})fb_alloc(sizeof({c_type(target)})))")
+        elif instance_type is arena_type:
+            self.out.write("fb_arena_new()")
+        elif instance_type.kind is STRUCT:
+            self.out.write(f"fb_make_{c_name(instance_type.name)}()")
+        else:
+            self.out.write(f"(({c_type(instance_type)})0)")
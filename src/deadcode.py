@@ -0,0 +1,217 @@
+from nodes import *
+from typesystem import POINTER, STRUCT, PROC
+from visitor import NodeVisitor
+
+def terminates(statement):
+    # True if no path through the statement gets past it
+    stack = [statement]
+    while stack:
+        statement = stack.pop()
+        if type(statement) is ReturnNode:
+            continue
+        if type(statement) is IfNode and statement.false_branch is not None:
+            stack.append(statement.true_branch)
+            stack.append(statement.false_branch)
+            continue
+        return False
+    return True
+
+def has_calls(node):
+    return any(type(child) is FunctionCallNode for child in walk(node))
+
+class DeadCodeEliminator(NodeVisitor):
+    # Removes code that never runs or is never used from an analyzed and folded AST, so
+    # there is less C to generate and to compile. Two steps:
+    #
+    # The visit drops statements after a return and takes the branch of an if whose
+    # condition is constant. The visit method of a statement returns the statement to keep
+    # in its place, None if there is nothing left of it.
+    #
+    # Then the procs, types and globals reachable from the statements of the program are
+    # marked, through the symbols and types the reachable code refers to, and the rest is
+    # removed. A global whose initializer calls a proc is always kept.
+    def __init__(self):
+        self.reached = set() # Symbols of the reachable procs and globals
+        self.types = set() # Reachable struct types
+        self.pending = [] # Reached nodes not scanned yet
+        self.procs = {} # Proc symbol -> ProcNode
+        self.globals = {} # Global symbol -> LetNode or DimNode
+        self.type_nodes = {} # Struct type -> TypeNode
+
+    def eliminate(self, program):
+        self.visit(program)
+        self.mark(program)
+        program.statements = self.unreached_removed(program.statements, self.globals)
+        for proc in self.procs.values():
+            if proc.symbol in self.reached:
+                proc.body_statements = self.unreached_removed(proc.body_statements, {})
+
+    # Unreachable statements and constant branches
+
+    def body(self, statements, declarations):
+        # Statements after one that returns on every path never run, only declarations,
+        # which aren't bound to their place, are kept
+        kept = []
+        returned = False
+        for statement in statements:
+            if returned and type(statement) not in declarations:
+                continue
+            statement = yield statement
+            if statement is not None:
+                kept.append(statement)
+                returned = returned or terminates(statement)
+        return kept
+
+    def single(self, node, kept):
+        # A statement that is the whole body of another one stays, even if nothing is left of it
+        return kept if kept is not None else node
+
+    def visit_ProgramNode(self, node):
+        node.statements = yield from self.body(node.statements, (ProcNode, TypeNode, LetNode, DimNode))
+        return node
+
+    def visit_ProcNode(self, node):
+        node.body_statements = yield from self.body(node.body_statements, (ProcNode, TypeNode))
+        return node
+
+    def visit_IfNode(self, node):
+        if type(node.condition) is NumberNode:
+            branch = node.true_branch if node.condition.number else node.false_branch
+            if branch is None:
+                return None
+            # A declaration stays in the branch, it must not end up in the scope around it
+            if type(branch) is not LetNode and type(branch) is not DimNode:
+                return (yield branch)
+        node.true_branch = self.single(node.true_branch, (yield node.true_branch))
+        if node.false_branch is not None:
+            node.false_branch = self.single(node.false_branch, (yield node.false_branch))
+        return node
+
+    def visit_WhileNode(self, node):
+        if type(node.condition) is NumberNode and not node.condition.number:
+            return None
+        node.body = self.single(node.body, (yield node.body))
+        return node
+
+    def visit_ForNode(self, node):
+        node.loop_body = self.single(node.loop_body, (yield node.loop_body))
+        return node
+
+    def visit_DoWhileNode(self, node):
+        node.body = self.single(node.body, (yield node.body))
+        return node
+
+    def visit_DoUntilNode(self, node):
+        node.body = self.single(node.body, (yield node.body))
+        return node
+
+    def visit_SelectCaseNode(self, node):
+        for index, (value, body) in enumerate(node.cases):
+            node.cases[index] = (value, self.single(body, (yield body)))
+        if node.default_case is not None:
+            node.default_case = self.single(node.default_case, (yield node.default_case))
+        return node
+
+    def visit_statement(self, node):
+        return node
+
+    visit_LetNode = visit_DimNode = visit_AssignmentNode = visit_statement
+    visit_ReturnNode = visit_FreeNode = visit_FunctionCallNode = visit_TypeNode = visit_ErrorNode = visit_statement
+
+    # Reachability
+
+    def mark(self, program):
+        for node in walk(program):
+            if type(node) is ProcNode:
+                self.procs[node.symbol] = node
+            elif type(node) is TypeNode:
+                self.type_nodes[node.struct_type] = node
+        for statement in program.statements:
+            if type(statement) is LetNode or type(statement) is DimNode:
+                self.globals[statement.symbol] = statement
+
+        for statement in program.statements:
+            if type(statement) is ProcNode or type(statement) is TypeNode:
+                continue
+            if type(statement) is LetNode or type(statement) is DimNode:
+                if not has_calls(statement):
+                    continue # Reached through its uses, if any
+                self.reached.add(statement.symbol)
+            self.pending.append(statement)
+
+        while self.pending:
+            self.scan(self.pending.pop())
+
+    def scan(self, root):
+        # Marks what the code of a reached node refers to. Procs and types in it are reached
+        # through their uses, they aren't part of the code around them.
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            node_class = type(node)
+            if node_class is ProcNode or node_class is TypeNode:
+                if node is not root:
+                    continue
+                if node_class is ProcNode:
+                    self.mark_type(node.symbol.type)
+                    stack.extend(node.body_statements)
+                else:
+                    stack.extend(field.default_value for field in node.fields.values() if field.default_value is not None)
+                continue
+
+            symbol = getattr(node, "symbol", None)
+            if symbol is not None:
+                self.reach(symbol)
+            if isinstance(node, ExprNode):
+                self.mark_type(node.type)
+            elif node_class is LetNode or node_class is DimNode:
+                self.mark_type(node.symbol.type)
+
+            for name, how in node_layouts[node_class]:
+                value = getattr(node, name)
+                if how == NODE:
+                    if value is not None:
+                        stack.append(value)
+                elif how == NODES:
+                    stack.extend(value)
+                elif how == PAIRS:
+                    for pair in value:
+                        stack.extend(pair)
+
+    def reach(self, symbol):
+        if symbol in self.reached:
+            return
+        self.reached.add(symbol)
+        node = self.procs.get(symbol) or self.globals.get(symbol)
+        if node is not None:
+            self.pending.append(node)
+
+    def mark_type(self, var_type):
+        # Struct types anywhere in a type, behind pointers and in proc signatures
+        stack = [var_type]
+        while stack:
+            var_type = stack.pop()
+            if var_type is None:
+                continue
+            if var_type.kind is POINTER:
+                stack.append(var_type.target)
+            elif var_type.kind is PROC:
+                stack.extend(var_type.params)
+                stack.append(var_type.return_type)
+            elif var_type.kind is STRUCT and var_type not in self.types:
+                self.types.add(var_type)
+                stack.extend(var_type.fields.values())
+                if var_type in self.type_nodes:
+                    self.pending.append(self.type_nodes[var_type])
+
+    def unreached_removed(self, statements, globals):
+        kept = []
+        for statement in statements:
+            if type(statement) is ProcNode and statement.symbol not in self.reached:
+                continue
+            if type(statement) is TypeNode and statement.struct_type not in self.types:
+                continue
+            if (type(statement) is LetNode or type(statement) is DimNode) and globals.get(statement.symbol) is statement and statement.symbol not in self.reached:
+                continue
+            kept.append(statement)
+        return kept
@@ -0,0 +1,51 @@
+import sys
+
+class CompileError(Exception):
+    # Raised after an error was recorded, to abandon the statement it happened in
+    pass
+
+class Diagnostic:
+    def __init__(self, severity, message, srcpos):
+        self.severity = severity
+        self.message = message
+        self.srcpos = srcpos
+
+    def __repr__(self):
+        return f"[{self.severity}] {self.srcpos.filename}:{self.srcpos.line}:{self.srcpos.column}:\n\t-> {self.message}"
+
+class Diagnostics:
+    # Errors of all compiler stages are collected here instead of exiting on the first one,
+    # so a single run reports everything that is wrong with a program
+    def __init__(self):
+        self.items = []
+        self.error_count = 0
+
+    def error(self, message, srcpos):
+        self.items.append(Diagnostic("error", message, srcpos))
+        self.error_count += 1
+
+    def note(self, message, srcpos):
+        # Information on what the compiler did, not a problem with the program
+        self.items.append(Diagnostic("note", message, srcpos))
+
+    def extend(self, diagnostics):
+        # Adds the diagnostics of another run, like a worker process
+        for diagnostic in diagnostics:
+            self.items.append(diagnostic)
+            if diagnostic.severity == "error":
+                self.error_count += 1
+
+    def has_errors(self):
+        return self.error_count > 0
+
+    def report(self, file=sys.stdout):
+        for diagnostic in sorted(self.items, key=lambda diagnostic: (diagnostic.srcpos.filename, diagnostic.srcpos.line, diagnostic.srcpos.column)):
+            print(diagnostic, file=file)
+        if self.error_count:
+            print(f"{self.error_count} error{'s' if self.error_count != 1 else ''}", file=file)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
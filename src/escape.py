@@ -0,0 +1,245 @@
+from nodes import *
+from visitor import NodeVisitor
+
+class ProcFacts:
+    # How pointers move in one proc, collected by the visit of EscapeAnalyzer
+    def __init__(self, proc):
+        self.proc = proc
+        self.param_indices = {name: index for index, (name, _) in enumerate(proc.params)}
+        self.params = {} # Symbol of a parameter -> its index
+        self.locals = set() # Symbols of the lets and loop variables
+        self.flows = [] # (symbol, expression) of the lets and assignments of local pointers
+        self.escapes = [] # (expression, reason) of pointers that leave the proc
+        self.calls = [] # (proc symbol, proc name, parameter index, argument) of pointer arguments
+        self.sites = [] # NewInstanceNodes that could be on the stack
+
+class EscapeAnalyzer(NodeVisitor):
+    # Finds the instances made by new ptr Type in a proc that never outlive the call of the
+    # proc, the code generator puts them in a variable of the C function instead of a pool.
+    # An instance escapes when a pointer to it is returned, stored in a global, a field or an
+    # array, freed, or passed to a proc that lets the pointer of the parameter escape, or to
+    # a proc pointer. Instances made in a loop or in an arena always stay on the heap, the
+    # variable of an instance is there once per call.
+    #
+    # Pointers are followed through the lets and assignments of local pointers, regardless
+    # of their order. Which parameters escape is found for all procs together, a call can
+    # make a parameter of the caller escape.
+    def __init__(self, diagnostics, report=False):
+        self.diagnostics = diagnostics
+        self.report = report
+        self.source = None
+        self.procs = [] # ProcFacts of every proc
+        self.proc_symbols = set() # Symbols of the procs of the program, other calls go through pointers
+        self.facts = None # ProcFacts of the proc being visited, None in main
+        self.loop_depth = 0
+        self.captured = {} # (proc symbol, parameter index) -> name of the proc, for parameters that escape
+        self.stack = 0
+        self.heap = 0
+
+    def analyze(self, program):
+        self.source = program.source
+        self.proc_symbols = {node.symbol for node in walk(program) if type(node) is ProcNode}
+        self.visit(program)
+
+        # Every proc is solved again when a parameter of a proc it calls turns out to escape
+        callers = {}
+        for facts in self.procs:
+            for callee, _, _, _ in facts.calls:
+                callers.setdefault(callee, []).append(facts)
+        pending = list(self.procs)
+        while pending:
+            facts = pending.pop()
+            escaped = self.escaped(facts)
+            for symbol, index in facts.params.items():
+                key = (facts.proc.symbol, index)
+                if symbol in escaped and key not in self.captured:
+                    self.captured[key] = facts.proc.name
+                    pending.extend(callers.get(facts.proc.symbol, ()))
+
+        for facts in self.procs:
+            escaped = self.escaped(facts)
+            stack_instances = []
+            for site in facts.sites:
+                reason = escaped.get(site)
+                if reason is None:
+                    site.stack_index = self.stack
+                    stack_instances.append(site)
+                    self.stack += 1
+                else:
+                    self.heap += 1
+                if self.report:
+                    place = f"on the stack, it doesn't escape proc '{facts.proc.name}'" if reason is None else f"on the heap, it {reason}"
+                    self.diagnostics.note(f"Instance of '{site.instance_type.target}' allocated {place}", self.source.srcpos(site.offset))
+            facts.proc.stack_instances = stack_instances
+
+    def sources(self, node, holds):
+        # Instances and parameters a pointer expression can point to
+        if node.type is None or not node.type.is_pointer or node.type.is_proc:
+            return ()
+        node_class = type(node)
+        if node_class is NewInstanceNode:
+            return (node,)
+        if node_class is IdentifierNode:
+            return holds.get(node.symbol, ())
+        if node_class is BinOpNode: # Pointer arithmetic stays in the instance
+            return tuple(self.sources(node.left, holds)) + tuple(self.sources(node.right, holds))
+        return ()
+
+    def escaped(self, facts):
+        # Instance or parameter symbol -> why it escapes, for everything that does
+        holds = {symbol: {symbol} for symbol in facts.params}
+        changed = True
+        while changed:
+            changed = False
+            for symbol, expr in facts.flows:
+                held = holds.setdefault(symbol, set())
+                for source in self.sources(expr, holds):
+                    if source not in held:
+                        held.add(source)
+                        changed = True
+
+        escaped = {}
+        for expr, reason in facts.escapes:
+            for source in self.sources(expr, holds):
+                escaped.setdefault(source, reason)
+        for callee, name, index, argument in facts.calls:
+            if (callee, index) in self.captured:
+                for source in self.sources(argument, holds):
+                    escaped.setdefault(source, f"is passed to proc '{name}', which lets it escape")
+        return escaped
+
+    def escape(self, node, reason):
+        if self.facts is not None:
+            self.facts.escapes.append((node, reason))
+
+    def is_local(self, symbol):
+        return symbol in self.facts.locals or symbol in self.facts.params
+
+    # Expressions
+
+    def visit_NewInstanceNode(self, node):
+        if node.arena is not None:
+            yield node.arena
+        elif self.facts is not None and node.instance_type.is_pointer:
+            self.facts.sites.append(node)
+            if self.loop_depth:
+                self.escape(node, "is made in a loop")
+
+    def visit_IdentifierNode(self, node):
+        facts = self.facts
+        if facts is not None and node.name in facts.param_indices and node.symbol not in facts.locals:
+            facts.params[node.symbol] = facts.param_indices[node.name]
+
+    def visit_leaf(self, node):
+        pass
+
+    visit_NumberNode = visit_StringNode = visit_ErrorNode = visit_leaf
+
+    def visit_UnaryOpNode(self, node):
+        yield node.expr
+
+    def visit_BinOpNode(self, node):
+        yield node.left
+        yield node.right
+
+    def visit_FunctionCallNode(self, node):
+        for index, argument in enumerate(node.arguments):
+            yield argument
+            if self.facts is None or argument.type is None or not argument.type.is_pointer:
+                continue
+            if node.symbol in self.proc_symbols:
+                self.facts.calls.append((node.symbol, node.name, index, argument))
+            else:
+                self.escape(argument, f"is passed to '{node.name}'")
+
+    def visit_ArrayAccessNode(self, node):
+        yield node.index
+
+    def visit_FieldAccessNode(self, node):
+        yield node.instance
+
+    # Statements
+
+    def visit_ProgramNode(self, node):
+        yield node.statements
+
+    def visit_ProcNode(self, node):
+        outer = self.facts, self.loop_depth
+        self.facts, self.loop_depth = ProcFacts(node), 0
+        self.procs.append(self.facts)
+        yield node.body_statements
+        self.facts, self.loop_depth = outer
+
+    def visit_TypeNode(self, node):
+        pass # Defaults can't make instances
+
+    def visit_LetNode(self, node):
+        yield node.expr
+        if self.facts is not None:
+            self.facts.locals.add(node.symbol)
+            self.facts.flows.append((node.symbol, node.expr))
+
+    def visit_AssignmentNode(self, node):
+        yield node.var_name
+        yield node.value
+        if self.facts is None:
+            return
+        target = node.var_name
+        if type(target) is IdentifierNode:
+            if self.is_local(target.symbol):
+                self.facts.flows.append((target.symbol, node.value))
+            else:
+                self.escape(node.value, f"is stored in global '{target.name}'")
+        elif type(target) is FieldAccessNode:
+            self.escape(node.value, f"is stored in field '{target.name}'")
+        else:
+            self.escape(node.value, f"is stored in array '{target.name}'")
+
+    def visit_DimNode(self, node):
+        yield node.size
+
+    def visit_ReturnNode(self, node):
+        yield node.value
+        self.escape(node.value, "is returned")
+
+    def visit_FreeNode(self, node):
+        yield node.expr
+        self.escape(node.expr, "is freed")
+
+    def visit_IfNode(self, node):
+        yield node.condition
+        yield [node.true_branch]
+        if node.false_branch:
+            yield [node.false_branch]
+
+    def visit_ForNode(self, node):
+        yield node.start_value
+        yield node.end_value
+        yield node.step_value
+        if self.facts is not None:
+            self.facts.locals.add(node.symbol)
+        self.loop_depth += 1
+        yield [node.loop_body]
+        self.loop_depth -= 1
+
+    def visit_WhileNode(self, node):
+        self.loop_depth += 1
+        yield node.condition
+        yield [node.body]
+        self.loop_depth -= 1
+
+    def visit_DoWhileNode(self, node):
+        self.loop_depth += 1
+        yield [node.body]
+        yield node.condition
+        self.loop_depth -= 1
+
+    visit_DoUntilNode = visit_DoWhileNode
+
+    def visit_SelectCaseNode(self, node):
+        yield node.expr
+        for value, body in node.cases:
+            yield value
+            yield [body]
+        if node.default_case:
+            yield [node.default_case]
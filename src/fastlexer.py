@@ -0,0 +1,106 @@
+import re
+import string
+from diagnostics import Diagnostics
+from sourcepos import SourceFile
+from stringtable import StringTable
+from syntax import Syntax
+from tokentype import Token, TokenType
+
+class FastLexer:
+    # One master pattern for every token class, built from the Syntax tables. Each match
+    # yields (leading blanks, token text), so re.findall slices the whole input in C and
+    # the lexer never steps per character. Lines aren't tracked at all, tokens only carry
+    # their offset. Longer operators must come before their prefix.
+    token_regex = re.compile(
+        r'(\s*)('
+        r'[^\W\d]\w*'           # identifier, keyword or data type
+        r'|\d+(?:\.\d*)?'       # int or float
+        r'|"[^"]*"?'            # string, an unterminated one runs to the end of the input
+        r'|\#[^\n]*'            # comment
+        r'|\s+'                 # trailing blanks at the end of the input
+        + "".join("|" + re.escape(op) for op in sorted(Syntax.operators + Syntax.separators, key=len, reverse=True)) +
+        r'|.)'                  # anything else is reported when it is reached
+    )
+
+    # Token class by first character, non ascii letters and digits go through the slow path
+    char_classes = {
+        **dict.fromkeys(string.ascii_letters + "_", "NAME"),
+        **dict.fromkeys(string.digits, "NUMBER"),
+        **dict.fromkeys("".join(Syntax.operators), TokenType.OPERATOR),
+        **dict.fromkeys("".join(Syntax.separators), TokenType.SEPARATOR),
+        **dict.fromkeys(string.whitespace, "SKIP"),
+        "#": "SKIP",    # Comment
+        '"': "STRING"
+    }
+
+    # Names are classified with one dict lookup, data types win over keywords like in Lexer
+    word_types = {
+        **dict.fromkeys(Syntax.keywords, TokenType.KEYWORD),
+        **dict.fromkeys(Syntax.data_types, TokenType.DATATYPE)
+    }
+
+    def __init__(self, input_code, filename, strings=None, diagnostics=None):
+        self.input_code = input_code
+        self.filename = filename
+        self.source = SourceFile(filename, input_code)
+        self.strings = strings if strings is not None else StringTable()
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        self.position = 0 # Offset right behind the last returned token
+        self.token_iter = self.tokens()
+
+    def error(self, offset, message="Syntax error"):
+        self.diagnostics.error(message, self.source.srcpos(offset, 1))
+
+    def tokens(self):
+        char_classes = self.char_classes
+        word_types = self.word_types
+        intern = self.strings.intern
+        position = 0
+
+        for blanks, text in self.token_regex.findall(self.input_code):
+            start = position + len(blanks)
+            position = start + len(text)
+            kind = char_classes.get(text[0])
+
+            if kind is None:
+                char = text[0]
+                if char.isalpha() or char == "_":
+                    kind = "NAME"
+                elif char.isdigit():
+                    kind = "NUMBER"
+                elif char.isspace():
+                    continue
+                else:
+                    self.error(start, f"unexpected token {char}")
+                    continue # Skip it and go on
+
+            if kind == "SKIP":
+                continue
+
+            self.position = position
+
+            if kind == "NAME":
+                text = intern(text)
+                yield Token(word_types.get(text, TokenType.IDENTIFIER), text, start, position - start)
+            elif kind == "NUMBER":
+                yield Token(TokenType.FLT if "." in text else TokenType.INT, text, start, position - start)
+            elif kind == "STRING":
+                value = text[1:-1] if len(text) > 1 and text[-1] == '"' else text[1:]
+                yield Token(TokenType.STRING, value, start, position - start)
+            else:
+                yield Token(kind, intern(text), start, position - start)
+
+        self.position = position
+        eof = Token(TokenType.EOF, None, position, 0)
+        while True:
+            yield eof
+
+    def get_next_token(self):
+        return next(self.token_iter)
+
+    def tokenize(self):
+        tokens = []
+        for token in self.token_iter:
+            tokens.append(token)
+            if token.type is TokenType.EOF:
+                return tokens
@@ -0,0 +1,111 @@
+from array import array
+from nodes import *
+
+# Node kind codes, the index of the class in this list
+node_kinds = list(node_layouts)
+kind_codes = {node_class: kind for kind, node_class in enumerate(node_kinds)}
+
+class FlatAST:
+    # The AST as parallel typed arrays with one entry per node instead of a graph of
+    # objects. Nodes are stored in post-order, so children always come before their parent
+    # and the root is the last node, a pass that needs the results of the children first
+    # just runs over the arrays from front to back. Node i has the child slots
+    # children[child_starts[i]:child_starts[i + 1]], one per NODE field (-1 for None) and a
+    # count followed by the children per NODES and PAIRS field. Its VALUE fields are the
+    # tuple operand_pool[operands[i]], equal tuples are shared.
+    def __init__(self):
+        self.kinds = array('B')
+        self.offsets = array('i')
+        self.operands = array('i')
+        self.child_starts = array('i', [0])
+        self.children = array('i')
+        self.operand_pool = []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def node_class(self, index):
+        return node_kinds[self.kinds[index]]
+
+    @classmethod
+    def from_tree(cls, root):
+        flat = cls()
+        children = flat.children
+        operand_pool = flat.operand_pool
+        operand_index = {} # Operand tuple -> index in the pool, only needed while building
+        done = [] # Indices of finished nodes whose parent isn't finished yet
+        stack = [(root, None)] # Node and its number of children once they are pushed
+        while stack:
+            node, count = stack.pop()
+            layout = node_layouts[type(node)]
+            if count is None:
+                nested = []
+                for name, how in layout:
+                    value = getattr(node, name)
+                    if how == NODE:
+                        if value is not None:
+                            nested.append(value)
+                    elif how == NODES:
+                        nested.extend(value)
+                    elif how == PAIRS:
+                        for pair in value:
+                            nested.extend(pair)
+                stack.append((node, len(nested)))
+                stack.extend((child, None) for child in reversed(nested))
+                continue
+
+            # The children of this node are the last finished ones, in order
+            found = iter(done[len(done) - count:])
+            del done[len(done) - count:]
+            values = []
+            for name, how in layout:
+                value = getattr(node, name)
+                if how == VALUE:
+                    values.append(value)
+                elif how == NODE:
+                    children.append(next(found) if value is not None else -1)
+                else:
+                    children.append(len(value))
+                    for _ in range(len(value) * (2 if how == PAIRS else 1)):
+                        children.append(next(found))
+
+            done.append(len(flat.kinds))
+            flat.kinds.append(kind_codes[type(node)])
+            flat.offsets.append(node.offset)
+            values = tuple(values)
+            try:
+                operand = operand_index.setdefault(values, len(operand_pool))
+            except TypeError: # Holds a list or dict, those aren't shared
+                operand = len(operand_pool)
+            if operand == len(operand_pool):
+                operand_pool.append(values)
+            flat.operands.append(operand)
+            flat.child_starts.append(len(children))
+        return flat
+
+    def to_tree(self):
+        # Rebuilds the node objects, children are always built before their parent
+        nodes = []
+        children = self.children
+        for index in range(len(self.kinds)):
+            node_class = node_kinds[self.kinds[index]]
+            values = iter(self.operand_pool[self.operands[index]])
+            slot = self.child_starts[index]
+            arguments = []
+            for name, how in node_layouts[node_class]:
+                if how == VALUE:
+                    arguments.append(next(values))
+                elif how == NODE:
+                    arguments.append(nodes[children[slot]] if children[slot] != -1 else None)
+                    slot += 1
+                elif how == NODES:
+                    count = children[slot]
+                    arguments.append([nodes[child] for child in children[slot + 1:slot + 1 + count]])
+                    slot += 1 + count
+                else:
+                    count = children[slot]
+                    pairs = children[slot + 1:slot + 1 + count * 2]
+                    arguments.append([(nodes[pairs[i]], nodes[pairs[i + 1]]) for i in range(0, len(pairs), 2)])
+                    slot += 1 + count * 2
+            nodes.append(node_class(self.offsets[index], *arguments))
+        return nodes[-1]
@@ -0,0 +1,250 @@
+import math
+import struct
+from nodes import *
+from typesystem import int_type
+from visitor import NodeVisitor
+
+def number_text(value):
+    # Literal text of a folded value, floats always get a '.' so they read back as floats
+    if type(value) is int:
+        return str(value)
+    text = repr(value)
+    if '.' not in text:
+        mantissa, exponent = text.split('e')
+        text = f"{mantissa}.0e{exponent}"
+    return text
+
+def c_divide(a, b):
+    # Integer division truncates toward zero like in C, Python's // rounds down
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+def fold_operation(op, a, b):
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == '*':
+        return a * b
+    if op == '/':
+        return c_divide(a, b) if type(a) is int and type(b) is int else a / b
+    if op == '<':
+        return int(a < b)
+    if op == '<=':
+        return int(a <= b)
+    if op == '>':
+        return int(a > b)
+    if op == '>=':
+        return int(a >= b)
+    if op == '==':
+        return int(a == b)
+    if op == '!=':
+        return int(a != b)
+    if op == 'and':
+        return int(bool(a) and bool(b))
+    return int(bool(a) or bool(b))
+
+def converted(value, value_type):
+    # The value as a variable of the type holds it, a float rounded like a C float
+    if not value_type.is_float:
+        return value
+    value = float(value)
+    if value_type.name == "float" and math.isfinite(value):
+        try:
+            value = struct.unpack('f', struct.pack('f', value))[0]
+        except OverflowError:
+            value = math.inf
+    return value
+
+class ConstantFolder(NodeVisitor):
+    # Runs on an analyzed AST and computes what can be computed at compile time. Operations
+    # on constants are replaced by a NumberNode with the result, and so are uses of variables
+    # whose let is never followed by an assignment, in the proc or main body the let is in.
+    # Every folded value is checked against the range of its type, an overflow is an error
+    # here instead of wrapping around at runtime. Like in C, operations on types narrower
+    # than int compute in int, their values are checked when they are stored.
+    #
+    # The visit method of an expression returns its value if it is constant, else None. The
+    # parent replaces a constant child that isn't a literal yet.
+    def __init__(self, diagnostics):
+        self.diagnostics = diagnostics
+        self.source = None
+        self.assigned = set() # Symbols that are assigned somewhere after their declaration
+        self.constants = {} # Symbol of a constant let -> its value and the proc it is in
+        self.proc = None # Proc being folded, None in main
+
+    def report(self, message, node):
+        self.diagnostics.error(message, self.source.srcpos(node.offset))
+
+    def fold(self, program):
+        self.source = program.source
+        self.assigned = {node.var_name.symbol for node in walk(program) if type(node) is AssignmentNode and type(node.var_name) is IdentifierNode}
+        self.visit(program)
+
+    def folded(self, node, value):
+        # The node to keep in the tree for an expression and its constant value
+        if value is None or type(node) is NumberNode:
+            return node
+        literal = NumberNode(node.offset, number_text(value))
+        literal.type = node.type
+        return literal
+
+    def checked(self, value, node):
+        # The value of a folded operation, None if it can't be folded
+        value_type = node.type
+        if value_type is None or not value_type.is_numeric:
+            return None
+        if value_type.is_float:
+            value = converted(value, value_type)
+            if not math.isfinite(value):
+                self.report(f"Constant expression overflows type '{value_type}'", node)
+                return None
+            return value
+        value = int(value)
+        if value_type.range[1] < int_type.range[1]:
+            value_type = int_type
+        return self.stored(value, value_type, node)
+
+    def stored(self, value, target_type, node):
+        # The value of node as a variable of the target type holds it
+        if value is None or not target_type.is_integer:
+            return value
+        min_value, max_value = target_type.range
+        if not min_value <= value <= max_value:
+            self.report(f"Constant expression value '{value}' out of range for type '{target_type}'", node)
+            return None
+        return value
+
+    # Expressions
+
+    def visit_NumberNode(self, node):
+        # A literal of a float type is a float value, rounded to the type
+        return converted(node.number, node.type)
+
+    def visit_StringNode(self, node):
+        return None
+
+    def visit_NewInstanceNode(self, node):
+        if node.arena is not None:
+            yield node.arena
+        return None
+
+    def visit_IdentifierNode(self, node):
+        constant = self.constants.get(node.symbol)
+        if constant is not None and constant[1] is self.proc:
+            return constant[0]
+        return None
+
+    def visit_UnaryOpNode(self, node):
+        value = yield node.expr
+        node.expr = self.folded(node.expr, value)
+        if value is None:
+            return None
+        if node.op == '-':
+            return self.checked(-value, node)
+        if node.op == '+':
+            return self.checked(value, node)
+        return self.checked(int(not value), node)
+
+    def visit_BinOpNode(self, node):
+        left = yield node.left
+        right = yield node.right
+        node.left = self.folded(node.left, left)
+        node.right = self.folded(node.right, right)
+        if left is None or right is None:
+            return None
+        if node.op == '/' and right == 0:
+            self.report("Division by zero in constant expression", node)
+            return None
+        return self.checked(fold_operation(node.op, left, right), node)
+
+    def visit_FunctionCallNode(self, node):
+        params = node.symbol.type.params
+        for index, argument in enumerate(node.arguments):
+            value = self.stored((yield argument), params[index], argument)
+            node.arguments[index] = self.folded(argument, value)
+        return None
+
+    def visit_ArrayAccessNode(self, node):
+        node.index = self.folded(node.index, (yield node.index))
+        return None
+
+    def visit_FieldAccessNode(self, node):
+        yield node.instance
+        return None
+
+    # Statements
+
+    def visit_ProgramNode(self, node):
+        yield node.statements
+
+    def visit_ProcNode(self, node):
+        outer = self.proc
+        self.proc = node
+        yield node.body_statements
+        self.proc = outer
+
+    def visit_TypeNode(self, node):
+        for field in node.fields.values():
+            if field.default_value is not None:
+                value = self.stored((yield field.default_value), field.type, field.default_value)
+                field.default_value = self.folded(field.default_value, value)
+
+    def visit_LetNode(self, node):
+        value = self.stored((yield node.expr), node.var_type, node.expr)
+        node.expr = self.folded(node.expr, value)
+        if value is not None and node.symbol not in self.assigned and node.symbol.type.is_numeric:
+            self.constants[node.symbol] = (converted(value, node.symbol.type), self.proc)
+
+    def visit_AssignmentNode(self, node):
+        if type(node.var_name) is not IdentifierNode:
+            yield node.var_name
+        node.value = self.folded(node.value, self.stored((yield node.value), node.var_name.type, node.value))
+
+    def visit_DimNode(self, node):
+        node.size = self.folded(node.size, (yield node.size))
+
+    def visit_ReturnNode(self, node):
+        value = yield node.value
+        if self.proc is not None:
+            value = self.stored(value, self.proc.return_type, node.value)
+        node.value = self.folded(node.value, value)
+
+    def visit_FreeNode(self, node):
+        yield node.expr
+
+    def visit_IfNode(self, node):
+        node.condition = self.folded(node.condition, (yield node.condition))
+        yield [node.true_branch]
+        if node.false_branch:
+            yield [node.false_branch]
+
+    def visit_ForNode(self, node):
+        node.start_value = self.folded(node.start_value, (yield node.start_value))
+        node.end_value = self.folded(node.end_value, (yield node.end_value))
+        node.step_value = self.folded(node.step_value, (yield node.step_value))
+        yield [node.loop_body]
+
+    def visit_WhileNode(self, node):
+        node.condition = self.folded(node.condition, (yield node.condition))
+        yield [node.body]
+
+    def visit_DoWhileNode(self, node):
+        yield [node.body]
+        node.condition = self.folded(node.condition, (yield node.condition))
+
+    def visit_DoUntilNode(self, node):
+        yield [node.body]
+        node.condition = self.folded(node.condition, (yield node.condition))
+
+    def visit_SelectCaseNode(self, node):
+        node.expr = self.folded(node.expr, (yield node.expr))
+        for index, (value, body) in enumerate(node.cases):
+            value = self.folded(value, (yield value))
+            node.cases[index] = (value, body)
+            yield [body]
+        if node.default_case:
+            yield [node.default_case]
+
+    def visit_ErrorNode(self, node):
+        pass
@@ -0,0 +1,368 @@
+from nodes import *
+from typesystem import int_type
+from visitor import NodeVisitor
+
+# Nodes an inlined body may consist of, none of them changes any state
+pure_node_classes = {NumberNode, StringNode, IdentifierNode, UnaryOpNode, BinOpNode, FieldAccessNode, ArrayAccessNode, FunctionCallNode}
+
+# Node class -> every slot of its instances
+node_slots = {node_class: [slot for cls in reversed(node_class.__mro__) for slot in getattr(cls, "__slots__", ())] for node_class in node_layouts}
+
+def copy_tree(node, offset=None):
+    # Copy of an expression or statement with its annotations, at the given offset if there
+    # is one. Only small trees are copied, see Inliner.cost and LoopOptimizer.unrollable, so
+    # the recursion is bounded.
+    copy = object.__new__(type(node))
+    for slot in node_slots[type(node)]:
+        setattr(copy, slot, getattr(node, slot))
+    if offset is not None:
+        copy.offset = offset
+    for name, how in node_layouts[type(node)]:
+        value = getattr(node, name)
+        if how == NODE:
+            setattr(copy, name, copy_tree(value, offset) if value is not None else None)
+        elif how == NODES:
+            setattr(copy, name, [copy_tree(child, offset) for child in value])
+        elif how == PAIRS:
+            setattr(copy, name, [(copy_tree(first, offset), copy_tree(second, offset)) for first, second in value])
+    return copy
+
+def is_narrow(var_type):
+    # C computes with these as int, a return or a let would cut the result down again
+    return var_type.is_integer and var_type.range is not None and var_type.range[1] < int_type.range[1]
+
+def size(node):
+    return sum(1 for _ in walk(node))
+
+class InlineForm:
+    # A proc that is just an expression: lets and a return of values without side effects
+    def __init__(self, proc, lets, result):
+        self.proc = proc
+        self.params = [name for name, _ in proc.params]
+        self.lets = lets # (name, expr) of the lets in order
+        self.result = result # Expression of the return
+        self.calls = set() # Symbols of the procs it calls
+        self.free_names = set() # Names of the globals and procs it uses
+        self.uses = {} # Parameter name -> number of uses once the lets are substituted
+        self.cost = 0 # Nodes once the lets are substituted
+
+class Inliner(NodeVisitor):
+    # Expands calls of small procs in place, so no C call is left for them and constant
+    # folding, which runs after, sees through them. Only procs whose body is lets followed
+    # by a return of an expression without side effects are inlined, when the expansion costs
+    # at most limit nodes. An argument that the expansion would evaluate more than once counts
+    # for every copy, and arguments with side effects are never moved.
+    #
+    # Expansions are expanded further, a proc isn't inlined into its own expansion, which
+    # stops recursion, and the nesting of expansions is at most depth deep.
+    #
+    # The visit method of an expression returns the node to keep in its place.
+    def __init__(self, limit=16, depth=8):
+        self.limit = limit
+        self.depth = depth
+        self.forms = {} # Proc symbol -> InlineForm
+        self.expanding = [] # Symbols of the procs whose expansion is being visited
+        self.globals = set() # Symbols that are the same everywhere: globals and procs
+        self.declared = set() # Names declared in the C function being visited
+        self.inlined = 0
+
+    def inline(self, program):
+        procs = [node for node in walk(program) if type(node) is ProcNode]
+        self.globals = {proc.symbol for proc in procs}
+        self.globals.update(statement.symbol for statement in program.statements if type(statement) is LetNode or type(statement) is DimNode)
+        for proc in procs:
+            form = self.inline_form(proc)
+            if form is not None:
+                self.forms[proc.symbol] = form
+
+        # A form that calls a proc that has none can have side effects after all
+        changed = True
+        while changed:
+            changed = False
+            for symbol, form in list(self.forms.items()):
+                if any(call not in self.forms for call in form.calls):
+                    del self.forms[symbol]
+                    changed = True
+
+        self.declared = self.declared_names(program.statements, top_level=True)
+        self.visit(program)
+        return self.inlined
+
+    def inline_form(self, proc):
+        body = proc.body_statements
+        if not body or type(body[-1]) is not ReturnNode or any(type(statement) is not LetNode for statement in body[:-1]):
+            return None
+        if body[-1].value.type is not proc.return_type or is_narrow(proc.return_type):
+            return None
+        if any(is_narrow(param_type) for _, param_type in proc.params):
+            return None # The argument would be used without its conversion to the parameter
+        lets = []
+        for let in body[:-1]:
+            if let.symbol.type is not let.expr.type or is_narrow(let.symbol.type):
+                return None
+            lets.append((let.var_name, let.expr))
+        form = InlineForm(proc, lets, body[-1].value)
+
+        # Locals are only valid where the let is, other than globals and procs
+        local = {}
+        for name in form.params:
+            local[name] = None
+        for name, expr in lets + [(None, form.result)]:
+            for node in walk(expr):
+                if type(node) not in pure_node_classes:
+                    return None
+                if type(node) is FunctionCallNode:
+                    if node.symbol not in self.globals or not node.symbol.type.is_proc:
+                        return None
+                    form.calls.add(node.symbol)
+                    form.free_names.add(node.name)
+                elif type(node) is IdentifierNode or type(node) is ArrayAccessNode:
+                    if node.name in local and node.symbol not in self.globals:
+                        continue
+                    if node.symbol not in self.globals:
+                        return None
+                    form.free_names.add(node.name)
+            if name is not None:
+                local[name] = expr
+
+        # Cost and parameter uses of the body with the lets substituted
+        counts = {name: 0 for name in form.params}
+        let_counts = {}
+        for name, expr in lets + [(None, form.result)]:
+            cost = 0
+            uses = dict.fromkeys(form.params, 0)
+            for node in walk(expr):
+                if type(node) is IdentifierNode and node.name in let_counts:
+                    let_cost, let_uses = let_counts[node.name]
+                    cost += let_cost
+                    for param, count in let_uses.items():
+                        uses[param] += count
+                    continue
+                cost += 1
+                if type(node) is IdentifierNode and node.name in uses:
+                    uses[node.name] += 1
+            if cost > self.limit:
+                return None
+            if name is not None:
+                let_counts[name] = (cost, uses)
+            else:
+                form.cost = cost
+                form.uses = uses
+        return form
+
+    def declared_names(self, statements, top_level=False):
+        # Names of the locals of a C function, nested procs are functions of their own
+        names = set()
+        globals = set(statements) if top_level else ()
+        stack = list(statements)
+        while stack:
+            node = stack.pop()
+            node_class = type(node)
+            if node_class is ProcNode:
+                continue
+            if node_class is LetNode and node not in globals:
+                names.add(node.var_name)
+            elif node_class is DimNode and node not in globals:
+                names.add(node.name)
+            elif node_class is ForNode:
+                names.add(node.var_name)
+            for name, how in node_layouts[node_class]:
+                value = getattr(node, name)
+                if how == NODE:
+                    if value is not None and not isinstance(value, ExprNode):
+                        stack.append(value)
+                elif how == PAIRS:
+                    stack.extend(body for _, body in value)
+        return names
+
+    def expansion_cost(self, form, arguments):
+        # Nodes the expansion adds, arguments count once per copy
+        cost = form.cost
+        for name, argument in zip(form.params, arguments):
+            if form.uses[name] == 0:
+                continue
+            cost += (form.uses[name] - 1) * size(argument)
+            if cost > self.limit:
+                return None
+        return cost
+
+    def is_pure(self, node):
+        for child in walk(node):
+            if type(child) not in pure_node_classes:
+                return False
+            if type(child) is FunctionCallNode and child.symbol not in self.forms:
+                return False
+        return True
+
+    def expand(self, form, node):
+        # The body of the proc at the call, every parameter and let used the first time is
+        # the node itself and copied for further uses
+        replacements = dict(zip(form.params, node.arguments))
+        taken = set()
+
+        def substituted(expr):
+            if type(expr) is IdentifierNode and expr.name in replacements:
+                return take(expr.name)
+            copy = copy_tree(expr, node.offset)
+            stack = [copy]
+            while stack:
+                parent = stack.pop()
+                for name, how in node_layouts[type(parent)]:
+                    if how == NODE:
+                        child = getattr(parent, name)
+                        if type(child) is IdentifierNode and child.name in replacements:
+                            setattr(parent, name, take(child.name))
+                        else:
+                            stack.append(child)
+                    elif how == NODES:
+                        children = getattr(parent, name)
+                        for index, child in enumerate(children):
+                            if type(child) is IdentifierNode and child.name in replacements:
+                                children[index] = take(child.name)
+                            else:
+                                stack.append(child)
+            return copy
+
+        def take(name):
+            replacement = replacements[name]
+            if name in taken:
+                return copy_tree(replacement)
+            taken.add(name)
+            return replacement
+
+        for name, expr in form.lets:
+            replacements[name] = substituted(expr)
+        return substituted(form.result)
+
+    def inline_call(self, node):
+        # The form of the proc if this call can be expanded
+        form = self.forms.get(node.symbol)
+        if form is None or node.symbol in self.expanding or len(self.expanding) >= self.depth:
+            return None
+        if form.free_names & self.declared or len(node.arguments) != len(form.params):
+            return None
+        if not all(self.is_pure(argument) for argument in node.arguments):
+            return None
+        if self.expansion_cost(form, node.arguments) is None:
+            return None
+        return form
+
+    # Expressions
+
+    def visit_FunctionCallNode(self, node):
+        # The arguments are expanded first, what is left of them is visited again as part of
+        # the expansion but can't be expanded any further
+        for index, argument in enumerate(node.arguments):
+            node.arguments[index] = yield argument
+        form = self.inline_call(node)
+        if form is None:
+            return node
+        expansion = self.expand(form, node)
+        self.inlined += 1
+        self.expanding.append(node.symbol)
+        expansion = yield expansion
+        self.expanding.pop()
+        return expansion
+
+    def visit_leaf(self, node):
+        return node
+
+    visit_NumberNode = visit_StringNode = visit_IdentifierNode = visit_leaf
+
+    def visit_NewInstanceNode(self, node):
+        if node.arena is not None:
+            node.arena = yield node.arena
+        return node
+
+    def visit_UnaryOpNode(self, node):
+        node.expr = yield node.expr
+        return node
+
+    def visit_BinOpNode(self, node):
+        node.left = yield node.left
+        node.right = yield node.right
+        return node
+
+    def visit_ArrayAccessNode(self, node):
+        node.index = yield node.index
+        return node
+
+    def visit_FieldAccessNode(self, node):
+        node.instance = yield node.instance
+        return node
+
+    # Statements, a call that is a statement keeps its call
+
+    def statement(self, node):
+        if type(node) is FunctionCallNode:
+            for index, argument in enumerate(node.arguments):
+                node.arguments[index] = yield argument
+        else:
+            yield node
+
+    def visit_ProgramNode(self, node):
+        for statement in node.statements:
+            yield from self.statement(statement)
+
+    def visit_ProcNode(self, node):
+        outer = self.declared
+        self.declared = self.declared_names(node.body_statements) | {name for name, _ in node.params}
+        for statement in node.body_statements:
+            yield from self.statement(statement)
+        self.declared = outer
+
+    def visit_TypeNode(self, node):
+        for field in node.fields.values():
+            if field.default_value is not None:
+                field.default_value = yield field.default_value
+
+    def visit_LetNode(self, node):
+        node.expr = yield node.expr
+
+    def visit_AssignmentNode(self, node):
+        node.var_name = yield node.var_name
+        node.value = yield node.value
+
+    def visit_DimNode(self, node):
+        node.size = yield node.size
+
+    def visit_ReturnNode(self, node):
+        node.value = yield node.value
+
+    def visit_FreeNode(self, node):
+        node.expr = yield node.expr
+
+    def visit_IfNode(self, node):
+        node.condition = yield node.condition
+        yield from self.statement(node.true_branch)
+        if node.false_branch:
+            yield from self.statement(node.false_branch)
+
+    def visit_ForNode(self, node):
+        node.start_value = yield node.start_value
+        node.end_value = yield node.end_value
+        node.step_value = yield node.step_value
+        yield from self.statement(node.loop_body)
+
+    def visit_WhileNode(self, node):
+        node.condition = yield node.condition
+        yield from self.statement(node.body)
+
+    def visit_DoWhileNode(self, node):
+        yield from self.statement(node.body)
+        node.condition = yield node.condition
+
+    def visit_DoUntilNode(self, node):
+        yield from self.statement(node.body)
+        node.condition = yield node.condition
+
+    def visit_SelectCaseNode(self, node):
+        node.expr = yield node.expr
+        for index, (value, body) in enumerate(node.cases):
+            node.cases[index] = ((yield value), body)
+            yield from self.statement(body)
+        if node.default_case:
+            yield from self.statement(node.default_case)
+
+    def visit_ErrorNode(self, node):
+        pass
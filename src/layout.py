@@ -0,0 +1,129 @@
+from nodes import TypeNode, walk
+from typesystem import PRIMITIVE, STRUCT
+
+# Bytes of the C types of the primitives on the 64 bit targets the generated code is compiled
+# for, each is aligned to its size. Strings and arenas are pointers.
+primitive_sizes = {
+    "void": 1,
+    "char": 1,
+    "uchar": 1,
+    "short": 2,
+    "ushort": 2,
+    "int": 4,
+    "uint": 4,
+    "long": 8,
+    "ulong": 8,
+    "size": 8,
+    "float": 4,
+    "double": 8,
+    "string": 8,
+    "arena": 8,
+}
+
+pointer_size = 8
+
+# A record the program uses a lot should fit in one
+cache_line_size = 64
+
+def definition_order(structs):
+    # Structs held by value in another one have to be defined, and laid out, before it
+    ordered = []
+    done = set()
+    for struct in structs:
+        stack = [(struct, iter(struct.fields.values()))]
+        while stack:
+            current, fields = stack[-1]
+            for field_type in fields:
+                if field_type.kind is STRUCT and field_type not in done and all(field_type is not entry for entry, _ in stack):
+                    stack.append((field_type, iter(field_type.fields.values())))
+                    break
+            else:
+                stack.pop()
+                if current not in done:
+                    done.add(current)
+                    ordered.append(current)
+    return ordered
+
+def aligned(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+class StructLayout:
+    # Where the fields of a struct are in memory
+    def __init__(self, fields, size, alignment, padding, declared_size):
+        self.fields = fields # (name, Type, offset) in memory order
+        self.offsets = {name: offset for name, _, offset in fields}
+        self.size = size
+        self.alignment = alignment
+        self.padding = padding # Bytes between and after the fields
+        self.declared_size = declared_size # Size with the fields in the order of their declaration
+
+class LayoutPlanner:
+    # Computes the C layout of every struct instead of leaving it to the C compiler, which
+    # puts the fields in the order they are declared and pads each to its alignment. The
+    # fields are ordered by alignment, widest first, which leaves padding only at the end.
+    # Fields of equal alignment keep their order. With reorder off every struct keeps the
+    # order of its declaration, for structs that C code shares.
+    #
+    # The code generator declares the fields in the planned order and writes the sizes and
+    # offsets as tables, with a check that the C compiler lays them out the same. With a
+    # report every type gets a note with its size and padding.
+    def __init__(self, reorder=True, diagnostics=None):
+        self.reorder = reorder
+        self.diagnostics = diagnostics
+        self.layouts = {} # Struct Type -> StructLayout
+        self.declared_layouts = {} # Struct Type -> StructLayout with all fields in declared order
+        self.saved = 0 # Bytes the reordering saves, of all types together
+
+    def report(self, program):
+        types = [node for node in walk(program) if type(node) is TypeNode]
+        self.plan([node.struct_type for node in types])
+        for node in types:
+            layout = self.layouts[node.struct_type]
+            message = f"Type '{node.struct_type}' takes {layout.size} bytes, {layout.padding} of them padding"
+            if layout.declared_size != layout.size:
+                message += f", {layout.declared_size} with the fields in declared order"
+            if layout.size > cache_line_size:
+                message += f", more than a {cache_line_size} byte cache line"
+            self.diagnostics.note(message, program.source.srcpos(node.offset))
+
+    def plan(self, structs):
+        for struct in definition_order(structs):
+            # The declared order holds for the structs in the fields too
+            declared = self.place([(name, field_type) + self.size_and_alignment(field_type, self.declared_layouts) for name, field_type in struct.fields.items()])
+            self.declared_layouts[struct] = declared
+            if self.reorder:
+                fields = [(name, field_type) + self.size_and_alignment(field_type, self.layouts) for name, field_type in struct.fields.items()]
+                fields.sort(key=lambda field: -field[3])
+                layout = self.place(fields)
+            else:
+                layout = declared
+            layout.declared_size = declared.size
+            self.layouts[struct] = layout
+            self.saved += declared.size - layout.size
+        return self.layouts
+
+    def size_and_alignment(self, field_type, layouts):
+        if field_type.kind is STRUCT:
+            layout = layouts.get(field_type)
+            if layout is None:
+                return 0, 1 # Still being laid out, it contains itself by value, which the semanter reports
+            return layout.size, layout.alignment
+        if field_type.kind is PRIMITIVE:
+            size = primitive_sizes[field_type.name]
+            return size, size
+        return pointer_size, pointer_size # Pointers and procs
+
+    def place(self, fields):
+        # Layout of (name, Type, size, alignment) fields in the given order
+        placed = []
+        offset = 0
+        alignment = 1
+        used = 0
+        for name, field_type, size, field_alignment in fields:
+            offset = aligned(offset, field_alignment)
+            placed.append((name, field_type, offset))
+            offset += size
+            used += size
+            alignment = max(alignment, field_alignment)
+        size = aligned(offset, alignment)
+        return StructLayout(placed, size, alignment, size - used, size)
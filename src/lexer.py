@@ -1,29 +1,26 @@
-import sys
-from sourcepos import SrcPos
+from diagnostics import Diagnostics
+from sourcepos import SourceFile
+from stringtable import StringTable
 from syntax import Syntax
 from tokentype import Token, TokenType
 
 class Lexer:
-    def __init__(self, input_code, filename):
+    def __init__(self, input_code, filename, strings=None, diagnostics=None):
         self.input_code = input_code
         self.filename = filename
+        self.source = SourceFile(filename, input_code)
+        self.strings = strings if strings is not None else StringTable()
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
         self.position = 0
-        self.line = 1   # Lines start at 1
-        self.column = 1 # Columns start at 1
         self.current_char = self.input_code[self.position] if self.input_code else None
     
-    def error(self, srcpos, message="Syntax error"):
-        print(f"error at {srcpos.filename}:{srcpos.line}:{srcpos.column} : {message}")
-        sys.exit()
+    def error(self, offset, message="Syntax error"):
+        self.diagnostics.error(message, self.source.srcpos(offset, 1))
     
     def advance(self):
-        if self.current_char == "\n":
-            self.line += 1
-            self.column = 1  # Reset column to 1 at the start of a new line
-        else:
-            self.column += 1
-        
-        self.position += 1
+        # Stops at the end, like the fast lexer, for an input that ends in a comment or string
+        if self.position < len(self.input_code):
+            self.position += 1
         if self.position < len(self.input_code):
             self.current_char = self.input_code[self.position]
         else:
@@ -34,17 +31,17 @@ class Lexer:
             self.advance()
     
     def get_identifier(self):
-        start_column = self.column
+        start = self.position
         result = ""
         while self.current_char is not None and (self.current_char.isalnum() or self.current_char == "_"):
             result += self.current_char
             self.advance()
-        return result, start_column
+        return self.strings.intern(result), start
 
     def get_number(self):
         result = ""
         is_float = False
-        start_column = self.column
+        start = self.position
         
         while self.current_char is not None and (self.current_char.isdigit() or self.current_char == "."):
             if self.current_char == ".":
@@ -55,17 +52,17 @@ class Lexer:
             self.advance()
         
         token_type = TokenType.FLT if is_float else TokenType.INT
-        return result, start_column, token_type
+        return result, start, token_type
     
     def get_string(self):
-        start_column = self.column
+        start = self.position
         self.advance()  # Skip the opening quote
         result = ""
         while self.current_char is not None and self.current_char != '"':
             result += self.current_char
             self.advance()
         self.advance()  # Skip the closing quote
-        return result, start_column
+        return result, start
     
     def skip_comment(self):
         while self.current_char is not None and self.current_char != "\n":
@@ -83,86 +80,95 @@ class Lexer:
                 continue
             
             if self.current_char.isalpha() or self.current_char == "_":
-                value, start_column = self.get_identifier()
-                token_length = self.column - start_column
+                value, start = self.get_identifier()
+                token_length = self.position - start
                 if value in Syntax.data_types:
-                    return Token(TokenType.DATATYPE, value, SrcPos(self.filename, self.line, start_column, token_length))
+                    return Token(TokenType.DATATYPE, value, start, token_length)
                 if value in Syntax.keywords:
-                    return Token(TokenType.KEYWORD, value, SrcPos(self.filename, self.line, start_column, token_length))
+                    return Token(TokenType.KEYWORD, value, start, token_length)
                 else:
-                    return Token(TokenType.IDENTIFIER, value, SrcPos(self.filename, self.line, start_column, token_length))
+                    return Token(TokenType.IDENTIFIER, value, start, token_length)
             
             # Recognize operators
             if self.current_char == "<":
-                start_column = self.column
+                start = self.position
                 self.advance()
-                token_length = start_column - self.column
+                token_length = self.position - start
                 if self.current_char == "=":
                     self.advance()
-                    token_length = start_column - self.column
-                    return Token(TokenType.OPERATOR, "<=", SrcPos(self.filename, self.line, start_column, token_length))
-                return Token(TokenType.OPERATOR, "<", SrcPos(self.filename, self.line, start_column, token_length))
+                    token_length = self.position - start
+                    return Token(TokenType.OPERATOR, "<=", start, token_length)
+                return Token(TokenType.OPERATOR, "<", start, token_length)
             
             if self.current_char == ">":
-                start_column = self.column
+                start = self.position
                 self.advance()
-                token_length = start_column - self.column
+                token_length = self.position - start
                 if self.current_char == "=":
                     self.advance()
-                    token_length = start_column - self.column
-                    return Token(TokenType.OPERATOR, ">=", SrcPos(self.filename, self.line, start_column, token_length))
-                return Token(TokenType.OPERATOR, ">", SrcPos(self.filename, self.line, start_column, token_length))
+                    token_length = self.position - start
+                    return Token(TokenType.OPERATOR, ">=", start, token_length)
+                return Token(TokenType.OPERATOR, ">", start, token_length)
             
             if self.current_char == "=":
-                start_column = self.column
+                start = self.position
                 self.advance()
-                token_length = start_column - self.column
+                token_length = self.position - start
                 if self.current_char == "=":
                     self.advance()
-                    token_length = start_column - self.column
-                    return Token(TokenType.OPERATOR, "==", SrcPos(self.filename, self.line, start_column, token_length))
-                return Token(TokenType.OPERATOR, "=", SrcPos(self.filename, self.line, start_column, token_length))  # For assignments
+                    token_length = self.position - start
+                    return Token(TokenType.OPERATOR, "==", start, token_length)
+                return Token(TokenType.OPERATOR, "=", start, token_length)  # For assignments
             
             if self.current_char == "!":
-                start_column = self.column
+                start = self.position
                 self.advance()
-                token_length = start_column - self.column
+                token_length = self.position - start
                 if self.current_char == "=":
                     self.advance()
-                    token_length = start_column - self.column
-                    return Token(TokenType.OPERATOR, "!=", SrcPos(self.filename, self.line, start_column, token_length))
-                return Token(TokenType.OPERATOR, "!", SrcPos(self.filename, self.line, start_column, token_length))  # For assignments
+                    token_length = self.position - start
+                    return Token(TokenType.OPERATOR, "!=", start, token_length)
+                return Token(TokenType.OPERATOR, "!", start, token_length)  # For assignments
                     
             
             # Recognize "and" and "or"
             if self.current_char.isalpha():
-                identifier, start_column = self.get_identifier()
-                token_length = self.column - start_column
+                identifier, start = self.get_identifier()
+                token_length = self.position - start
                 if identifier in ["and", "or"]:
-                    return Token(TokenType.KEYWORD, identifier, SrcPos(self.filename, self.line, start_column, token_length))
+                    return Token(TokenType.KEYWORD, identifier, start, token_length)
     
             if self.current_char.isdigit():
-                value, start_column, token_type = self.get_number()
-                token_length = self.column - start_column
-                return Token(token_type, value, SrcPos(self.filename, self.line, start_column, token_length))
+                value, start, token_type = self.get_number()
+                token_length = self.position - start
+                return Token(token_type, value, start, token_length)
             
             if self.current_char == '"':
-                value, start_column = self.get_string()
-                token_length = self.column - start_column + 1  # Include the closing quote
-                return Token(TokenType.STRING, value, SrcPos(self.filename, self.line, start_column, token_length))
+                value, start = self.get_string()
+                token_length = self.position - start  # Including both quotes
+                return Token(TokenType.STRING, value, start, token_length)
             
             if self.current_char in "+-*/=<>:":
-                start_column = self.column
+                start = self.position
                 char = self.current_char
                 self.advance()
-                return Token(TokenType.OPERATOR, char, SrcPos(self.filename, self.line, start_column, 1))
+                return Token(TokenType.OPERATOR, char, start, 1)
             
             if self.current_char in ".(),[]":
-                start_column = self.column
+                start = self.position
                 char = self.current_char
                 self.advance()
-                return Token(TokenType.SEPARATOR, char, SrcPos(self.filename, self.line, start_column, 1))
+                return Token(TokenType.SEPARATOR, char, start, 1)
 
-            self.error(SrcPos(self.filename, self.line, self.column, 1), f"unexpected token {self.current_char}")
+            self.error(self.position, f"unexpected token {self.current_char}")
+            self.advance() # Skip it and go on
         
-        return Token(TokenType.EOF, None, SrcPos(self.filename, self.line, self.column, 0))
+        return Token(TokenType.EOF, None, self.position, 0)
+
+    def tokenize(self):
+        tokens = []
+        while True:
+            token = self.get_next_token()
+            tokens.append(token)
+            if token.type is TokenType.EOF:
+                return tokens
@@ -0,0 +1,434 @@
+from nodes import *
+from inliner import copy_tree, is_narrow, size
+from visitor import NodeVisitor
+
+def put(container, key, value):
+    # Replaces a child, the container is its parent node or the list it is in
+    if type(container) is list:
+        container[key] = value
+    else:
+        setattr(container, key, value)
+
+def expression_key(node):
+    # Equal for expressions that compute the same from the same variables
+    return tuple((type(child), getattr(child, "op", None), getattr(child, "name", None), getattr(child, "value", None), getattr(child, "symbol", None)) for child in walk(node))
+
+def constant_trips(node):
+    # Number of times the body of a for loop with literal bounds runs, None if they aren't
+    numbers = [node.start_value, node.end_value, node.step_value]
+    if any(type(number) is not NumberNode or type(number.number) is not int for number in numbers):
+        return None
+    start, end, step = (number.number for number in numbers)
+    if step == 0:
+        return None
+    return len(range(start, end + (1 if step > 0 else -1), step))
+
+def first_expressions(statement):
+    # Expressions a statement evaluates before anything else it does, they run whenever the
+    # statement runs
+    if isinstance(statement, ExprNode):
+        return [statement]
+    statement_class = type(statement)
+    if statement_class is LetNode:
+        return [statement.expr]
+    if statement_class is AssignmentNode or statement_class is ReturnNode:
+        return [statement.value]
+    if statement_class is DimNode:
+        return [statement.size]
+    if statement_class is IfNode or statement_class is WhileNode:
+        return [statement.condition]
+    if statement_class is ForNode:
+        bounds = [statement.start_value, statement.end_value, statement.step_value]
+        return bounds + first_expressions(statement.loop_body) if (constant_trips(statement) or 0) > 0 else bounds
+    if statement_class is SelectCaseNode:
+        return [statement.expr]
+    if statement_class is DoWhileNode or statement_class is DoUntilNode:
+        return first_expressions(statement.body)
+    if statement_class is BlockNode and statement.statements:
+        return first_expressions(statement.statements[0])
+    return []
+
+class LoopInfo:
+    # What may change while a loop runs
+    def __init__(self):
+        self.variant = set() # Symbols of variables that are assigned or declared in the loop
+        self.assigned = set() # Symbols of variables that are assigned in the loop
+        self.stored_arrays = set() # Symbols of arrays with elements assigned in the loop
+        self.stores_fields = False # A field behind a pointer is assigned in the loop
+        self.calls = False # A proc is called in the loop, it can change globals and the heap
+
+class LoopOptimizer(NodeVisitor):
+    # Makes loops do less work per iteration, on an analyzed AST just before the C is
+    # generated. Three transformations, in two visits of the program:
+    #
+    # A for loop with literal bounds that runs at most unroll_trips times, with a body of
+    # at most unroll_limit nodes altogether, is replaced by a BlockNode with a copy of the
+    # body for every value of the loop variable, which is a literal in the copy. Loops are
+    # unrolled from the inside out, the limit holds for the copies of inner loops too.
+    #
+    # Then for every loop from the outside in: in a for loop with a literal step, array indices of the form i * c + x, where x doesn't
+    # change in the loop, become InductionNodes: a variable that starts at the value of the
+    # index and grows by c * step with the loop variable, so there is no multiplication left.
+    #
+    # Expressions that don't change while the loop runs, like the field chain p.engine.speed
+    # when no field is assigned and no proc called in the loop, become HoistedNodes. They are
+    # computed once before the loop. An expression that could fail, a load through a pointer,
+    # an array access or a division, is only moved if the loop would evaluate it before
+    # anything else anyway. The bounds of a for loop are computed once by the C code already.
+    #
+    # The visit method of a statement returns the statement to keep in its place.
+    def __init__(self, unroll_trips=8, unroll_limit=128):
+        self.unroll_trips = unroll_trips
+        self.unroll_limit = unroll_limit
+        self.globals = set() # Symbols of the global variables and arrays
+        self.count = 0 # Numbers the variables of hoisted and induction expressions
+        self.unrolling = False # Visiting to unroll, else to hoist and reduce
+        self.hoisted = 0
+        self.reduced = 0
+        self.unrolled = 0
+
+    def optimize(self, program):
+        self.globals = {statement.symbol for statement in program.statements if type(statement) is LetNode or type(statement) is DimNode}
+        self.unrolling = True
+        self.visit(program)
+        self.unrolling = False
+        self.visit(program)
+
+    def scan(self, loop):
+        # What the loop changes, None if it has declarations that must stay where they are
+        info = LoopInfo()
+        for node in walk(loop):
+            node_class = type(node)
+            if node_class is ProcNode or node_class is TypeNode:
+                return None
+            if node_class is AssignmentNode:
+                target = node.var_name
+                while type(target) is FieldAccessNode:
+                    if target.instance.type.is_pointer:
+                        info.stores_fields = True
+                        break
+                    target = target.instance
+                if type(target) is IdentifierNode:
+                    info.variant.add(target.symbol)
+                    info.assigned.add(target.symbol)
+                elif type(target) is ArrayAccessNode:
+                    info.stored_arrays.add(target.symbol)
+            elif node_class is ForNode or node_class is LetNode or node_class is DimNode:
+                info.variant.add(node.symbol)
+            elif node_class is FunctionCallNode:
+                info.calls = True
+            elif node_class is FreeNode:
+                info.stores_fields = True # Freed memory is handed out again by the next new
+        return info
+
+    def is_invariant(self, node, info):
+        # True if the expression has the same value in every iteration
+        for child in walk(node):
+            child_class = type(child)
+            if child_class is FunctionCallNode or child_class is NewInstanceNode:
+                return False
+            if child_class is IdentifierNode or child_class is ArrayAccessNode:
+                if child.symbol in info.variant or (info.calls and child.symbol in self.globals):
+                    return False
+                if child_class is ArrayAccessNode and child.symbol in info.stored_arrays:
+                    return False
+            elif child_class is FieldAccessNode and child.instance.type.is_pointer and (info.stores_fields or info.calls):
+                return False
+        return True
+
+    def can_fail(self, node):
+        # True if computing the expression where the loop wouldn't could stop the program
+        for child in walk(node):
+            child_class = type(child)
+            if child_class is ArrayAccessNode:
+                return True
+            if child_class is FieldAccessNode and child.instance.type.is_pointer:
+                return True
+            if child_class is BinOpNode:
+                if child.op == '/' and not child.type.is_float and (type(child.right) is not NumberNode or child.right.number == 0):
+                    return True
+                if child.left.type is not None and child.left.type.name == "string":
+                    return True # strcmp of a string that was never set
+        return False
+
+    def is_worth_hoisting(self, node):
+        # Loads and computations, a variable or literal costs no more than the copy
+        node_class = type(node)
+        if node.type is None or node.type.is_proc or not (node.type.is_numeric or node.type.is_pointer or node.type.name == "string"):
+            return False
+        if node_class is FieldAccessNode:
+            return node.instance.type.is_pointer or type(node.instance) is FieldAccessNode
+        if node_class is ArrayAccessNode:
+            return True
+        if node_class is BinOpNode or node_class is UnaryOpNode:
+            if node_class is UnaryOpNode and (type(node.expr) is NumberNode or type(node.expr) is IdentifierNode):
+                return False
+            # The C arithmetic of narrow and float values can be wider than their type, a
+            # variable of the type would round the result
+            if is_narrow(node.type):
+                return False
+            return not any(isinstance(child, ExprNode) and child.type is not None and child.type.name == "float" for child in walk(node))
+        return False
+
+    # Unrolling
+
+    def unrollable(self, node):
+        trips = constant_trips(node)
+        if trips is None or trips > self.unroll_trips:
+            return False
+        if type(node.loop_body) is LetNode or type(node.loop_body) is DimNode:
+            return False
+        if trips * size(node.loop_body) > self.unroll_limit:
+            return False
+        info = self.scan(node.loop_body)
+        return info is not None and node.symbol not in info.assigned
+
+    def unrolled_copy(self, node, value):
+        # The loop body with the loop variable replaced by its value in this iteration
+        copy = copy_tree(node.loop_body)
+        for parent in list(walk(copy)):
+            for name, how in node_layouts[type(parent)]:
+                if how == NODE:
+                    places = [(parent, name, getattr(parent, name))]
+                elif how == NODES:
+                    children = getattr(parent, name)
+                    places = [(children, index, child) for index, child in enumerate(children)]
+                else:
+                    continue
+                for container, key, child in places:
+                    if type(child) is IdentifierNode and child.symbol is node.symbol:
+                        literal = NumberNode(child.offset, str(value))
+                        literal.type = child.type
+                        put(container, key, literal)
+        return copy
+
+    # Strength reduction
+
+    def reduce(self, node, info):
+        # Replaces index expressions that grow linearly with the loop variable
+        step = node.step_value
+        if type(step) is not NumberNode or type(step.number) is not int or not step.number or node.symbol in info.assigned:
+            return
+        variables = {}
+        for access in list(walk(node.loop_body)):
+            if type(access) is not ArrayAccessNode:
+                continue
+            coefficients = self.coefficients(access.index, node, info)
+            stack = [(access, "index", access.index)]
+            while stack:
+                container, key, expr = stack.pop()
+                if type(expr) is HoistedNode or type(expr) is InductionNode:
+                    continue
+                coefficient, scaled = coefficients.get(id(expr), (None, False))
+                if coefficient and scaled:
+                    # A literal added last stays, i * 4 + 1 and i * 4 + 2 share the variable
+                    while type(expr) is BinOpNode and expr.op in ('+', '-') and type(expr.right) is NumberNode:
+                        container, key, expr = expr, "left", expr.left
+                    put(container, key, self.induction(node, expr, coefficient * step.number, variables))
+                    continue
+                for name, how in node_layouts[type(expr)]:
+                    if how == NODE:
+                        stack.append((expr, name, getattr(expr, name)))
+                    elif how == NODES:
+                        children = getattr(expr, name)
+                        stack.extend((children, index, child) for index, child in enumerate(children))
+
+    def coefficients(self, index, loop, info):
+        # Id of every node of the expression -> how much it grows when the loop variable grows
+        # by one, and if that takes a multiplication. The coefficient is None if the expression
+        # doesn't grow linearly or has parts that can't be computed before the loop.
+        coefficients = {}
+        for node in reversed(list(walk(index))):
+            node_class = type(node)
+            result = (None, False)
+            if node_class is NumberNode:
+                if type(node.number) is int:
+                    result = (0, False)
+            elif node_class is IdentifierNode:
+                if node.symbol is loop.symbol:
+                    result = (1, False)
+                elif node.symbol not in info.variant and not (info.calls and node.symbol in self.globals):
+                    result = (0, False)
+            elif node_class is HoistedNode:
+                result = (0, False)
+            elif node_class is InductionNode:
+                # One of an outer loop doesn't change in this one
+                if all(induction.index != node.index for induction in loop.inductions):
+                    result = (0, False)
+            elif node_class is UnaryOpNode and node.op in ('-', '+'):
+                coefficient, scaled = coefficients[id(node.expr)]
+                if coefficient is not None:
+                    result = (-coefficient if node.op == '-' else coefficient, scaled)
+            elif node_class is BinOpNode and node.op in ('+', '-', '*'):
+                left, left_scaled = coefficients[id(node.left)]
+                right, right_scaled = coefficients[id(node.right)]
+                if left is not None and right is not None:
+                    if node.op == '+':
+                        result = (left + right, left_scaled or right_scaled)
+                    elif node.op == '-':
+                        result = (left - right, left_scaled or right_scaled)
+                    elif left == 0 and right == 0:
+                        result = (0, False)
+                    elif left == 0 and type(node.left) is NumberNode:
+                        result = (node.left.number * right, True)
+                    elif right == 0 and type(node.right) is NumberNode:
+                        result = (left * node.right.number, True)
+            # The variable is an int64_t, the expression must not be computed with wrap around
+            if result[0] is not None and (node.type is None or not node.type.is_integer or node.type.range is None or node.type.range[0] >= 0 or is_narrow(node.type)):
+                result = (None, False)
+            coefficients[id(node)] = result
+        return coefficients
+
+    def induction(self, loop, expr, increment, variables):
+        key = expression_key(expr)
+        first = variables.get(key)
+        if first is None:
+            self.count += 1
+            self.reduced += 1
+            first = variables[key] = InductionNode(expr.offset, expr, self.count, increment)
+            first.type = expr.type
+            loop.inductions = loop.inductions + (first,)
+            return first
+        node = InductionNode(expr.offset, expr, first.index, increment)
+        node.type = expr.type
+        return node
+
+    # Hoisting
+
+    def hoist(self, node, info):
+        # The outermost expressions in the loop that can be computed before it
+        if type(node) is ForNode:
+            places = [(node, "loop_body")]
+            sure = first_expressions(node.loop_body) if (constant_trips(node) or 0) > 0 else []
+        elif type(node) is WhileNode:
+            places = [(node, "condition"), (node, "body")]
+            sure = [node.condition]
+        else:
+            places = [(node, "body"), (node, "condition")]
+            sure = first_expressions(node.body)
+        sure = {id(expr) for expr in sure}
+
+        variables = {}
+        roots = []
+        statements = []
+        for container, key in places:
+            child = getattr(container, key)
+            if isinstance(child, ExprNode):
+                roots.append((container, key, child))
+            else:
+                statements.append(child)
+        while statements:
+            statement = statements.pop()
+            for name, how in node_layouts[type(statement)]:
+                value = getattr(statement, name)
+                if how == NODE and value is not None:
+                    if isinstance(value, ExprNode):
+                        roots.append((statement, name, value))
+                    else:
+                        statements.append(value)
+                elif how == NODES:
+                    statements.extend(value)
+                elif how == PAIRS:
+                    statements.extend(body for _, body in value)
+
+        # What the loop evaluates anyway is on top of the stack, equal expressions elsewhere
+        # in the loop then use the same variable, even if they could fail
+        stack = [(container, key, expr, id(expr) in sure) for container, key, expr in roots]
+        stack.sort(key=lambda entry: entry[3])
+        while stack:
+            container, key, expr, evaluated = stack.pop()
+            if expr is None or type(expr) is HoistedNode or type(expr) is InductionNode:
+                continue # No arena of a new, or already hoisted
+            if self.is_worth_hoisting(expr) and self.is_invariant(expr, info):
+                if evaluated or not self.can_fail(expr) or expression_key(expr) in variables:
+                    put(container, key, self.hoisted_node(node, expr, variables))
+                    continue
+            for name, how in node_layouts[type(expr)]:
+                if how == NODE:
+                    # Only the left operand of and and or is evaluated every time
+                    conditional = type(expr) is BinOpNode and expr.op in ('and', 'or') and name == "right"
+                    stack.append((expr, name, getattr(expr, name), evaluated and not conditional))
+                elif how == NODES:
+                    children = getattr(expr, name)
+                    stack.extend((children, index, child, evaluated) for index, child in enumerate(children))
+
+    def hoisted_node(self, loop, expr, variables):
+        key = expression_key(expr)
+        first = variables.get(key)
+        if first is None:
+            self.count += 1
+            self.hoisted += 1
+            first = variables[key] = HoistedNode(expr.offset, expr, self.count)
+            first.type = expr.type
+            loop.invariants = loop.invariants + (first,)
+            return first
+        node = HoistedNode(expr.offset, expr, first.index)
+        node.type = expr.type
+        return node
+
+    def optimized(self, node):
+        info = self.scan(node)
+        if info is None:
+            return
+        if type(node) is ForNode:
+            self.reduce(node, info)
+        self.hoist(node, info)
+
+    # Statements
+
+    def visit_ProgramNode(self, node):
+        for index, statement in enumerate(node.statements):
+            node.statements[index] = yield statement
+
+    def visit_ProcNode(self, node):
+        for index, statement in enumerate(node.body_statements):
+            node.body_statements[index] = yield statement
+        return node
+
+    def visit_BlockNode(self, node):
+        for index, statement in enumerate(node.statements):
+            node.statements[index] = yield statement
+        return node
+
+    def visit_IfNode(self, node):
+        node.true_branch = yield node.true_branch
+        if node.false_branch is not None:
+            node.false_branch = yield node.false_branch
+        return node
+
+    def visit_SelectCaseNode(self, node):
+        for index, (value, body) in enumerate(node.cases):
+            node.cases[index] = (value, (yield body))
+        if node.default_case is not None:
+            node.default_case = yield node.default_case
+        return node
+
+    def visit_ForNode(self, node):
+        if not self.unrolling:
+            self.optimized(node)
+        node.loop_body = yield node.loop_body
+        if self.unrolling and self.unrollable(node):
+            self.unrolled += 1
+            start, step = node.start_value.number, node.step_value.number
+            return BlockNode(node.offset, [self.unrolled_copy(node, start + trip * step) for trip in range(constant_trips(node))])
+        return node
+
+    def visit_WhileNode(self, node):
+        if not self.unrolling:
+            self.optimized(node)
+        node.body = yield node.body
+        return node
+
+    def visit_DoWhileNode(self, node):
+        if not self.unrolling:
+            self.optimized(node)
+        node.body = yield node.body
+        return node
+
+    visit_DoUntilNode = visit_DoWhileNode
+
+    def visit_statement(self, node):
+        return node
+
+    visit_LetNode = visit_DimNode = visit_AssignmentNode = visit_statement
+    visit_ReturnNode = visit_FreeNode = visit_FunctionCallNode = visit_TypeNode = visit_ErrorNode = visit_statement
@@ -1,4 +1,17 @@
+import argparse
+import sys
+from astprinter import ASTPrinter
+from boundscheck import BoundsChecker
+from codegen import CodeGenerator
+from deadcode import DeadCodeEliminator
+from diagnostics import Diagnostics
+from escape import EscapeAnalyzer
+from folder import ConstantFolder
+from inliner import Inliner
+from layout import LayoutPlanner
 from lexer import Lexer
+from loops import LoopOptimizer
+from fastlexer import FastLexer
 from parser import Parser
 from semanter import Semanter
 
@@ -87,16 +100,90 @@ let myProcPtr: ptr size = myProc
 myProcPtr()
 """
 
-# Set up the lexer, parser, and semantic analyzer
-lexer = Lexer(input_code5, "test.mb")
-parser = Parser(lexer)
+lexers = {
+    "classic": Lexer,
+    "fast": FastLexer
+}
+
+arg_parser = argparse.ArgumentParser(description="FlatBasic compiler")
+arg_parser.add_argument("file", nargs="?", help="source file to compile, the built-in example is used if omitted")
+arg_parser.add_argument("--lexer", choices=lexers.keys(), default="classic", help="lexer implementation to use")
+arg_parser.add_argument("--ast-format", choices=["text", "json", "sexpr"], default="text", help="format of the printed AST")
+arg_parser.add_argument("--nonrecursive", action="store_true", help="parse expressions with an explicit stack, for deeply nested programs")
+arg_parser.add_argument("--jobs", type=int, default=1, help="processes that check proc bodies in parallel")
+arg_parser.add_argument("-o", "--output", help="write the program translated to C to this file")
+arg_parser.add_argument("--bounds-report", action="store_true", help="note for every array access whether its bounds check is kept")
+arg_parser.add_argument("--escape-report", action="store_true", help="note for every new in a proc whether the instance is on the stack or the heap")
+arg_parser.add_argument("--keep-field-order", action="store_true", help="lay out the fields of structs in declared order, for structs shared with C code")
+arg_parser.add_argument("--layout-report", action="store_true", help="note the size and padding of every type")
+args = arg_parser.parse_args()
+
+if args.file:
+    with open(args.file) as source_file:
+        input_code, filename = source_file.read(), args.file
+else:
+    input_code, filename = input_code5, "test.mb"
+
+# Set up the lexer, parser, and semantic analyzer, all stages report into the same diagnostics
+diagnostics = Diagnostics()
+lexer = lexers[args.lexer](input_code, filename, diagnostics=diagnostics)
+parser = Parser(lexer, nonrecursive=args.nonrecursive)
 ast = parser.parse()
 
 # Print the AST for visual confirmation
-print(ast)
+ASTPrinter(sys.stdout, args.ast_format).print(ast)
 
-# Perform semantic analysis
-semanter = Semanter()
+# Perform semantic analysis, statements that failed to parse are skipped
+semanter = Semanter(diagnostics, jobs=args.jobs)
 semanter.analyze(ast)
 
+if diagnostics.has_errors():
+    diagnostics.report()
+    sys.exit(1)
+
 print("Semantic analysis completed successfully.")
+
+# Expand calls of small procs, what they compute can then be folded at the call
+Inliner().inline(ast)
+
+# Compute what is constant before the program is translated
+ConstantFolder(diagnostics).fold(ast)
+if diagnostics.has_errors():
+    diagnostics.report()
+    sys.exit(1)
+
+# Remove what never runs or is never used, constant conditions are known by now
+DeadCodeEliminator().eliminate(ast)
+
+# Prove array indices in bounds, the accesses that can't be proven are checked at runtime
+bounds_checker = BoundsChecker(diagnostics, report=args.bounds_report)
+bounds_checker.check(ast)
+if diagnostics.has_errors():
+    diagnostics.report()
+    sys.exit(1)
+
+# Instances that never leave the proc they are made in go on its stack instead of the heap
+escape_analyzer = EscapeAnalyzer(diagnostics, report=args.escape_report)
+escape_analyzer.analyze(ast)
+
+# The code generator lays out the structs the same way
+if args.layout_report:
+    layout_planner = LayoutPlanner(reorder=not args.keep_field_order, diagnostics=diagnostics)
+    layout_planner.report(ast)
+
+if args.bounds_report or args.escape_report or args.layout_report:
+    diagnostics.report()
+if args.bounds_report:
+    print(f"{bounds_checker.proven} array accesses proven in bounds, {bounds_checker.checked} checked at runtime")
+if args.escape_report:
+    print(f"{escape_analyzer.stack} instances allocated on the stack, {escape_analyzer.heap} on the heap")
+if args.layout_report:
+    print(f"{len(layout_planner.layouts)} types laid out, reordering their fields saves {layout_planner.saved} bytes")
+
+# Move what doesn't change out of loops and unroll the short ones, the last step before C
+LoopOptimizer().optimize(ast)
+
+if args.output:
+    with open(args.output, "w", newline="\n") as output_file:
+        CodeGenerator(output_file, reorder_fields=not args.keep_field_order).generate(ast)
+    print(f"C code written to {args.output}")
@@ -1,322 +1,343 @@
 class ASTNode:
-    pass
+    # Every node class declares __slots__, a node then has no per instance __dict__.
+    # Nodes are the bulk of the compiler's memory on large programs.
+    __slots__ = ("offset",)
 
-class UnaryOpNode(ASTNode):
-    def __init__(self, srcpos, op, expr):
-        self.srcpos = srcpos
+    def __repr__(self):
+        # Only the node itself, ASTPrinter dumps whole trees
+        return f"{type(self).__name__}@{self.offset}"
+
+# The semanter annotates the nodes with its results: every expression with the Type of its
+# value and every node that declares or refers to a name with the Symbol of it. Later passes
+# read these instead of resolving again. They are not fields in node_layouts, a tree rebuilt
+# from a FlatAST has to be analyzed again.
+
+class ExprNode(ASTNode):
+    __slots__ = ("type",)
+
+class UnaryOpNode(ExprNode):
+    __slots__ = ("op", "expr")
+
+    def __init__(self, offset, op, expr):
+        self.offset = offset
         self.op = op
         self.expr = expr
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return f"{ind}UnaryOpNode(\n{ind}  '{self.op}',\n{self.expr.__repr__(indent + 1)}\n{ind})"
+        self.type = None
 
 
-class BinOpNode(ASTNode):
-    def __init__(self, srcpos, left, op, right):
-        self.node_name = "BinOpNode"
-        self.srcpos = srcpos
+class BinOpNode(ExprNode):
+    __slots__ = ("left", "op", "right")
+
+    def __init__(self, offset, left, op, right):
+        self.offset = offset
         self.left = left
         self.op = op
         self.right = right
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return (f"{ind}{self.node_name}(\n"
-                f"{self.left.__repr__(indent + 1)},\n"
-                f"{ind}  '{self.op}',\n"
-                f"{self.right.__repr__(indent + 1)}\n"
-                f"{ind})")
-
-class NumberNode(ASTNode):
-    def __init__(self, srcpos, value):
-        self.node_name = "NumberNode"
-        self.srcpos = srcpos
-        self.value = value
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return f"{ind}{self.node_name}({self.value})"
-
-class IdentifierNode:
-    def __init__(self, srcpos, name, var_type=None, is_pointer=False):
-        self.srcpos = srcpos
+        self.type = None
+
+class NumberNode(ExprNode):
+    __slots__ = ("value", "number")
+
+    def __init__(self, offset, value):
+        self.offset = offset
+        self.value = value # Text of the literal
+        self.number = float(value) if '.' in value else int(value) # Its value, parsed once
+        self.type = None
+
+class IdentifierNode(ExprNode):
+    __slots__ = ("name", "symbol")
+
+    def __init__(self, offset, name):
+        self.offset = offset
         self.name = name
-        self.var_type = var_type
-        self.is_pointer = is_pointer
+        self.type = None
+        self.symbol = None
 
-    def __repr__(self, indent=0):
-        indent_str = '    ' * indent
-        pointer_str = 'ptr ' if self.is_pointer else ''
-        type_str = f": {pointer_str}{self.var_type}" if self.var_type else ''
-        return f"{indent_str}IdentifierNode({self.name}{type_str})"
 
+class StringNode(ExprNode):
+    __slots__ = ("value",)
 
-class StringNode(ASTNode):
-    def __init__(self, srcpos, value):
-        self.node_name = "StringNode"
-        self.srcpos = srcpos
+    def __init__(self, offset, value):
+        self.offset = offset
         self.value = value
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return f"{ind}{self.node_name}(\"{self.value}\")"
-
-class FunctionCallNode(ASTNode):
-    def __init__(self, srcpos, name, arguments):
-        self.node_name = "FunctionCallNode"
-        self.srcpos = srcpos
+        self.type = None
+
+class FunctionCallNode(ExprNode):
+    __slots__ = ("name", "arguments", "symbol")
+
+    def __init__(self, offset, name, arguments):
+        self.offset = offset
         self.name = name
         self.arguments = arguments
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        args = ',\n'.join(arg.__repr__(indent + 1) for arg in self.arguments)
-        return (f"{ind}{self.node_name}(\n"
-                f"{ind}  '{self.name}',\n"
-                f"{ind}  [\n{args}\n{ind}  ]\n"
-                f"{ind})")
+        self.type = None
+        self.symbol = None
 
 class AssignmentNode(ASTNode):
-    def __init__(self, srcpos, var_name, value):
-        self.node_name = "AssignmentNode"
-        self.srcpos = srcpos
+    __slots__ = ("var_name", "value")
+
+    def __init__(self, offset, var_name, value):
+        self.offset = offset
         self.var_name = var_name
         self.value = value
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return (f"{ind}{self.node_name}(\n"
-                f"{ind}  '{self.var_name}',\n"
-                f"{self.value.__repr__(indent + 1)}\n"
-                f"{ind})")
 
 class ArrayAssignmentNode(ASTNode):
-    def __init__(self, srcpos, array_name, index, value):
-        self.node_name = "ArrayAssignmentNode"
-        self.srcpos = srcpos
+    __slots__ = ("array_name", "index", "value", "symbol")
+
+    def __init__(self, offset, array_name, index, value):
+        self.offset = offset
         self.array_name = array_name
         self.index = index
         self.value = value
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return (f"{ind}{self.node_name}(\n"
-                f"{ind}  '{self.array_name}',\n"
-                f"{self.index.__repr__(indent + 1)},\n"
-                f"{self.value.__repr__(indent + 1)}\n"
-                f"{ind})")
-
-class LetNode:
-    def __init__(self, srcpos, var_name, expr, var_type, is_pointer):
-        self.srcpos = srcpos
+        self.symbol = None
+
+class LetNode(ASTNode):
+    __slots__ = ("var_name", "expr", "var_type", "symbol")
+
+    def __init__(self, offset, var_name, expr, var_type):
+        self.offset = offset
         self.var_name = var_name
         self.expr = expr
         self.var_type = var_type
-        self.is_pointer = is_pointer
-
-    def __repr__(self, indent=0):
-        indent_str = '    ' * indent
-        pointer_str = 'ptr ' if self.is_pointer else ''
-        return f"{indent_str}LetNode({self.var_name}: {pointer_str}{self.var_type} = {self.expr.__repr__(indent)})"
+        self.symbol = None
 
 
 
 class IfNode(ASTNode):
-    def __init__(self, srcpos, condition, true_branch, false_branch=None):
-        self.node_name = "IfNode"
-        self.srcpos = srcpos
+    __slots__ = ("condition", "true_branch", "false_branch")
+
+    def __init__(self, offset, condition, true_branch, false_branch=None):
+        self.offset = offset
         self.condition = condition
         self.true_branch = true_branch
         self.false_branch = false_branch
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        result = f"{ind}{self.node_name}(\n{self.condition.__repr__(indent + 1)},\n{self.true_branch.__repr__(indent + 1)}"
-        if self.false_branch:
-            result += f",\n{self.false_branch.__repr__(indent + 1)}"
-        result += f"\n{ind})"
-        return result
 
 class ForNode(ASTNode):
-    def __init__(self, srcpos, var_name, start_value, end_value, step_value, loop_body):
-        self.node_name = "ForNode"
-        self.srcpos = srcpos
+    __slots__ = ("var_name", "start_value", "end_value", "step_value", "loop_body", "symbol", "invariants", "inductions")
+
+    def __init__(self, offset, var_name, start_value, end_value, step_value, loop_body):
+        self.offset = offset
         self.var_name = var_name
         self.start_value = start_value
         self.end_value = end_value
         self.step_value = step_value
         self.loop_body = loop_body
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return (f"{ind}{self.node_name}(\n"
-                f"{ind}  '{self.var_name}',\n"
-                f"{self.start_value.__repr__(indent + 1)},\n"
-                f"{self.end_value.__repr__(indent + 1)},\n"
-                f"{self.step_value.__repr__(indent + 1)},\n"
-                f"{self.loop_body.__repr__(indent + 1)}\n"
-                f"{ind})")
+        self.symbol = None
+        self.invariants = () # HoistedNodes computed before the loop, set by the loop optimizer
+        self.inductions = () # InductionNodes increased with the loop variable, set by the loop optimizer
 
 class WhileNode(ASTNode):
-    def __init__(self, srcpos, condition, body):
-        self.node_name = "WhileNode"
-        self.srcpos = srcpos
+    __slots__ = ("condition", "body", "invariants")
+
+    def __init__(self, offset, condition, body):
+        self.offset = offset
         self.condition = condition
         self.body = body
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return (f"{ind}{self.node_name}(\n"
-                f"{self.condition.__repr__(indent + 1)},\n"
-                f"{self.body.__repr__(indent + 1)}\n"
-                f"{ind})")
+        self.invariants = () # Set by the loop optimizer, see ForNode
 
 class DoWhileNode(ASTNode):
-    def __init__(self, srcpos, body, condition):
-        self.node_name = "DoWhileNode"
-        self.srcpos = srcpos
+    __slots__ = ("body", "condition", "invariants")
+
+    def __init__(self, offset, body, condition):
+        self.offset = offset
         self.body = body
         self.condition = condition
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return (f"{ind}{self.node_name}(\n"
-                f"{self.body.__repr__(indent + 1)},\n"
-                f"{self.condition.__repr__(indent + 1)}\n"
-                f"{ind})")
+        self.invariants = () # Set by the loop optimizer, see ForNode
 
 class DoUntilNode(ASTNode):
-    def __init__(self, srcpos, body, condition):
-        self.node_name = "DoUntilNode"
-        self.srcpos = srcpos
+    __slots__ = ("body", "condition", "invariants")
+
+    def __init__(self, offset, body, condition):
+        self.offset = offset
         self.body = body
         self.condition = condition
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return (f"{ind}{self.node_name}(\n"
-                f"{self.body.__repr__(indent + 1)},\n"
-                f"{self.condition.__repr__(indent + 1)}\n"
-                f"{ind})")
+        self.invariants = () # Set by the loop optimizer, see ForNode
 
 class SelectCaseNode(ASTNode):
-    def __init__(self, srcpos, expr, cases, default_case=None):
-        self.node_name = "SelectCaseNode"
-        self.srcpos = srcpos
+    __slots__ = ("expr", "cases", "default_case")
+
+    def __init__(self, offset, expr, cases, default_case=None):
+        self.offset = offset
         self.expr = expr
         self.cases = cases
         self.default_case = default_case
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        case_repr = '\n'.join(f"{ind}  Case({case[0].__repr__(indent + 1)}):\n{case[1].__repr__(indent + 1)}" for case in self.cases)
-        default_repr = f"{ind}  Default:\n{self.default_case.__repr__(indent + 1)}" if self.default_case else ""
-        return (f"{ind}{self.node_name}(\n"
-                f"{self.expr.__repr__(indent + 1)},\n"
-                f"{case_repr}\n"
-                f"{default_repr}\n"
-                f"{ind})")
 
 class ProcNode(ASTNode):
-    def __init__(self, srcpos, name, params, body_statements, return_type):
-        self.node_name = "ProcNode"
-        self.srcpos = srcpos
+    __slots__ = ("name", "params", "body_statements", "return_type", "symbol", "stack_instances")
+
+    def __init__(self, offset, name, params, body_statements, return_type):
+        self.offset = offset
         self.name = name
-        self.params = params
+        self.params = params # (name, Type) pairs
         self.body_statements = body_statements
         self.return_type = return_type
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        params = ', '.join(f"{name}: {type}" for name, type, _ in self.params)
-        body = '\n'.join(stmt.__repr__(indent + 1) for stmt in self.body_statements)
-        return (f"{ind}{self.node_name}(\n"
-                f"{ind}  '{self.name}',\n"
-                f"{ind}  Params: [{params}],\n"
-                f"{ind}  ReturnType: {self.return_type},\n"
-                f"{ind}  Body:\n{body}\n"
-                f"{ind})")
+        self.symbol = None
+        self.stack_instances = () # NewInstanceNodes on the stack of the proc, set by the escape analyzer
 
 class ReturnNode(ASTNode):
-    def __init__(self, srcpos, value):
-        self.node_name = "ReturnNode"
-        self.srcpos = srcpos
+    __slots__ = ("value",)
+
+    def __init__(self, offset, value):
+        self.offset = offset
         self.value = value
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return f"{ind}{self.node_name}(\n{self.value.__repr__(indent + 1)}\n{ind})"
+
+class FreeNode(ASTNode):
+    # Frees an arena with everything allocated in it, or an instance made without one
+    __slots__ = ("expr",)
+
+    def __init__(self, offset, expr):
+        self.offset = offset
+        self.expr = expr
 
 class DimNode(ASTNode):
-    def __init__(self, srcpos, array_name, size, array_type):
-        self.node_name = "DimNode"
-        self.srcpos = srcpos
+    __slots__ = ("name", "size", "array_type", "symbol")
+
+    def __init__(self, offset, array_name, size, array_type):
+        self.offset = offset
         self.name = array_name
         self.size = size
         self.array_type = array_type
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return (f"{ind}{self.node_name}(\n"
-                f"{ind}  '{self.name}',\n"
-                f"{self.size.__repr__(indent + 1)},\n"
-                f"{ind}  Type: {self.array_type}\n"
-                f"{ind})")
-
-class ArrayAccessNode(ASTNode):
-    def __init__(self, srcpos, array_name, index):
-        self.node_name = "ArrayAccessNode"
-        self.srcpos = srcpos
+        self.symbol = None
+
+class ArrayAccessNode(ExprNode):
+    __slots__ = ("name", "index", "symbol", "in_bounds")
+
+    def __init__(self, offset, array_name, index):
+        self.offset = offset
         self.name = array_name
         self.index = index
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return f"{ind}{self.node_name}(\n{ind}  '{self.name}',\n{self.index.__repr__(indent + 1)}\n{ind})"
+        self.type = None
+        self.symbol = None
+        self.in_bounds = False # Set by the bounds checker if the index can't be out of bounds
 
 class ProgramNode(ASTNode):
-    def __init__(self, srcpos, statements):
-        self.node_name = "ProgramNode"
-        self.srcpos = srcpos
+    __slots__ = ("statements", "source")
+
+    def __init__(self, offset, statements, source):
+        self.offset = offset
         self.statements = statements
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        stmts = '\n'.join(stmt.__repr__(indent + 1) for stmt in self.statements)
-        return f"{ind}{self.node_name}(\n{stmts}\n{ind})"
+        self.source = source # SourceFile the offsets of all nodes refer to
 
 class TypeNode(ASTNode):
-    def __init__(self, type_name, fields):
-        self.type_name = type_name
+    __slots__ = ("struct_type", "fields")
+
+    def __init__(self, offset, struct_type, fields):
+        self.offset = offset
+        self.struct_type = struct_type
         self.fields = fields
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        fields_repr = '\n'.join(
-            f"{ind}  {name}: {symbol.var_type}{' ptr' if symbol.is_pointer else ''}" 
-            for name, symbol in self.fields.items()
-        )
-        return f"{ind}TypeNode({self.type_name})\n{fields_repr}"
-
-
-class NewInstanceNode:
-    def __init__(self, type_name, is_pointer):
-        self.type_name = type_name
-        self.is_pointer = is_pointer
-
-    def __repr__(self, indent=0):
-        indent_str = '    ' * indent
-        pointer_str = 'ptr ' if self.is_pointer else ''
-        return f"{indent_str}NewInstanceNode({pointer_str}{self.type_name})"
-
-class FieldAccessNode(ASTNode):
-    def __init__(self, srcpos, instance, field_name, field_type):
-        self.srcpos = srcpos
+
+
+class NewInstanceNode(ExprNode):
+    __slots__ = ("instance_type", "arena", "stack_index")
+
+    def __init__(self, offset, instance_type, arena=None):
+        self.offset = offset
+        self.instance_type = instance_type
+        self.arena = arena # Expression of the arena the instance is allocated in, or None
+        self.type = None
+        self.stack_index = None # Numbers the variable of an instance that doesn't escape its proc
+
+class FieldAccessNode(ExprNode):
+    __slots__ = ("instance", "name")
+
+    def __init__(self, offset, instance, field_name):
+        self.offset = offset
         self.instance = instance
         self.name = field_name
-        self.field_type = field_type
-    
-    def __repr__(self, indent=0):
-        ind = '    ' * indent
-        return f"{ind}FieldAccessNode(\n{self.instance.__repr__(indent + 1)},\n{ind}  Field: {self.name}:{self.field_type}\n{ind})"
+        self.type = None
+
+class BlockNode(ASTNode):
+    # Statements the loop optimizer puts in place of one, like the copies of the body of an
+    # unrolled loop. They run in order, in a scope of their own. Parsed programs have none.
+    __slots__ = ("statements",)
+
+    def __init__(self, offset, statements):
+        self.offset = offset
+        self.statements = statements
+
+class HoistedNode(ExprNode):
+    # Stands in for a loop invariant expression, which is computed once before the loop. The
+    # HoistedNodes of equal expressions in a loop share the index of their variable.
+    __slots__ = ("expr", "index")
+
+    def __init__(self, offset, expr, index):
+        self.offset = offset
+        self.expr = expr
+        self.index = index
+        self.type = None
+
+class InductionNode(ExprNode):
+    # Stands in for an expression of a for loop variable like i * 4 + 1. It is computed when
+    # the loop starts and increased by increment with every step instead of computed again.
+    __slots__ = ("expr", "index", "increment")
+
+    def __init__(self, offset, expr, index, increment):
+        self.offset = offset
+        self.expr = expr
+        self.index = index
+        self.increment = increment
+        self.type = None
+
+class ErrorNode(ASTNode):
+    # Stands in for a statement that failed to parse
+    __slots__ = ()
+
+    def __init__(self, offset):
+        self.offset = offset
+
+# The fields of every node class in constructor order after the offset and what they
+# hold. Code that walks any kind of node, like FlatAST and ASTPrinter, goes by this table.
+VALUE = 0   # Scalar field
+NODE = 1    # One child node or None
+NODES = 2   # List of child nodes
+PAIRS = 3   # List of child node pairs, like the cases of a select
+
+node_layouts = {
+    UnaryOpNode: (("op", VALUE), ("expr", NODE)),
+    BinOpNode: (("left", NODE), ("op", VALUE), ("right", NODE)),
+    NumberNode: (("value", VALUE),),
+    IdentifierNode: (("name", VALUE),),
+    StringNode: (("value", VALUE),),
+    FunctionCallNode: (("name", VALUE), ("arguments", NODES)),
+    AssignmentNode: (("var_name", NODE), ("value", NODE)),
+    ArrayAssignmentNode: (("array_name", VALUE), ("index", NODE), ("value", NODE)),
+    LetNode: (("var_name", VALUE), ("expr", NODE), ("var_type", VALUE)),
+    IfNode: (("condition", NODE), ("true_branch", NODE), ("false_branch", NODE)),
+    ForNode: (("var_name", VALUE), ("start_value", NODE), ("end_value", NODE), ("step_value", NODE), ("loop_body", NODE)),
+    WhileNode: (("condition", NODE), ("body", NODE)),
+    DoWhileNode: (("body", NODE), ("condition", NODE)),
+    DoUntilNode: (("body", NODE), ("condition", NODE)),
+    SelectCaseNode: (("expr", NODE), ("cases", PAIRS), ("default_case", NODE)),
+    ProcNode: (("name", VALUE), ("params", VALUE), ("body_statements", NODES), ("return_type", VALUE)),
+    ReturnNode: (("value", NODE),),
+    DimNode: (("name", VALUE), ("size", NODE), ("array_type", VALUE)),
+    ArrayAccessNode: (("name", VALUE), ("index", NODE)),
+    ProgramNode: (("statements", NODES), ("source", VALUE)),
+    TypeNode: (("struct_type", VALUE), ("fields", VALUE)),
+    NewInstanceNode: (("instance_type", VALUE), ("arena", NODE)),
+    FieldAccessNode: (("instance", NODE), ("name", VALUE)),
+    ErrorNode: (),
+    BlockNode: (("statements", NODES),),
+    HoistedNode: (("expr", NODE), ("index", VALUE)),
+    InductionNode: (("expr", NODE), ("index", VALUE), ("increment", VALUE)),
+    FreeNode: (("expr", NODE),),
+}
+
+def walk(root):
+    # Every node of a tree in pre-order, children in node_layouts order
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        children = []
+        for name, how in node_layouts[type(node)]:
+            value = getattr(node, name)
+            if how == NODE:
+                if value is not None:
+                    children.append(value)
+            elif how == NODES:
+                children.extend(value)
+            elif how == PAIRS:
+                for pair in value:
+                    children.extend(pair)
+        children.reverse()
+        stack.extend(children)
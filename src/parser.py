@@ -1,25 +1,88 @@
 from symbol import Symbol
-import sys
+from types import GeneratorType
+from diagnostics import CompileError
 from nodes import *
+from syntax import Syntax
 from tokentype import TokenType
+from tokenstream import TokenStream
+from typesystem import primitive_types
+from symboltable import TypeTable
+
+# Statement keyword -> parse method and token type -> factor method. Rules register
+# themselves with the decorators below, so a new statement is just a decorated method.
+statement_rules = {}
+factor_rules = {}
+
+def statement_rule(keyword):
+    def register(method):
+        statement_rules[keyword] = method
+        return method
+    return register
+
+def factor_rule(*token_types):
+    def register(method):
+        for token_type in token_types:
+            factor_rules[token_type] = method
+        return method
+    return register
+
+# Keywords that end a block, error recovery resumes at these and at statement keywords
+block_end_keywords = ["pend", "tend", "endif", "else", "next", "wend", "loop", "case", "end"]
+
+# A broken proc or type header is skipped up to and including its end keyword
+header_end_keywords = {
+    "proc": "pend",
+    "type": "tend"
+}
+
+# Prefix operators bind tighter than any binary operator
+unary_precedence = max(precedence for precedence, _ in Syntax.binary_operators.values()) + 1
+
+class ExpressionFrame:
+    # One open parenthesis, call or index of Parser.expr_iterative
+    def __init__(self, kind, token, name=None):
+        self.kind = kind
+        self.token = token
+        self.name = name
+        self.operands = []
+        self.operators = [] # (precedence, token) pairs, prefix operators use unary_precedence
+        self.arguments = []
+
+    def reduce(self, min_precedence):
+        # Folds the operators that bind at least as tight as min_precedence into nodes
+        operands = self.operands
+        operators = self.operators
+        while operators and operators[-1][0] >= min_precedence:
+            precedence, token = operators.pop()
+            if precedence == unary_precedence:
+                operands.append(UnaryOpNode(token.offset, token.value, operands.pop()))
+            else:
+                right = operands.pop()
+                operands.append(BinOpNode(token.offset, operands.pop(), token.value, right))
 
 class Parser:
-    def __init__(self, lexer):
-        self.lexer = lexer
-        self.current_token = lexer.get_next_token()
-        self.global_symbol_table = {}  # Global scope
-        self.local_symbol_table = None  # Local scope, set within procedures
-        self.user_type_table = {} # Table for user-defined types
+    def __init__(self, lexer, nonrecursive=False):
+        self.nonrecursive = nonrecursive # Parse expressions with an explicit stack
+        self.source = lexer.source
+        self.diagnostics = lexer.diagnostics
+        self.tokens = TokenStream(lexer)
+        self.current_token = self.tokens.next()
+        self.types = TypeTable() # User-defined types, names of variables and procs are resolved by the semanter
     
-    def error(self, message="Syntax error"):
-        print(f"[error] {self.current_token.srcpos.filename}:{self.current_token.srcpos.line}:{self.current_token.srcpos.column}:\n\t-> {message}")
-        sys.exit()
+    def report(self, message, token=None):
+        token = token or self.current_token
+        self.diagnostics.error(message, self.source.srcpos(token.offset, token.length))
+
+    def error(self, message="Syntax error", token=None):
+        # Records the error and abandons the statement, see recover()
+        self.report(message, token)
+        raise CompileError(message)
 
     def advance(self):
-        self.current_token = self.lexer.get_next_token()
+        self.current_token = self.tokens.next()
 
     def eat(self, token_type):
-        if self.current_token.type == token_type:
+        if self.current_token.type is token_type:
             self.advance()
         else:
             self.error(f"Expected token {token_type}, got '{self.current_token.value}' {self.current_token.type}")
@@ -30,161 +93,205 @@ class Parser:
         else:
             self.error(f"Expected token '{token_value}', got '{self.current_token.value}'")
     
-    def declare_variable(self, var_name, var_type, is_pointer=False, scope='global'):
-        symbol_table = self.global_symbol_table if scope == 'global' else self.local_symbol_table
-        if var_name in symbol_table:
-            self.error(f"Variable '{var_name}' already declared in this scope")
-        # Store the variable as a Symbol object
-        symbol_table[var_name] = Symbol(var_type=var_type, is_pointer=is_pointer)
-
-    
-    def parse_field_access(self, instance_name):
-        token = self.current_token
-        instance = IdentifierNode(token.srcpos, instance_name)
+    def parse_type(self, expected):
+        # [ptr] followed by a built-in or user-defined type name, returns the interned Type
+        is_pointer = False
+        if self.current_token.value == "ptr":
+            is_pointer = True
+            self.eat(TokenType.KEYWORD)
 
-        # Determine the type of the initial instance from the local or global scope
-        if self.local_symbol_table is not None and instance_name in self.local_symbol_table:
-            current_symbol = self.local_symbol_table[instance_name]
-        elif instance_name in self.global_symbol_table:
-            current_symbol = self.global_symbol_table[instance_name]
+        if self.current_token.type is TokenType.DATATYPE:
+            var_type = primitive_types[self.current_token.value]
+        elif self.current_token.type is TokenType.IDENTIFIER:
+            var_type = self.types.reference(self.current_token.value, self.current_token.offset)
         else:
-            self.error(f"Variable '{instance_name}' not declared", token)
+            self.error(f"Expected {expected}, got '{self.current_token.value}'")
+        self.advance()
 
-        current_type = current_symbol.var_type
+        return var_type.pointer() if is_pointer else var_type
 
-        while self.current_token.type == TokenType.SEPARATOR and self.current_token.value == '.':
+    
+    def parse_field_access(self, instance_name):
+        # The fields are checked by the semanter, which knows the type of the instance
+        token = self.current_token
+        instance = IdentifierNode(token.offset, instance_name)
+        while self.current_token.type is TokenType.SEPARATOR and self.current_token.value == '.':
             self.eat(TokenType.SEPARATOR)  # Eat '.'
             field_name = self.current_token.value
             self.eat(TokenType.IDENTIFIER)
-
-            # Check if the current_type is a user-defined type and exists in the user_type_table
-            if current_type not in self.user_type_table:
-                self.error(f"Type '{current_type}' is not a user-defined type", token)
-
-            fields = self.user_type_table[current_type]
-            if field_name not in fields:
-                self.error(f"Field '{field_name}' does not exist on type '{current_type}'", token)
-
-            # Update the current type to the type of the field
-            current_type = fields[field_name].var_type  # Get the type of the field
-
-            # Update the instance to the new FieldAccessNode
-            instance = FieldAccessNode(token.srcpos, instance, field_name, current_type)
-
+            instance = FieldAccessNode(token.offset, instance, field_name)
         return instance
     
     def factor(self):
+        # One dict lookup on the token type picks the rule
+        rule = factor_rules.get(self.current_token.type)
+        if rule is None:
+            self.error(f"Unexpected token '{self.current_token.value}'")
+        return rule(self)
+
+    @factor_rule(TokenType.OPERATOR)
+    def parse_unary(self):
         token = self.current_token
-
-        # Handle unary operators
-        if token.type == TokenType.OPERATOR and token.value in ['-', '+', '!']:
-            self.eat(TokenType.OPERATOR)
-            node = self.factor()
-            return UnaryOpNode(token.srcpos, token.value, node)
-    
-        if token.type == TokenType.SEPARATOR and token.value == '(':
-            self.expect('(')  # Eat '('
-            node = self.expr()
-            self.expect(')')
-            return node
-        elif token.type == TokenType.INT or token.type == TokenType.FLT:
-            self.eat(token.type)
-            return NumberNode(token.srcpos, token.value)
-        elif token.type == TokenType.IDENTIFIER:
-            self.eat(TokenType.IDENTIFIER)
-            if self.current_token.type == TokenType.SEPARATOR and self.current_token.value == '.':
-                return self.parse_field_access(token.value)
-            if self.current_token.type == TokenType.SEPARATOR and self.current_token.value == '(':
-                return self.parse_function_call(token.value)
-            if self.current_token.type == TokenType.SEPARATOR and self.current_token.value == '[':
-                self.expect("[")
-                index = self.expr()
-                self.expect("]")
-                return ArrayAccessNode(token.srcpos, token.value, index)
-            return IdentifierNode(token.srcpos, token.value)
-        elif token.type == TokenType.STRING:
-            self.eat(TokenType.STRING)
-            return StringNode(token.srcpos, token.value)
-        else:
+        if token.value not in ['-', '+', '!']:
             self.error(f"Unexpected token '{token.value}'")
-
-
-    def term(self):
+        self.eat(TokenType.OPERATOR)
         node = self.factor()
-        
-        while self.current_token.type == TokenType.OPERATOR and self.current_token.value in '*/':
-            token = self.current_token
-            self.eat(TokenType.OPERATOR)
-            node = BinOpNode(token.srcpos, node, token.value, self.factor())
-        
+        return UnaryOpNode(token.offset, token.value, node)
+
+    @factor_rule(TokenType.SEPARATOR)
+    def parse_parenthesized(self):
+        if self.current_token.value != '(':
+            self.error(f"Unexpected token '{self.current_token.value}'")
+        self.expect('(')  # Eat '('
+        node = self.expr()
+        self.expect(')')
         return node
-    
-    def expr(self):
-        return self.logical_or()
 
-    def additive(self):
-        node = self.term()
-        
-        while self.current_token.type == TokenType.OPERATOR and self.current_token.value in '+-':
-            token = self.current_token
-            self.eat(TokenType.OPERATOR)
-            node = BinOpNode(token.srcpos, node, token.value, self.term())
-        
-        return node
-    
-    def comparison(self):
-        node = self.additive()
-        
-        while self.current_token.type == TokenType.OPERATOR and self.current_token.value in ['<', '<=', '>', '>=']:
-            token = self.current_token
-            self.eat(TokenType.OPERATOR)
-            node = BinOpNode(token.srcpos, node, token.value, self.additive())
-        
-        return node
-    
-    def equality(self):
-        node = self.comparison()
-        
-        while self.current_token.type == TokenType.OPERATOR and self.current_token.value in ['==', '!=']:
+    @factor_rule(TokenType.INT, TokenType.FLT)
+    def parse_number(self):
+        token = self.current_token
+        self.eat(token.type)
+        return NumberNode(token.offset, token.value)
+
+    @factor_rule(TokenType.STRING)
+    def parse_string(self):
+        token = self.current_token
+        self.eat(TokenType.STRING)
+        return StringNode(token.offset, token.value)
+
+    @factor_rule(TokenType.IDENTIFIER)
+    def parse_name(self):
+        token = self.current_token
+        self.eat(TokenType.IDENTIFIER)
+        if self.current_token.type is TokenType.SEPARATOR and self.current_token.value == '.':
+            return self.parse_field_access(token.value)
+        if self.current_token.type is TokenType.SEPARATOR and self.current_token.value == '(':
+            return self.parse_function_call(token.value)
+        if self.current_token.type is TokenType.SEPARATOR and self.current_token.value == '[':
+            self.expect("[")
+            index = self.expr()
+            self.expect("]")
+            return ArrayAccessNode(token.offset, token.value, index)
+        return IdentifierNode(token.offset, token.value)
+
+    def expr(self, min_precedence=1):
+        if self.nonrecursive:
+            return self.expr_iterative()
+
+        # Precedence climbing over Syntax.binary_operators, the factor rule is looked up
+        # inline so a primary costs a single call
+        rule = factor_rules.get(self.current_token.type)
+        if rule is None:
+            self.error(f"Unexpected token '{self.current_token.value}'")
+        node = rule(self)
+        
+        while True:
             token = self.current_token
-            self.eat(TokenType.OPERATOR)
-            node = BinOpNode(token.srcpos, node, token.value, self.comparison())
+            if token.type is not TokenType.OPERATOR and token.type is not TokenType.KEYWORD:
+                break
+            operator = Syntax.binary_operators.get(token.value)
+            if operator is None or operator[0] < min_precedence:
+                break
+            precedence, associativity = operator
+            self.advance()
+            right = self.expr(precedence + 1 if associativity == "left" else precedence)
+            node = BinOpNode(token.offset, node, token.value, right)
         
         return node
     
-    def logical_and(self):
-        node = self.equality()
-        
-        while self.current_token.type == TokenType.KEYWORD and self.current_token.value == 'and':
+    def expr_iterative(self):
+        # Shunting-yard version of expr() for the nonrecursive mode. Parentheses, call arguments
+        # and array indices open a new frame on an explicit stack instead of recursing, so the
+        # nesting depth of an expression only costs heap memory. Builds the same tree as expr().
+        frames = []
+        frame = ExpressionFrame(None, None)
+        while True:
+            # Operand position, prefix operators and openers push state and read on
             token = self.current_token
-            self.eat(TokenType.KEYWORD)
-            node = BinOpNode(token.srcpos, node, token.value, self.equality())
-        
-        return node
+            if token.type is TokenType.OPERATOR and token.value in ['-', '+', '!']:
+                self.advance()
+                frame.operators.append((unary_precedence, token))
+                continue
+            if token.type is TokenType.SEPARATOR and token.value == '(':
+                self.advance()
+                frames.append(frame)
+                frame = ExpressionFrame('(', token)
+                continue
+            if token.type is TokenType.IDENTIFIER:
+                self.advance()
+                next_token = self.current_token
+                if next_token.type is TokenType.SEPARATOR and next_token.value == '(':
+                    self.advance()
+                    if self.current_token.type is TokenType.SEPARATOR and self.current_token.value == ')':
+                        self.advance()
+                        frame.operands.append(FunctionCallNode(next_token.offset, token.value, []))
+                    else:
+                        frames.append(frame)
+                        frame = ExpressionFrame('call', next_token, token.value)
+                        continue
+                elif next_token.type is TokenType.SEPARATOR and next_token.value == '[':
+                    self.advance()
+                    frames.append(frame)
+                    frame = ExpressionFrame('[', token)
+                    continue
+                elif next_token.type is TokenType.SEPARATOR and next_token.value == '.':
+                    frame.operands.append(self.parse_field_access(token.value))
+                else:
+                    frame.operands.append(IdentifierNode(token.offset, token.value))
+            elif token.type is TokenType.INT or token.type is TokenType.FLT:
+                frame.operands.append(self.parse_number())
+            elif token.type is TokenType.STRING:
+                frame.operands.append(self.parse_string())
+            else:
+                self.error(f"Unexpected token '{token.value}'")
 
-    def logical_or(self):
-        node = self.logical_and()
-        
-        while self.current_token.type == TokenType.KEYWORD and self.current_token.value == 'or':
-            token = self.current_token
-            self.eat(TokenType.KEYWORD)
-            node = BinOpNode(token.srcpos, node, token.value, self.logical_and())
-        
-        return node
+            # Operator position, either continue with a binary operator or close frames
+            while True:
+                token = self.current_token
+                operator = None
+                if token.type is TokenType.OPERATOR or token.type is TokenType.KEYWORD:
+                    operator = Syntax.binary_operators.get(token.value)
+                if operator is not None:
+                    precedence, associativity = operator
+                    frame.reduce(precedence if associativity == "left" else precedence + 1)
+                    frame.operators.append((precedence, token))
+                    self.advance()
+                    break
+
+                frame.reduce(0)
+                node = frame.operands.pop()
+                if frame.kind is None:
+                    return node
+                if frame.kind == 'call':
+                    frame.arguments.append(node)
+                    if self.current_token.type is TokenType.SEPARATOR and self.current_token.value == ',':
+                        self.expect(",")  # Eat ','
+                        break
+                    self.expect(")")  # Eat ')'
+                    node = FunctionCallNode(frame.token.offset, frame.name, frame.arguments)
+                elif frame.kind == '[':
+                    self.expect("]")
+                    node = ArrayAccessNode(frame.token.offset, frame.token.value, node)
+                else:
+                    self.expect(")")
+                frame = frames.pop()
+                frame.operands.append(node)
     
+    @statement_rule("if")
     def parse_if(self):
         token = self.current_token
         self.expect("if")  # Eat IF
         condition = self.expr()
         self.expect("then")  # Eat THEN
-        true_branch = self.statement()
+        true_branch = yield
         false_branch = None
-        if self.current_token.type == TokenType.KEYWORD and self.current_token.value == 'else':
+        if self.current_token.type is TokenType.KEYWORD and self.current_token.value == 'else':
             self.expect("else")  # Eat ELSE
-            false_branch = self.statement()
+            false_branch = yield
         self.expect("endif")
-        return IfNode(token.srcpos, condition, true_branch, false_branch)
+        return IfNode(token.offset, condition, true_branch, false_branch)
     
+    @statement_rule("for")
     def parse_for(self):
         token = self.current_token
         self.expect("for")  # Eat FOR
@@ -194,38 +301,41 @@ class Parser:
         start_value = self.expr()
         self.expect("to")  # Eat TO
         end_value = self.expr()
-        step_value = NumberNode(token.srcpos, "1")
-        if self.current_token.type == TokenType.KEYWORD and self.current_token.value == 'step':
+        step_value = NumberNode(token.offset, "1")
+        if self.current_token.type is TokenType.KEYWORD and self.current_token.value == 'step':
             self.expect("step")  # Eat STEP
             step_value = self.expr()
-        loop_body = self.statement()
+        loop_body = yield
         self.expect("next")  # Eat NEXT
-        return ForNode(token.srcpos, var_name, start_value, end_value, step_value, loop_body)
+        return ForNode(token.offset, var_name, start_value, end_value, step_value, loop_body)
 
     
+    @statement_rule("while")
     def parse_while(self):
         token = self.current_token
         self.expect("while")  # Eat WHILE
         condition = self.expr()
-        body = self.statement()
+        body = yield
         self.expect("wend")  # Eat WEND
-        return WhileNode(token.srcpos, condition, body)
+        return WhileNode(token.offset, condition, body)
     
+    @statement_rule("do")
     def parse_do_loop(self):
         token = self.current_token
         self.expect("do")  # Eat DO
-        body = self.statement()
+        body = yield
         self.expect("loop")  # Eat LOOP
-        if self.current_token.type == TokenType.KEYWORD and self.current_token.value == 'while':
+        if self.current_token.type is TokenType.KEYWORD and self.current_token.value == 'while':
             self.expect("while")  # Eat WHILE
             condition = self.expr()
-            return DoWhileNode(token.srcpos, body, condition)
-        elif self.current_token.type == TokenType.KEYWORD and self.current_token.value == 'until':
+            return DoWhileNode(token.offset, body, condition)
+        elif self.current_token.type is TokenType.KEYWORD and self.current_token.value == 'until':
             self.expect("until")  # Eat UNTIL
             condition = self.expr()
-            return DoUntilNode(token.srcpos, body, condition)
+            return DoUntilNode(token.offset, body, condition)
         return body  # Infinite loop if no condition
     
+    @statement_rule("select")
     def parse_select_case(self):
         token = self.current_token
         self.expect("select")  # Eat SELECT
@@ -233,19 +343,22 @@ class Parser:
         expr = self.expr()
         cases = []
         default_case = None
-        while self.current_token.type != TokenType.KEYWORD or self.current_token.value != 'end':
-            if self.current_token.type == TokenType.KEYWORD and self.current_token.value == 'case':
+        while self.current_token.type is not TokenType.KEYWORD or self.current_token.value != 'end':
+            if self.current_token.type is TokenType.KEYWORD and self.current_token.value == 'case':
                 self.expect("case")  # Eat CASE
                 case_value = self.expr()
-                case_body = self.statement()
+                case_body = yield
                 cases.append((case_value, case_body))
-            elif self.current_token.type == TokenType.KEYWORD and self.current_token.value == 'else':
+            elif self.current_token.type is TokenType.KEYWORD and self.current_token.value == 'else':
                 self.expect("else")  # Eat ELSE
-                default_case = self.statement()
+                default_case = yield
+            else:
+                self.error(f"Expected 'case', 'else' or 'end', got '{self.current_token.value}'")
         self.expect("end")  # Eat END
         self.expect("select")  # Eat SELECT
-        return SelectCaseNode(token.srcpos, expr, cases, default_case)
+        return SelectCaseNode(token.offset, expr, cases, default_case)
     
+    @statement_rule("proc")
     def parse_proc(self):
         token = self.current_token
         self.expect("proc")
@@ -253,63 +366,41 @@ class Parser:
         self.eat(TokenType.IDENTIFIER)
         self.expect("(")
         
-        # Local symbol table
-        self.local_symbol_table = {}
-        
         params = []
-        while self.current_token.type != TokenType.SEPARATOR or self.current_token.value != ')':
+        while self.current_token.type is not TokenType.SEPARATOR or self.current_token.value != ')':
             param_name = self.current_token.value
             self.eat(TokenType.IDENTIFIER)
             self.expect(":")
-            
-            is_pointer = False
-            if self.current_token.value == "ptr":
-                is_pointer = True
-                self.eat(TokenType.KEYWORD) # skip ptr keyword
-            
-            # Check if the type is built-in or user-defined
-            if self.current_token.type == TokenType.DATATYPE or self.current_token.value in self.user_type_table:
-                param_type = self.current_token.value
-                self.eat(self.current_token.type)
-            else:
-                self.error(f"Expected a valid type for parameter '{param_name}', got '{self.current_token.value}'")
-            
-            params.append((param_name, param_type, is_pointer))
-            self.declare_variable(param_name, param_type, is_pointer, scope='local')
-            if self.current_token.type == TokenType.SEPARATOR and self.current_token.value == ',':
+            param_type = self.parse_type(f"a valid type for parameter '{param_name}'")
+            params.append((param_name, param_type))
+            if self.current_token.type is TokenType.SEPARATOR and self.current_token.value == ',':
                 self.expect(",")
         self.expect(")")
         self.expect(":")
-
-        is_pointer = False
-        if self.current_token.value == "ptr":
-            is_pointer = True
-            self.eat(TokenType.KEYWORD) # skip ptr keyword, this will be resolved in semant step
-        
-        # Check if the return type is built-in or user-defined
-        if self.current_token.type == TokenType.DATATYPE or self.current_token.value in self.user_type_table:
-            return_type = self.current_token.value
-            self.eat(self.current_token.type)
-        else:
-            self.error(f"Expected a valid return type, got '{self.current_token.value}'")
+        return_type = self.parse_type("a valid return type")
         
         body_statements = []
-        while self.current_token.value != 'pend':
-            body_statements.append(self.statement())
+        while self.current_token.value != 'pend' and self.current_token.type is not TokenType.EOF:
+            body_statements.append((yield))
         
         self.expect("pend")
         
-        # Clear the local scope after the procedure is parsed
-        self.local_symbol_table = None
-        
-        return ProcNode(token.srcpos, name, params, body_statements, return_type)
+        return ProcNode(token.offset, name, params, body_statements, return_type)
 
+    @statement_rule("return")
     def parse_return(self):
         token = self.current_token
         self.expect("return")  # Eat 'return'
         value = self.expr()  # The return value expression
-        return ReturnNode(token.srcpos, value)
+        return ReturnNode(token.offset, value)
     
+    @statement_rule("free")
+    def parse_free(self):
+        token = self.current_token
+        self.expect("free")
+        return FreeNode(token.offset, self.expr())
+
+    @statement_rule("dim")
     def parse_dim(self):
         token = self.current_token
         self.expect("dim")  # Eat DIM
@@ -319,62 +410,44 @@ class Parser:
         size = self.expr()
         self.expect("]")  # Eat ']'
         self.expect(":")  # Eat ':'
-        array_type = self.current_token.value
+        array_type = primitive_types.get(self.current_token.value)
         self.eat(TokenType.DATATYPE)
-        return DimNode(token.srcpos, array_name, size, array_type)
+        return DimNode(token.offset, array_name, size, array_type)
     
     def parse_function_call(self, name):
         token = self.current_token
         self.expect("(")  # Eat '('
         
         arguments = []
-        if self.current_token.type != TokenType.SEPARATOR or self.current_token.value != ')':
+        if self.current_token.type is not TokenType.SEPARATOR or self.current_token.value != ')':
             while True:
                 arguments.append(self.expr())
-                if self.current_token.type == TokenType.SEPARATOR and self.current_token.value == ',':
+                if self.current_token.type is TokenType.SEPARATOR and self.current_token.value == ',':
                     self.expect(",")  # Eat ','
                 else:
                     break
         
         self.expect(")")  # Eat ')'
         
-        return FunctionCallNode(token.srcpos, name, arguments)
+        return FunctionCallNode(token.offset, name, arguments)
     
+    @statement_rule("let")
     def parse_let(self):
         token = self.current_token
         self.expect("let")
         var_name = self.current_token.value
         self.eat(TokenType.IDENTIFIER)
         self.expect(":")
-
-        # Check for pointer type
-        is_pointer = False
-        if self.current_token.value == "ptr":
-            is_pointer = True
-            self.eat(TokenType.KEYWORD)
-        
-        # Check if the type is built-in or user-defined
-        if self.current_token.type == TokenType.DATATYPE or self.current_token.value in self.user_type_table:
-            var_type = self.current_token.value
-            self.eat(self.current_token.type)
-        else:
-            self.error(f"Expected a valid type for variable '{var_name}', got '{self.current_token.value}'")
-
+        var_type = self.parse_type(f"a valid type for variable '{var_name}'")
         self.expect("=")
         
         # Handle new instance creation
-        if self.current_token.type == TokenType.KEYWORD and self.current_token.value == "new":
+        if self.current_token.type is TokenType.KEYWORD and self.current_token.value == "new":
             value = self.parse_new_instance()
         else:
             value = self.expr()
         
-        # Declare the variable in the appropriate scope with pointer flag
-        if self.local_symbol_table is not None:
-            self.declare_variable(var_name, var_type, is_pointer, scope='local')
-        else:
-            self.declare_variable(var_name, var_type, is_pointer, scope='global')
-        
-        return LetNode(token.srcpos, var_name, value, var_type, is_pointer)
+        return LetNode(token.offset, var_name, value, var_type)
 
     def parse_assignment(self):
         token = self.current_token
@@ -382,36 +455,44 @@ class Parser:
         self.eat(TokenType.IDENTIFIER)
         
         # Start with an identifier node
-        node = IdentifierNode(token.srcpos, var_name)
+        node = IdentifierNode(token.offset, var_name)
 
         # Handle array access
-        if self.current_token.type == TokenType.SEPARATOR and self.current_token.value == '[':
+        if self.current_token.type is TokenType.SEPARATOR and self.current_token.value == '[':
             self.eat(TokenType.SEPARATOR)  # Eat the '['
             index_expr = self.expr()  # Parse the index expression
             self.expect(']')  # Expect and consume the ']'
-            node = ArrayAccessNode(token.srcpos, var_name, index_expr)
+            node = ArrayAccessNode(token.offset, var_name, index_expr)
 
         # Handle field access
-        while self.current_token.type == TokenType.SEPARATOR and self.current_token.value == '.':
+        while self.current_token.type is TokenType.SEPARATOR and self.current_token.value == '.':
             self.eat(TokenType.SEPARATOR)
             field_name = self.current_token.value
             self.eat(TokenType.IDENTIFIER)
-            node = FieldAccessNode(token.srcpos, node, field_name, None)
+            node = FieldAccessNode(token.offset, node, field_name)
         
         self.expect("=")
         
         # Handle new instance creation
-        if self.current_token.type == TokenType.KEYWORD and self.current_token.value == "new":
+        if self.current_token.type is TokenType.KEYWORD and self.current_token.value == "new":
             value = self.parse_new_instance()
         else:
             value = self.expr()
         
-        return AssignmentNode(token.srcpos, node, value)
+        return AssignmentNode(token.offset, node, value)
 
+    @statement_rule("type")
     def parse_type_definition(self):
+        token = self.current_token
         self.expect("type")
-        type_name = self.current_token.value
+        name_token = self.current_token
+        type_name = name_token.value
         self.eat(TokenType.IDENTIFIER)
+
+        # Define the type before its fields, so a field can point to its own type
+        struct = self.types.define(type_name)
+        if struct is None:
+            self.error(f"Type '{type_name}' already defined", name_token)
         
         fields = {}
         while self.current_token.value != "tend":
@@ -419,85 +500,96 @@ class Parser:
             field_name = self.current_token.value
             self.eat(TokenType.IDENTIFIER)
             self.expect(":")
-            
-            # Check for pointer type
-            is_pointer = False
-            if self.current_token.value == "ptr":
-                is_pointer = True
-                self.eat(TokenType.KEYWORD)
-            
-            # Check if the type is built-in or user-defined
-            if self.current_token.type == TokenType.DATATYPE or self.current_token.value in self.user_type_table:
-                field_type = self.current_token.value
-                self.eat(self.current_token.type)
-            else:
-                self.error(f"Expected a valid type for field '{field_name}', got '{self.current_token.value}'")
+            field_type = self.parse_type(f"a valid type for field '{field_name}'")
             
             # Handle default values (currently stored for future use)
             default_value = None
-            if self.current_token.type == TokenType.OPERATOR and self.current_token.value == '=':
+            if self.current_token.type is TokenType.OPERATOR and self.current_token.value == '=':
                 self.eat(TokenType.OPERATOR)
                 default_value = self.expr()
             
             # Store the field as a Symbol object in the fields dictionary
-            fields[field_name] = Symbol(var_type=field_type, is_pointer=is_pointer, default_value=default_value)
+            fields[field_name] = Symbol(field_type, default_value)
+            struct.fields[field_name] = field_type
         
         self.expect("tend")
         
-        # Store the type definition in the user_type_table
-        self.user_type_table[type_name] = fields
-        
-        return TypeNode(type_name, fields)
+        return TypeNode(token.offset, struct, fields)
 
 
     def parse_new_instance(self):
+        token = self.current_token
         self.expect("new")
-
-        # Check for pointer type
-        is_pointer = False
-        if self.current_token.value == "ptr":
-            is_pointer = True
-            self.eat(TokenType.KEYWORD)
-
-        type_name = self.current_token.value
-
-        # Check if the type is a user-defined type or a built-in primitive type
-        if type_name not in self.user_type_table and type_name not in self.lexer.data_types:
-            self.error(f"Type '{type_name}' is not defined")
-        
-        self.advance()
-        # self.eat(TokenType.IDENTIFIER)
-
-        return NewInstanceNode(type_name, is_pointer)
+        instance_type = self.parse_type("a defined type")
+        arena = None
+        if self.current_token.type is TokenType.KEYWORD and self.current_token.value == "in":
+            self.expect("in")
+            arena = self.expr()
+        return NewInstanceNode(token.offset, instance_type, arena)
 
 
 
     
     def statement(self):
-        if self.current_token.type == TokenType.KEYWORD:
-            if self.current_token.value == 'let':
-                return self.parse_let()
-            elif self.current_token.value == 'if':
-                return self.parse_if()
-            elif self.current_token.value == 'for':
-                return self.parse_for()
-            elif self.current_token.value == 'while':
-                return self.parse_while()
-            elif self.current_token.value == 'do':
-                return self.parse_do_loop()
-            elif self.current_token.value == 'select':
-                return self.parse_select_case()
-            elif self.current_token.value == 'proc':
-                return self.parse_proc()
-            elif self.current_token.value == 'dim':
-                return self.parse_dim()
-            elif self.current_token.value == 'return':
-                return self.parse_return()
-            elif self.current_token.value == 'type':
-                return self.parse_type_definition()
-        elif self.current_token.type == TokenType.IDENTIFIER:
+        # Rules of statements with a nested body are generators that yield whenever they need
+        # the next nested statement and get it sent back. They are driven from an explicit
+        # stack here, so the nesting depth of blocks doesn't consume Python stack.
+        # A statement that fails to parse becomes an ErrorNode and parsing goes on behind it.
+        stack = []
+        starts = [] # First token of every statement on the stack
+        start = self.current_token
+        try:
+            result = self.start_statement()
+        except CompileError:
+            result = self.recover(start)
+        while True:
+            if isinstance(result, GeneratorType):
+                stack.append(result)
+                starts.append(start)
+                result = None
+            elif not stack:
+                return result
+            try:
+                stack[-1].send(result)
+            except StopIteration as done:
+                stack.pop()
+                starts.pop()
+                result = done.value
+            except CompileError:
+                stack.pop()
+                result = self.recover(starts.pop())
+            else:
+                start = self.current_token
+                try:
+                    result = self.start_statement()
+                except CompileError:
+                    result = self.recover(start)
+
+    def recover(self, start):
+        # Skips the rest of a broken statement up to the next statement keyword or block end.
+        # The first token of the statement is always skipped, so the parser can't get stuck.
+        end = header_end_keywords.get(start.value) if start.type is TokenType.KEYWORD else None
+        while self.current_token.type is not TokenType.EOF:
+            token = self.current_token
+            if token is not start and token.type is TokenType.KEYWORD:
+                if end is not None:
+                    if token.value == end:
+                        self.advance()
+                        break
+                elif token.value in statement_rules or token.value in block_end_keywords:
+                    break
+            self.advance()
+        return ErrorNode(start.offset)
+
+    def start_statement(self):
+        if self.current_token.type is TokenType.KEYWORD:
+            rule = statement_rules.get(self.current_token.value)
+            if rule is not None:
+                return rule(self)
+        elif self.current_token.type is TokenType.IDENTIFIER:
             name = self.current_token.value
-            if self.lexer.input_code[self.lexer.position] == '(':
+            next_token = self.tokens.peek()
+            if next_token.type is TokenType.SEPARATOR and next_token.value == '(':
                 self.eat(TokenType.IDENTIFIER) # name
                 return self.parse_function_call(name)
             else:
@@ -508,7 +600,9 @@ class Parser:
     def parse(self):
         token = self.current_token
         statements = []
-        while self.current_token.type != TokenType.EOF:
+        while self.current_token.type is not TokenType.EOF:
             statements.append(self.statement())
-        return ProgramNode(token.srcpos, statements)
+        for name, offset in self.types.undefined.items():
+            self.diagnostics.error(f"Type '{name}' not defined", self.source.srcpos(offset, len(name)))
+        return ProgramNode(token.offset, statements, self.source)
 
@@ -0,0 +1,153 @@
+/* Runtime of FlatBasic programs. The code generator copies this file to the start of every
+ * C file it writes, so the output compiles on its own. Everything here is static and its
+ * names start with fb_, which FlatBasic names never do in C.
+ *
+ * The library functions the code uses are declared here, the headers that declare them
+ * would take many more names from the program, like index from <string.h>. */
+
+void *calloc(size_t count, size_t size);
+void free(void *memory);
+void abort(void);
+void *memset(void *memory, int value, size_t size);
+int strcmp(const char *a, const char *b);
+
+static inline void *fb_alloc(size_t size)
+{
+    void *memory = calloc(1, size);
+    if (memory == NULL) {
+        abort();
+    }
+    return memory;
+}
+
+static inline uint32_t fb_hash(const char *text)
+{
+    uint32_t hash = 2166136261u;
+    while (*text) {
+        hash = (hash ^ (uint8_t)*text++) * 16777619u;
+    }
+    return hash;
+}
+
+/* An index of an unsigned type that doesn't fit int64_t turns negative and is out of bounds too */
+static inline size_t fb_check(int64_t index, size_t length)
+{
+    if (index < 0 || (uint64_t)index >= length) {
+        abort();
+    }
+    return (size_t)index;
+}
+
+/* Pools and arenas take memory from calloc in blocks of fb_block_size bytes, or one block
+ * for an instance that doesn't fit. Instances are fb_align aligned, no FlatBasic value
+ * needs more. */
+enum { fb_block_size = 64 * 1024, fb_align = 8 };
+
+struct fb_block {
+    struct fb_block *next;
+    size_t size; /* Bytes after the header */
+};
+
+static inline size_t fb_rounded(size_t size)
+{
+    /* Every size is at least a pointer, a free instance of a pool holds the next one */
+    size = (size + fb_align - 1) & ~(size_t)(fb_align - 1);
+    return size < sizeof(void *) ? sizeof(void *) : size;
+}
+
+static inline struct fb_block *fb_block_new(size_t size)
+{
+    struct fb_block *block = fb_alloc(sizeof(struct fb_block) + size);
+    block->size = size;
+    return block;
+}
+
+/* A pool holds the instances of one type made by new without an arena. Freed instances
+ * are kept in a list and handed out again by the next new, before the pool takes more of
+ * its current block. The memory of a pool goes back to the system when the program ends. */
+struct fb_pool {
+    void *free_list;
+    char *next; /* Unused part of the current block */
+    char *end;
+};
+
+static inline void *fb_pool_alloc(struct fb_pool *pool, size_t size)
+{
+    size = fb_rounded(size);
+    void *instance = pool->free_list;
+    if (instance != NULL) {
+        pool->free_list = *(void **)instance;
+        return memset(instance, 0, size);
+    }
+    if ((size_t)(pool->end - pool->next) < size) {
+        struct fb_block *block = fb_block_new(size > fb_block_size ? size : fb_block_size);
+        pool->next = (char *)(block + 1);
+        pool->end = pool->next + block->size;
+    }
+    instance = pool->next;
+    pool->next += size;
+    return instance;
+}
+
+static inline void fb_pool_free(struct fb_pool *pool, void *instance)
+{
+    if (instance != NULL) {
+        *(void **)instance = pool->free_list;
+        pool->free_list = instance;
+    }
+}
+
+/* An arena hands out the memory of its blocks one instance after the other and frees all
+ * of them at once. Freeing keeps the newest block, zeroed, so an arena that is filled and
+ * freed over and over only calls calloc when it needs more than one block. */
+struct fb_arena {
+    struct fb_block *blocks; /* Newest first */
+    char *next;
+    char *end;
+};
+
+static inline struct fb_arena *fb_arena_new(void)
+{
+    return fb_alloc(sizeof(struct fb_arena));
+}
+
+static inline void *fb_arena_grow(struct fb_arena *arena, size_t size)
+{
+    struct fb_block *block = fb_block_new(size > fb_block_size ? size : fb_block_size);
+    block->next = arena->blocks;
+    arena->blocks = block;
+    arena->next = (char *)(block + 1) + size;
+    arena->end = (char *)(block + 1) + block->size;
+    return block + 1;
+}
+
+static inline void *fb_arena_alloc(struct fb_arena *arena, size_t size)
+{
+    if (arena == NULL) {
+        abort(); /* An arena variable that was never set */
+    }
+    size = fb_rounded(size);
+    if ((size_t)(arena->end - arena->next) < size) {
+        return fb_arena_grow(arena, size);
+    }
+    void *instance = arena->next;
+    arena->next += size;
+    return instance;
+}
+
+static inline void fb_arena_free(struct fb_arena *arena)
+{
+    if (arena == NULL || arena->blocks == NULL) {
+        return;
+    }
+    struct fb_block *kept = arena->blocks;
+    struct fb_block *block = kept->next;
+    while (block != NULL) {
+        struct fb_block *next = block->next;
+        free(block);
+        block = next;
+    }
+    memset(kept + 1, 0, (size_t)(arena->next - (char *)(kept + 1)));
+    kept->next = NULL;
+    arena->next = (char *)(kept + 1);
+}
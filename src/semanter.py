@@ -1,448 +1,517 @@
+import io
+import multiprocessing
+import pickle
 from symbol import Symbol
-import sys
+from diagnostics import CompileError, Diagnostics
 from nodes import *
-from syntax import Syntax
-
-class Semanter:
-    def __init__(self):
-        self.global_scope = {}
-        self.local_scope = None
+from symboltable import SymbolTable
+from typesystem import POINTER, STRUCT, int_type, double_type, string_type, void_type, integer_literal_types, promotion, proc_type, proc_pointer_type, arena_type, is_assignable
+from visitor import NodeVisitor
+
+# The semanter the workers of a process pool were forked from, see check_procs_in_pool
+forked_semanter = None
+
+class SharedPickler(pickle.Pickler):
+    # Objects the forked workers share with the main process, like the global symbols, are
+    # pickled as their index in the shared list, so the main process gets its own objects
+    # back instead of copies
+    def __init__(self, file, shared_ids):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.shared_ids = shared_ids
+
+    def persistent_id(self, obj):
+        return self.shared_ids.get(id(obj))
+
+class SharedUnpickler(pickle.Unpickler):
+    def __init__(self, file, shared):
+        super().__init__(file)
+        self.shared = shared
+
+    def persistent_load(self, index):
+        return self.shared[index]
+
+def contains_itself(struct):
+    # True if the struct holds itself by value, in a field or in a field of a field
+    seen = set()
+    pending = [struct]
+    while pending:
+        for field_type in pending.pop().fields.values():
+            if field_type is struct:
+                return True
+            if field_type.kind is STRUCT and field_type not in seen:
+                seen.add(field_type)
+                pending.append(field_type)
+    return False
+
+def check_proc_chunk(chunk):
+    # Runs in a forked worker, which has a copy of the semanter and the whole AST. Sends back
+    # the new diagnostics and the annotations of the nodes of the procs in walk order.
+    semanter = forked_semanter
+    semanter.diagnostics = Diagnostics()
+    annotations = []
+    for proc in semanter.procs[chunk[0]:chunk[1]]:
+        semanter.check_proc(proc)
+        annotations.append([(getattr(node, "type", None), getattr(node, "symbol", None)) for node in walk(proc)])
+    buffer = io.BytesIO()
+    SharedPickler(buffer, semanter.shared_ids).dump((semanter.diagnostics.items, annotations))
+    return buffer.getvalue()
+
+class Semanter(NodeVisitor):
+    def __init__(self, diagnostics=None, jobs=1):
+        self.symbols = None # Names visible at the statement being checked
+        self.source = None
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        self.jobs = jobs # Processes that check proc bodies, 1 checks them in this process
+        self.procs = None # Procs of the program, checked after its statements
+        self.owner = None # Proc being checked, or the program for its statements
+        self.owners = {} # Symbol of a local -> the proc or program it is local to
+
+    def report(self, message, node):
+        # For errors the check can go on after
+        self.diagnostics.error(message, self.source.srcpos(node.offset))
 
     def error(self, message, node):
-        print(f"[error] {node.srcpos.filename}:{node.srcpos.line}:{node.srcpos.column}:\n\t-> {message}")
-        sys.exit()
+        # For errors that leave nothing to go on with, abandons the statement
+        self.report(message, node)
+        raise CompileError(message)
     
     def analyze(self, node):
+        # Phase one declares the procs and globals of the program and checks its statements,
+        # phase two checks the body of each proc on its own against those declarations
+        self.source = node.source
+        self.symbols = SymbolTable()
+        self.procs = [statement for statement in node.statements if type(statement) is ProcNode]
+        self.owner = node
         self.visit(node)
+        if self.jobs > 1 and len(self.procs) > 1 and "fork" in multiprocessing.get_all_start_methods():
+            self.check_procs_in_pool(node)
+        else:
+            for proc in self.procs:
+                self.check_proc(proc)
 
-    def visit(self, node):
-        method_name = f'visit_{type(node).__name__}'
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
+    def check_proc(self, node):
+        try:
+            self.visit(node)
+        except CompileError:
+            pass # Only the body is abandoned, the signature was checked when it was declared
+
+    def check_procs_in_pool(self, node):
+        # Workers are forked, so they start with the AST and the declarations without
+        # pickling them. Without fork (Windows) the procs are checked in this process.
+        global forked_semanter
+        self.shared = [statement.struct_type for statement in node.statements if type(statement) is TypeNode]
+        self.shared.extend(self.symbols.symbols.values())
+        self.shared_ids = {id(obj): index for index, obj in enumerate(self.shared)}
+        count = len(self.procs)
+        chunk_count = min(count, self.jobs * 4) # A few chunks per worker evens out the load
+        chunks = [(count * i // chunk_count, count * (i + 1) // chunk_count) for i in range(chunk_count)]
+        forked_semanter = self
+        try:
+            with multiprocessing.get_context("fork").Pool(self.jobs) as pool:
+                for (start, stop), data in zip(chunks, pool.imap(check_proc_chunk, chunks)):
+                    diagnostics, annotations = SharedUnpickler(io.BytesIO(data), self.shared).load()
+                    self.diagnostics.extend(diagnostics)
+                    for proc, values in zip(self.procs[start:stop], annotations):
+                        for proc_node, (node_type, symbol) in zip(walk(proc), values):
+                            if node_type is not None:
+                                proc_node.type = node_type
+                            if symbol is not None:
+                                proc_node.symbol = symbol
+        finally:
+            forked_semanter = None
+
+    def declare(self, name, symbol, node, message="Variable '{}' already declared in this scope"):
+        if not self.symbols.declare(name, symbol):
+            self.report(message.format(name), node)
+
+    def declare_local(self, name, symbol, node, message="Variable '{}' already declared in this scope"):
+        self.owners[symbol] = self.owner
+        self.declare(name, symbol, node, message)
+
+    def lookup(self, name, node):
+        # Every proc is a C function of its own, it can't use the locals of the proc or
+        # program body it is nested in
+        symbol = self.symbols.lookup(name)
+        owner = self.owners.get(symbol)
+        if owner is not None and owner is not self.owner:
+            self.report(f"Variable '{name}' of an enclosing scope can't be used in proc '{self.owner.name}'", node)
+        return symbol
 
-    def generic_visit(self, node):
-        raise Exception(f'No visit_{type(node).__name__} method')
+    def block(self, statements):
+        # Statements of a block are checked in a scope of their own. Nothing between entering
+        # and leaving it may raise, an error in the statements abandons only the statement
+        # it happened in and the scope is left as usual.
+        self.symbols.enter()
+        yield statements
+        self.symbols.leave()
+
+    def declare_proc(self, node):
+        node.symbol = Symbol(proc_type([param_type for _, param_type in node.params], node.return_type))
+        self.declare(node.name, node.symbol, node, "Procedure '{}' already declared")
+
+    def declare_global(self, node):
+        # Globals are declared before the statements, like procs, a 'ptr size' initialized
+        # with a proc gets its signature here already
+        if type(node) is DimNode:
+            node.symbol = Symbol(node.array_type, is_array=True)
+            self.declare(node.name, node.symbol, node, "array '{}' already defined")
+            return
+        var_type = node.var_type
+        if var_type is proc_pointer_type and type(node.expr) is IdentifierNode:
+            value = self.symbols.lookup(node.expr.name)
+            if value is not None and value.type.is_proc:
+                var_type = value.type
+        node.symbol = Symbol(var_type)
+        self.declare(node.var_name, node.symbol, node)
 
     def visit_ProgramNode(self, node):
-        for stmt in node.statements:
-            self.visit(stmt)
+        # Procs and globals can be used anywhere in the program, so they are declared before
+        # any statement is checked. The proc bodies are checked after the program, see analyze.
+        for proc in self.procs:
+            self.declare_proc(proc)
+        for statement in node.statements:
+            if type(statement) is LetNode or type(statement) is DimNode:
+                self.declare_global(statement)
+        yield [statement for statement in node.statements if type(statement) is not ProcNode]
     
     def visit_ProcNode(self, node):
-        # Save current local scope
-        saved_local_scope = self.local_scope
-
-        # Set up a new local scope with correct pointer information
-        self.local_scope = {
-            param_name: Symbol(var_type=param_type, is_pointer=is_pointer)
-            for param_name, param_type, is_pointer in node.params
-        }
-
-        # Register the procedure in the global scope
-        self.global_scope[node.name] = Symbol(
-            var_type='size',
-            is_pointer=True,  # Procedures are considered pointers
-            callable=True,
-            params=[Symbol(var_type=param_type, is_pointer=is_pointer) for _, param_type, is_pointer in node.params],
-            return_type=node.return_type
-        )
-
-        for stmt in node.body_statements:
-            self.visit(stmt)
-
-        # Restore the previous local scope
-        self.local_scope = saved_local_scope
+        if self.symbols.depth() > 1:
+            self.declare_proc(node) # Not declared up front, only procs of the program are
+
+        # Parameters are in the scope of the body
+        outer = self.owner
+        self.owner = node
+        self.symbols.enter()
+        for param_name, param_type in node.params:
+            self.declare_local(param_name, Symbol(param_type), node)
+
+        yield node.body_statements
+
+        self.symbols.leave()
+        self.owner = outer
 
     def visit_IdentifierNode(self, node):
-        if self.local_scope is not None and node.name in self.local_scope:
-            symbol = self.local_scope[node.name]
-        elif node.name in self.global_scope:
-            symbol = self.global_scope[node.name]
-        else:
+        node.symbol = self.lookup(node.name, node)
+        if node.symbol is None:
             self.error(f"Variable or procedure '{node.name}' not defined", node)
 
-        node.var_type = symbol.var_type
-        node.is_pointer = symbol.is_pointer
-        
-        return symbol
+        node.type = node.symbol.type
+        return node.type
     
     def visit_UnaryOpNode(self, node):
-        expr_symbol = self.visit(node.expr)
+        expr_type = yield node.expr
         # Handle the unary minus and plus (numeric)
         if node.op in ['-', '+']:
-            if expr_symbol.is_pointer:
+            if expr_type.is_pointer:
                 self.error(f"Unary '{node.op}' operator cannot be applied to pointers", node)
-            if expr_symbol.var_type not in Syntax.numeric_types:
-                self.error(f"Unary '{node.op}' operator requires numeric operand, got {expr_symbol.var_type}", node)
-            return Symbol(var_type=expr_symbol.var_type, is_pointer=False)
+            if not expr_type.is_numeric:
+                self.error(f"Unary '{node.op}' operator requires numeric operand, got {expr_type}", node)
+            node.type = expr_type
+            return expr_type
 
         # Handle logical negation
         if node.op == '!':
-            if expr_symbol.var_type != 'int':
-                self.error(f"Unary '!' operator requires an integer (boolean) operand, got {expr_symbol.var_type}", node)
-            return Symbol(var_type='int', is_pointer=False)
+            if expr_type is not int_type:
+                self.report(f"Unary '!' operator requires an integer (boolean) operand, got {expr_type}", node)
+            node.type = int_type
+            return int_type
         
         self.error(f"Unknown unary operator {node.op}", node)
 
 
     def visit_BinOpNode(self, node):
-        left_symbol = self.visit(node.left)
-        right_symbol = self.visit(node.right)
+        left_type = yield node.left
+        right_type = yield node.right
 
         # Arithmetic operations
         if node.op in ['+', '-', '*', '/']:
-            # Handle pointer arithmetic
-            if left_symbol.is_pointer or right_symbol.is_pointer:
+            # Handle pointer arithmetic, the result is the pointer
+            if left_type.is_pointer or right_type.is_pointer:
                 if node.op in ['+', '-']:
-                    if (left_symbol.is_pointer and right_symbol.var_type not in Syntax.none_float_numeric_data_types) or \
-                       (right_symbol.is_pointer and left_symbol.var_type not in Syntax.none_float_numeric_data_types):
+                    if (left_type.is_pointer and not right_type.is_integer) or \
+                       (right_type.is_pointer and not left_type.is_integer):
                         self.error(f"Pointer arithmetic requires a pointer and a non-floating-point numeric type", node)
-                    return Symbol(var_type=self.promote_type(left_symbol.var_type, right_symbol.var_type), is_pointer=True, return_type=left_symbol.var_type if left_symbol.is_pointer else right_symbol.var_type)
+                    node.type = left_type if left_type.is_pointer else right_type
+                    return node.type
                 else:
                     self.error(f"Operation '{node.op}' not allowed on pointers", node)
             
             # Regular numeric arithmetic
-            if left_symbol.var_type not in Syntax.numeric_data_types or right_symbol.var_type not in Syntax.numeric_data_types:
+            if not left_type.is_numeric or not right_type.is_numeric:
                 self.error(f"Arithmetic operations require numeric operands", node)
             
-            return Symbol(var_type=self.promote_type(left_symbol.var_type, right_symbol.var_type))
+            node.type = promotion[left_type.index][right_type.index]
+            return node.type
         
         # Comparison operations
         if node.op in ['<', '<=', '>', '>=', '==', '!=']:
-            if left_symbol.is_pointer != right_symbol.is_pointer:
-                self.error(f"Comparison operations require both operands to be either pointers or the same numeric type", node)
-            return Symbol(var_type='int')
+            if left_type.is_pointer != right_type.is_pointer:
+                self.report(f"Comparison operations require both operands to be either pointers or the same numeric type", node)
+            node.type = int_type
+            return int_type
         
         # Logical operations
         if node.op in ['and', 'or']:
-            if left_symbol.var_type != 'int' or right_symbol.var_type != 'int':
-                self.error(f"Logical operations require integer (boolean) operands", node)
-            return Symbol(var_type='int')
+            if left_type is not int_type or right_type is not int_type:
+                self.report(f"Logical operations require integer (boolean) operands", node)
+            node.type = int_type
+            return int_type
 
         self.error(f"Unknown binary operator {node.op}", node)
 
-    def promote_type(self, left_type, right_type):
-        # Promote to the type with the highest rank
-        if Syntax.numeric_type_hierarchy[left_type] > Syntax.numeric_type_hierarchy[right_type]:
-            return left_type
-        else:
-            return right_type
-
     def visit_NumberNode(self, node, expected_type=None):
-        value_str = str(node.value)
-        
-        if expected_type:
-            # Check if the value is a floating-point number
-            if '.' in value_str:
-                # If the expected type is an integer type, raise an error
-                if expected_type in Syntax.none_float_numeric_data_types:
-                    self.error(f"Type mismatch: cannot assign a floating-point value '{node.value}' to '{expected_type}'", node)
-                # Check if the expected type is float or double
-                elif expected_type == "float":
-                    if not self.is_value_in_range(node.value, "float"):
-                        self.error(f"Value '{node.value}' out of range for type 'float'", node)
-                elif expected_type == "double":
-                    if not self.is_value_in_range(node.value, "double"):
-                        self.error(f"Value '{node.value}' out of range for type 'double'", node)
-                return Symbol(var_type=expected_type)
-            else:
-                # If the value is an integer, perform range check based on the expected type
-                if not self.is_value_in_range(node.value, expected_type):
-                    self.error(f"Value '{node.value}' out of range for type '{expected_type}'", node)
-                return Symbol(var_type=expected_type)
+        is_float = type(node.number) is float
+
+        # Literals take the type they are assigned to, if it is a numeric one
+        if expected_type is not None and expected_type.is_numeric:
+            if is_float and expected_type.is_integer:
+                self.report(f"Type mismatch: cannot assign a floating-point value '{node.value}' to '{expected_type}'", node)
+            elif expected_type.range is not None:
+                min_value, max_value = expected_type.range
+                if not min_value <= node.number <= max_value:
+                    self.report(f"Value '{node.value}' out of range for type '{expected_type}'", node)
+            node.type = expected_type
+            return expected_type
     
-        # If no expected type is provided, determine the type based on the value
-        if '.' in value_str:
-            return Symbol(var_type='double')
+        # If no expected type is provided, determine the type based on the value, like in C an
+        # integer is an int if it fits and else the first of long and ulong that holds it
+        if is_float:
+            node.type = double_type
         else:
-            return Symbol(var_type='int')
+            node.type = next((literal_type for literal_type in integer_literal_types if node.number <= literal_type.range[1]), None)
+            if node.type is None:
+                node.type = integer_literal_types[-1]
+                self.report(f"Value '{node.value}' out of range for type '{node.type}'", node)
+        return node.type
 
     def visit_StringNode(self, node):
-        return Symbol(var_type='string')
-    
-    def is_compatible_type(self, var_symbol, value_symbol):
-        # Exact type match
-        if var_symbol.var_type == value_symbol.var_type and var_symbol.is_pointer == value_symbol.is_pointer:
-            return True
-
-        # Handle pointer arithmetic
-        if var_symbol.is_pointer:
-            # Allow assigning the result of pointer arithmetic to a pointer variable
-            if value_symbol.is_pointer and var_symbol.var_type == value_symbol.var_type:
-                return True
-            # Allow pointer + integer or pointer - integer
-            if not value_symbol.is_pointer and value_symbol.var_type in Syntax.none_float_numeric_data_types:
-                return True
-            return False
-
-        # Handle numeric type promotion
-        var_rank = Syntax.numeric_type_hierarchy.get(var_symbol.var_type)
-        value_rank = Syntax.numeric_type_hierarchy.get(value_symbol.var_type)
-
-        if var_rank is None or value_rank is None:
-            # If either type is not a recognized numeric type, they must be an exact match to be compatible
-            return False
-
-        # Allow assigning smaller or equal integer types to larger integer types
-        if var_rank >= value_rank:
-            # Ensure that ulong/long cannot be assigned to float
-            if var_symbol.var_type == "float" and value_symbol.var_type in ["long", "ulong"]:
-                return False
-            return True
-
-        # Prevent assigning a floating-point type to an integer type
-        if var_symbol.var_type in Syntax.none_float_numeric_data_types and \
-                value_symbol.var_type in Syntax.float_numeric_data_types:
-            return False
-
-        # If the value rank is higher than the variable rank, it's not compatible
-        return False
-    
-    def is_value_in_range(self, value, var_type):
-        # Convert the string value to an integer or float
-        try:
-            if '.' in str(value):
-                numeric_value = float(value)
-            else:
-                numeric_value = int(value)
-        except ValueError:
-            self.error(f"Invalid numeric value: {value}", None)
-
-        if var_type not in Syntax.numeric_data_type_ranges:
-            # No range checking for non-integer types like float, double, etc.
-            return True
-        
-        min_value, max_value = Syntax.numeric_data_type_ranges[var_type]
-        return min_value <= numeric_value <= max_value
-    
-    def get_variable_type(self, var_name_node):
-        if isinstance(var_name_node, IdentifierNode):
-            if self.local_scope is not None and var_name_node.name in self.local_scope:
-                return self.local_scope[var_name_node.name].var_type
-            elif var_name_node.name in self.global_scope:
-                return self.global_scope[var_name_node.name].var_type
-        elif isinstance(var_name_node, FieldAccessNode):
-            var_symbol = self.visit(var_name_node)
-            return var_symbol.var_type
-        elif isinstance(var_name_node, ArrayAccessNode):
-            var_symbol = self.visit(var_name_node)
-            return var_symbol.var_type
-        
-        self.error(f"Variable '{var_name_node.name}' not defined", var_name_node)
-        return None
+        node.type = string_type
+        return string_type
+
+    def check_assignment(self, target_type, value_type, what, node):
+        if is_assignable(target_type, value_type):
+            return
+        if target_type.is_pointer != value_type.is_pointer:
+            self.report(f"Pointer mismatch in {what}: cannot assign {'a pointer' if value_type.is_pointer else 'a non-pointer'} to {'a pointer' if target_type.is_pointer else 'a non-pointer'}", node)
+        else:
+            self.report(f"Type mismatch in {what}: cannot assign '{value_type}' to '{target_type}'", node)
+
+    def visit_target(self, node):
+        # Visits an assignment target and returns its type
+        if isinstance(node, IdentifierNode):
+            node.symbol = self.lookup(node.name, node)
+            if node.symbol is None:
+                self.error(f"Variable '{node.name}' not defined", node)
+            node.type = node.symbol.type
+            return node.type
+        if isinstance(node, (FieldAccessNode, ArrayAccessNode)):
+            return (yield node)
+        self.error(f"Invalid assignment target", node)
     
     def visit_LetNode(self, node):
-        # Determine the symbol for the variable being declared
-        var_symbol = Symbol(var_type=node.var_type, is_pointer=node.is_pointer)
-
-        # Handle NumberNode with expected type
         if isinstance(node.expr, NumberNode):
-            expected_type = var_symbol.var_type
-
-            value_symbol = self.visit_NumberNode(node.expr, expected_type=expected_type)
-
-            # Check if the literal value fits within the expected type range
-            if not self.is_value_in_range(node.expr.value, expected_type):
-                self.error(f"Value {node.expr.value} out of range for type '{expected_type}'", node)
-
-            # Disallow assigning a float to an integer type
-            if expected_type in Syntax.none_float_numeric_data_types and \
-            value_symbol.var_type in Syntax.float_numeric_data_types:
-                self.error(f"Type mismatch: cannot assign a floating-point value to '{expected_type}'", node)
+            # visit_NumberNode reports literals out of the range of the declared type
+            value_type = self.visit_NumberNode(node.expr, expected_type=node.var_type)
         else:
-            value_symbol = self.visit(node.expr)
+            value_type = yield node.expr
 
-        # Type checking
-        if not self.is_compatible_type(var_symbol, value_symbol):
-            self.error(f"Type mismatch in declaration: cannot assign '{value_symbol.var_type}' to '{var_symbol.var_type}'", node)
+        self.check_assignment(node.var_type, value_type, "declaration", node)
 
-        # Pointer type checking
-        if var_symbol.is_pointer != value_symbol.is_pointer:
-            self.error(f"Pointer mismatch in declaration: cannot assign {'a pointer' if value_symbol.is_pointer else 'a non-pointer'} to {'a pointer' if var_symbol.is_pointer else 'a non-pointer'}", node)
+        if self.symbols.depth() == 1:
+            return # A global, declared up front
 
-        # Store the variable symbol in the appropriate scope
-        if self.local_scope is not None:
-            self.local_scope[node.var_name] = value_symbol
-        else:
-            self.global_scope[node.var_name] = value_symbol
+        # The variable has its declared type, only a 'ptr size' holding a proc keeps the
+        # signature of the proc so it can be called
+        var_type = value_type if value_type.is_proc and node.var_type is proc_pointer_type else node.var_type
+        node.symbol = Symbol(var_type)
+        self.declare_local(node.var_name, node.symbol, node)
 
     def visit_AssignmentNode(self, node):
-        if isinstance(node.value, NumberNode):
-            expected_type = self.get_variable_type(node.var_name)
-            value_symbol = self.visit_NumberNode(node.value, expected_type=expected_type)
+        target_type = yield from self.visit_target(node.var_name)
 
-            # Check if the literal value fits within the expected type range
-            if not self.is_value_in_range(node.value.value, expected_type):
-                self.error(f"Value {node.value.value} out of range for type '{expected_type}'", node)
-        else:
-            value_symbol = self.visit(node.value)
-        
-        if isinstance(node.var_name, IdentifierNode):
-            if self.local_scope is not None and node.var_name.name in self.local_scope:
-                var_symbol = self.local_scope[node.var_name.name]
-            elif node.var_name.name in self.global_scope:
-                var_symbol = self.global_scope[node.var_name.name]
-            else:
-                self.error(f"Variable '{node.var_name.name}' not defined", node)
-        elif isinstance(node.var_name, FieldAccessNode):
-            var_symbol = self.visit(node.var_name)
-        elif isinstance(node.var_name, ArrayAccessNode):
-            var_symbol = self.visit(node.var_name)
+        if isinstance(node.value, NumberNode):
+            # visit_NumberNode reports literals out of the range of the target type
+            value_type = self.visit_NumberNode(node.value, expected_type=target_type)
         else:
-            self.error(f"Invalid assignment target", node)
+            value_type = yield node.value
 
-        if not self.is_compatible_type(var_symbol, value_symbol):
-            self.error(f"Type mismatch in assignment: cannot assign '{value_symbol.var_type}' to '{var_symbol.var_type}'", node)
-        
-        if var_symbol.is_pointer != value_symbol.is_pointer:
-            self.error(f"Pointer mismatch in assignment: cannot assign {'a pointer' if value_symbol.is_pointer else 'a non-pointer'} to {'a pointer' if var_symbol.is_pointer else 'a non-pointer'}", node)
-        
-        if self.local_scope is not None:
-            self.local_scope[node.var_name] = var_symbol
-        else:
-            self.global_scope[node.var_name] = var_symbol
+        self.check_assignment(target_type, value_type, "assignment", node)
 
     def visit_ArrayAssignmentNode(self, node):
-        if node.array_name not in self.global_scope:
+        node.symbol = self.lookup(node.array_name, node)
+        if node.symbol is None:
             self.error(f"array '{node.array_name}' not defined", node)
+        if not node.symbol.is_array:
+            self.report(f"'{node.array_name}' is not an array", node)
 
         # Check the index type
-        index_symbol = self.visit(node.index)
-        valid_index_types = Syntax.none_float_numeric_data_types
-        if index_symbol.var_type not in valid_index_types:
-            self.error(f"array index must be a non-floating-point numeric type, got {index_symbol.var_type}", node)
+        index_type = yield node.index
+        if not index_type.is_integer:
+            self.report(f"array index must be a non-floating-point numeric type, got {index_type}", node)
 
         # Retrieve the array's element type
-        array_symbol = self.global_scope[node.array_name]
+        element_type = node.symbol.type
         
         # Handle NumberNode with expected type
         if isinstance(node.value, NumberNode):
-            expected_type = array_symbol.var_type
-            value_symbol = self.visit_NumberNode(node.value, expected_type=expected_type)
-
-            # Check if the literal value fits within the expected type range
-            if not self.is_value_in_range(node.value.value, expected_type):
-                self.error(f"Value {node.value.value} out of range for type '{expected_type}'", node)
+            # visit_NumberNode reports literals out of the range of the expected type
+            value_type = self.visit_NumberNode(node.value, expected_type=element_type)
         else:
-            value_symbol = self.visit(node.value)
+            value_type = yield node.value
         
         # Type compatibility check
-        if value_symbol.var_type != array_symbol.var_type:
-            self.error(f"array '{node.array_name}' expects elements of type {array_symbol.var_type}, got {value_symbol.var_type}", node)
-        
-        # Pointer type compatibility check
-        if value_symbol.is_pointer != array_symbol.is_pointer:
-            self.error(f"Pointer mismatch: cannot assign {'a pointer' if value_symbol.is_pointer else 'a non-pointer'} to array of {'pointers' if array_symbol.is_pointer else 'non-pointers'}", node)
+        if value_type is not element_type:
+            if value_type.is_pointer != element_type.is_pointer:
+                self.report(f"Pointer mismatch: cannot assign {'a pointer' if value_type.is_pointer else 'a non-pointer'} to array of {'pointers' if element_type.is_pointer else 'non-pointers'}", node)
+            else:
+                self.report(f"array '{node.array_name}' expects elements of type {element_type}, got {value_type}", node)
 
     def visit_ArrayAccessNode(self, node):
-        if node.name not in self.global_scope:
+        node.symbol = self.lookup(node.name, node)
+        if node.symbol is None:
             self.error(f"array '{node.name}' not defined", node)
+        if not node.symbol.is_array:
+            self.report(f"'{node.name}' is not an array", node)
+
+        index_type = yield node.index
+        if not index_type.is_integer:
+            self.report(f"array index must be a non-floating-point numeric type, got {index_type}", node)
 
-        index_symbol = self.visit(node.index)
-        valid_index_types = Syntax.none_float_numeric_data_types
-        if index_symbol.var_type not in valid_index_types:
-            self.error(f"array index must be a non-floating-point numeric type, got {index_symbol.var_type}", node)
+        node.type = node.symbol.type
+        return node.type
 
-        array_symbol = self.global_scope[node.name]
-        return Symbol(var_type=array_symbol.var_type, is_pointer=array_symbol.is_pointer)
+    def check_condition(self, condition_type, node):
+        if condition_type is not int_type:
+            self.report(f"condition expression must be an integer, got {condition_type}", node)
 
     def visit_IfNode(self, node):
-        condition_symbol = self.visit(node.condition)
-        if condition_symbol.var_type != "int":
-            self.error(f"condition expression must be an integer, got {condition_symbol.var_type}", node)
-        
-        self.visit(node.true_branch)
+        self.check_condition((yield node.condition), node)
+        yield from self.block([node.true_branch])
         if node.false_branch:
-            self.visit(node.false_branch)
+            yield from self.block([node.false_branch])
 
     def visit_ForNode(self, node):
-        self.visit_LetNode(LetNode(node.srcpos, node.var_name, node.start_value))  # Initialize the loop variable
-        start_symbol = self.visit(node.start_value)
-        end_symbol = self.visit(node.end_value)
-        step_symbol = self.visit(node.step_value)
+        start_type = yield node.start_value
+        end_type = yield node.end_value
+        step_type = yield node.step_value
 
-        if start_symbol.var_type != "int" or end_symbol.var_type != "int" or step_symbol.var_type != "int":
-            self.error(f"for loop bounds and step must be integers", node)
-        
-        self.visit(node.loop_body)
+        if start_type is not int_type or end_type is not int_type or step_type is not int_type:
+            self.report(f"for loop bounds and step must be integers", node)
+
+        # The loop variable is in the scope of the body
+        self.symbols.enter()
+        node.symbol = Symbol(int_type)
+        self.declare_local(node.var_name, node.symbol, node)
+        yield [node.loop_body]
+        self.symbols.leave()
 
     def visit_WhileNode(self, node):
-        condition_symbol = self.visit(node.condition)
-        if condition_symbol.var_type != "int":
-            self.error(f"condition expression must be an integer, got {condition_symbol.var_type}", node)
-        self.visit(node.body)
+        self.check_condition((yield node.condition), node)
+        yield from self.block([node.body])
 
     def visit_DoWhileNode(self, node):
-        self.visit(node.body)
-        condition_symbol = self.visit(node.condition)
-        if condition_symbol.var_type != "int":
-            self.error(f"condition expression must be an integer, got {condition_symbol.var_type}", node)
+        yield from self.block([node.body])
+        self.check_condition((yield node.condition), node)
 
     def visit_DoUntilNode(self, node):
-        self.visit(node.body)
-        condition_symbol = self.visit(node.condition)
-        if condition_symbol.var_type != "int":
-            self.error(f"condition expression must be an integer, got {condition_symbol.var_type}", node)
+        yield from self.block([node.body])
+        self.check_condition((yield node.condition), node)
 
     def visit_SelectCaseNode(self, node):
-        expr_symbol = self.visit(node.expr)
+        expr_type = yield node.expr
         for case_value, case_body in node.cases:
-            case_value_symbol = self.visit(case_value)
-            if case_value_symbol.var_type != expr_symbol.var_type:
-                self.error(f"case value type {case_value_symbol.var_type} does not match select expression type {expr_symbol.var_type}", node)
-            self.visit(case_body)
+            case_value_type = yield case_value
+            if case_value_type is not expr_type:
+                self.report(f"case value type {case_value_type} does not match select expression type {expr_type}", node)
+            yield from self.block([case_body])
 
         if node.default_case:
-            self.visit(node.default_case)
+            yield from self.block([node.default_case])
 
     def visit_ReturnNode(self, node):
-        return_symbol = self.visit(node.value)
-        return return_symbol
+        # The value of a void proc is only computed, the one of the program is its exit code
+        proc = self.owner if type(self.owner) is ProcNode and self.owner.return_type is not void_type else None
+        if proc is not None and isinstance(node.value, NumberNode):
+            return_type = self.visit_NumberNode(node.value, expected_type=proc.return_type)
+        else:
+            return_type = yield node.value
+        if proc is not None:
+            self.check_assignment(proc.return_type, return_type, "return", node)
+        return return_type
+
+    def visit_FreeNode(self, node):
+        # Pointers are freed into the pool of their type, the code can't tell if they came
+        # from an arena, freeing those is up to the arena
+        expr_type = yield node.expr
+        if expr_type is not arena_type and expr_type.kind is not POINTER:
+            self.report(f"only arenas and pointers can be freed, got {expr_type}", node)
 
     def visit_DimNode(self, node):
-        if node.name in self.global_scope:
-            self.error(f"array '{node.name}' already defined", node)
-        self.global_scope[node.name] = Symbol(var_type=node.array_type, is_pointer=False)
+        size_type = yield node.size
+        if not size_type.is_integer:
+            self.report(f"array size must be a non-floating-point numeric type, got {size_type}", node)
+        if self.symbols.depth() > 1: # Globals are declared up front
+            node.symbol = Symbol(node.array_type, is_array=True)
+            self.declare_local(node.name, node.symbol, node, "array '{}' already defined")
 
     def visit_TypeNode(self, node):
-        self.global_scope[node.type_name] = node.fields
+        # The parser already made the struct type, only the default values are left to check,
+        # and that it has a size
+        if contains_itself(node.struct_type):
+            self.report(f"Type '{node.struct_type}' contains itself by value, use a ptr field", node)
+        for field in node.fields.values():
+            if field.default_value is None:
+                continue
+            if isinstance(field.default_value, NumberNode):
+                value_type = self.visit_NumberNode(field.default_value, expected_type=field.type)
+            else:
+                value_type = yield field.default_value
+            self.check_assignment(field.type, value_type, "field default", field.default_value)
 
     def visit_NewInstanceNode(self, node):
-        if node.type_name not in self.global_scope and node.type_name not in Syntax.data_types:
-            self.error(f"Type '{node.type_name}' not defined", node)
-        return Symbol(var_type=node.type_name, is_pointer=node.is_pointer)
+        node.type = node.instance_type
+        if node.arena is not None:
+            if node.instance_type.kind is not POINTER:
+                self.report(f"only pointers can be allocated in an arena, got {node.instance_type}", node)
+            allocator_type = yield node.arena
+            if allocator_type is not arena_type:
+                self.report(f"expected an arena to allocate in, got {allocator_type}", node)
+        return node.type
 
     def visit_FieldAccessNode(self, node):
-        instance_symbol = self.visit(node.instance)
-        if instance_symbol.var_type not in self.global_scope:
-            self.error(f"Type '{instance_symbol.var_type}' not defined", node)
-
-        fields = self.global_scope[instance_symbol.var_type]
-        if node.name not in fields:
-            self.error(f"Field '{node.name}' not found in type '{instance_symbol.var_type}'", node)
+        instance_type = yield node.instance
+        # Fields are also reached through a pointer to the struct
+        struct = instance_type.target if instance_type.target is not None else instance_type
+        if struct.kind is not STRUCT:
+            self.error(f"Type '{instance_type}' is not a user-defined type", node)
+
+        if node.name not in struct.fields:
+            self.error(f"Field '{node.name}' not found in type '{struct}'", node)
         
-        field_info = fields[node.name]
-        return Symbol(var_type=field_info.var_type , is_pointer=field_info.is_pointer)
+        node.type = struct.fields[node.name]
+        return node.type
 
     def visit_FunctionCallNode(self, node):
-        if node.name not in self.global_scope:
+        node.symbol = self.lookup(node.name, node)
+        if node.symbol is None:
             self.error(f"Function '{node.name}' not defined", node)
 
-        symbol = self.global_scope[node.name]
+        called = node.symbol.type
 
-        if not symbol.callable:
+        if not called.is_proc:
             self.error(f"'{node.name}' is not callable", node)
 
-        expected_params = symbol.params
-        expected_return_type = symbol.return_type
+        if len(node.arguments) != len(called.params):
+            self.report(f"function '{node.name}' expects {len(called.params)} arguments, got {len(node.arguments)}", node)
 
-        if len(node.arguments) != len(expected_params):
-            self.error(f"function '{node.name}' expects {len(expected_params)} arguments, got {len(node.arguments)}", node)
+        # Every argument is visited once, also the ones without a parameter
+        for i, arg in enumerate(node.arguments):
+            arg_type = yield arg
+            if i < len(called.params) and arg_type is not called.params[i]:
+                self.report(f"argument {i+1} of function '{node.name}' should be of type '{called.params[i]}', got '{arg_type}'", node)
 
-        for i, (arg, expected_param) in enumerate(zip(node.arguments, expected_params)):
-            arg_symbol = self.visit(arg)
-            if arg_symbol.var_type != expected_param.var_type or arg_symbol.is_pointer != expected_param.is_pointer:
-                expected_ptr = "ptr " if expected_param.is_pointer else ""
-                got_ptr = "ptr " if arg_symbol.is_pointer else ""
-                self.error(f"argument {i+1} of function '{node.name}' should be of type '{expected_ptr}{expected_param.var_type}', got '{got_ptr}{arg_symbol.var_type}'", node)
+        node.type = called.return_type
+        return node.type
 
-        return Symbol(var_type=expected_return_type, is_pointer=False)
+    def visit_ErrorNode(self, node):
+        pass # Already reported by the parser
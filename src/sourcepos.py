@@ -1,6 +1,28 @@
+from bisect import bisect_right
+
 class SrcPos:
     def __init__(self, filename, line, column, length):
         self.filename = filename
         self.line = line
         self.column = column
-        self.length = length
\ No newline at end of file
+        self.length = length
+
+class SourceFile:
+    # Tokens and nodes only carry a character offset into the source. Line and column
+    # are looked up here when a diagnostic is actually printed.
+    def __init__(self, filename, code):
+        self.filename = filename
+        self.code = code
+        self.line_starts = None # Offset of the first character of every line, built on first use
+
+    def srcpos(self, offset, length=0):
+        if self.line_starts is None:
+            self.line_starts = [0]
+            find = self.code.find
+            newline = find("\n")
+            while newline != -1:
+                self.line_starts.append(newline + 1)
+                newline = find("\n", newline + 1)
+
+        line = bisect_right(self.line_starts, offset)
+        return SrcPos(self.filename, line, offset - self.line_starts[line - 1] + 1, length)
\ No newline at end of file
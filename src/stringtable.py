@@ -0,0 +1,17 @@
+from syntax import Syntax
+
+class StringTable:
+    # Per compilation table of names. Every occurrence of an identifier maps to one shared
+    # str object, and the table is seeded with the Syntax words, which are the same interned
+    # objects as the literals in the parser and semanter. Comparing and hashing those
+    # strings then hits the identity fast path instead of comparing characters.
+    def __init__(self):
+        self.strings = {}
+        for word in Syntax.keywords + Syntax.data_types + Syntax.operators + Syntax.separators:
+            self.strings[word] = word
+
+    def intern(self, text):
+        return self.strings.setdefault(text, text)
+
+    def __len__(self):
+        return len(self.strings)
@@ -1,16 +1,9 @@
 class Symbol:
-    def __init__(self, var_type, is_pointer=False, default_value = None, callable=False, params=None, return_type=None):
-        self.var_type = var_type
-        self.is_pointer = is_pointer
+    def __init__(self, type, default_value=None, is_array=False):
+        self.type = type # Interned Type, see typesystem.py, of the elements for an array
         self.default_value = default_value
-        self.callable = callable
-        self.params = params if params is not None else []
-        self.return_type = return_type
+        self.is_array = is_array # Declared by a dim
 
     def __repr__(self):
-        pointer_str = 'ptr ' if self.is_pointer else ''
-        default_value = f'def. value: {self.default_value} ' if not self.callable else ''
-        callable_str = ' (callable)' if self.callable else ''
-        params_str = f"Params: {self.params}, " if self.callable else ''
-        return_type_str = f"Returns: {self.return_type}" if self.callable else ''
-        return f"Symbol({pointer_str}{self.var_type}{callable_str}, {params_str}{return_type_str})"
\ No newline at end of file
+        default_value = f", def. value: {self.default_value}" if self.default_value is not None else ''
+        return f"Symbol({self.type}{default_value})"
\ No newline at end of file
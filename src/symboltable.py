@@ -0,0 +1,60 @@
+from typesystem import struct_type
+
+class SymbolTable:
+    # The names visible at the current point of a pass, with nested scopes for the program,
+    # procs and blocks. One dict maps every name to its innermost symbol, so a lookup costs
+    # the same however deep the blocks are nested. Every open scope remembers what its
+    # declarations shadowed, leaving it puts that back.
+    def __init__(self):
+        self.symbols = {} # Name -> innermost visible Symbol
+        self.scopes = [{}] # Per open scope, its names -> the Symbol they shadow or None
+
+    def enter(self):
+        self.scopes.append({})
+
+    def leave(self):
+        for name, shadowed in self.scopes.pop().items():
+            if shadowed is None:
+                del self.symbols[name]
+            else:
+                self.symbols[name] = shadowed
+
+    def depth(self):
+        return len(self.scopes)
+
+    def lookup(self, name):
+        return self.symbols.get(name)
+
+    def declare(self, name, symbol):
+        # False if the name is already declared in the innermost scope itself
+        scope = self.scopes[-1]
+        if name in scope:
+            return False
+        scope[name] = self.symbols.get(name)
+        self.symbols[name] = symbol
+        return True
+
+class TypeTable:
+    # The user-defined struct types by name. A type can be used before its definition, the
+    # first use makes its Type and the definition later fills in the fields.
+    def __init__(self):
+        self.types = {} # Name -> struct Type
+        self.undefined = {} # Name -> offset of the first use, for types not defined yet
+
+    def reference(self, name, offset):
+        struct = self.types.get(name)
+        if struct is None:
+            struct = self.types[name] = struct_type(name)
+            self.undefined[name] = offset
+        return struct
+
+    def define(self, name):
+        # Returns the Type to fill in, None if the type is already defined
+        struct = self.types.get(name)
+        if struct is None:
+            struct = self.types[name] = struct_type(name)
+        elif name in self.undefined:
+            del self.undefined[name]
+        else:
+            return None
+        return struct
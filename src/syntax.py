@@ -6,9 +6,10 @@ class Syntax:
             "if",
             "then",
             "else",
-            "endif"
+            "endif",
             "for",
             "to",
+            "step",
             "next",
             "proc",
             "pend",
@@ -17,6 +18,7 @@ class Syntax:
             "wend",
             "do",
             "loop",
+            "until",
             "select",
             "case",
             "return",
@@ -26,9 +28,53 @@ class Syntax:
             "field",
             "tend",
             "new",
-            "ptr"
+            "ptr",
+            "in",
+            "free"
         ]
 
+    operators = [
+        "<=",
+        ">=",
+        "==",
+        "!=",
+        "+",
+        "-",
+        "*",
+        "/",
+        "=",
+        "<",
+        ">",
+        ":",
+        "!"
+    ]
+
+    separators = [
+        ".",
+        "(",
+        ")",
+        ",",
+        "[",
+        "]"
+    ]
+
+    # Binary operators by precedence (higher binds tighter) and associativity.
+    # Unary '-', '+' and '!' bind tighter than all of them.
+    binary_operators = {
+        "or": (1, "left"),
+        "and": (2, "left"),
+        "==": (3, "left"),
+        "!=": (3, "left"),
+        "<": (4, "left"),
+        "<=": (4, "left"),
+        ">": (4, "left"),
+        ">=": (4, "left"),
+        "+": (5, "left"),
+        "-": (5, "left"),
+        "*": (6, "left"),
+        "/": (6, "left")
+    }
+
     data_types = [
         "void",
         "char",    # 8  bits   [−127, +127]
@@ -42,7 +88,8 @@ class Syntax:
         "float",   # 32 bits   [1.2E-38 to 3.4E+38] (6 decimal places)
         "double",   # 64 bits   [2.3E-308 to 1.7E+308] (15 decimal places)
         "string",
-        "size"
+        "size",
+        "arena"    # Memory that instances are allocated in and freed together
     ]
 
     numeric_data_types = [
@@ -0,0 +1,23 @@
+class TokenStream:
+    # Lexes the whole input up front, so the parser can look ahead any number of
+    # tokens with a plain list index instead of asking the lexer token by token.
+    def __init__(self, lexer):
+        self.tokens = lexer.tokenize()
+        self.index = 0 # Index of the next token that next() returns
+        self.last_index = len(self.tokens) - 1 # The EOF token, it's returned forever
+
+    def next(self):
+        token = self.tokens[self.index]
+        if self.index < self.last_index:
+            self.index += 1
+        return token
+
+    def peek(self, k=1):
+        # k=1 is the token that the next call to next() returns
+        index = self.index + k - 1
+        if index > self.last_index:
+            index = self.last_index
+        return self.tokens[index]
+
+    def __len__(self):
+        return len(self.tokens)
@@ -12,10 +12,13 @@ class TokenType(Enum):
     EOF = auto()
 
 class Token:
-    def __init__(self, type, value, srcpos):
+    __slots__ = ("type", "value", "offset", "length")
+
+    def __init__(self, type, value, offset, length):
         self.type = type
         self.value = value
-        self.srcpos = srcpos
+        self.offset = offset # Character offset into the source, see SourceFile.srcpos
+        self.length = length
     
     def __repr__(self):
-        return f'Token({self.type}, {repr(self.value)}, {self.srcpos.filename}, {self.srcpos.line}, {self.srcpos.column}, {self.srcpos.length})'
+        return f'Token({self.type}, {repr(self.value)}, {self.offset}, {self.length})'
@@ -0,0 +1,104 @@
+from syntax import Syntax
+
+# Kinds of types
+PRIMITIVE = "primitive"
+POINTER = "pointer"
+STRUCT = "struct"
+PROC = "proc"
+
+class Type:
+    # Types are interned, there is exactly one object per type and they are compared with
+    # 'is'. Primitives exist once per process, pointer and proc types are only made through
+    # pointer() and proc_type() which cache them, and the parser makes one struct type per
+    # type definition. What the checks ask about a type is computed once here.
+    __slots__ = ("kind", "name", "target", "fields", "params", "return_type", "index", "range",
+                 "is_numeric", "is_integer", "is_float", "is_pointer", "is_proc", "pointer_type", "proc_types")
+
+    def __init__(self, kind, name, target=None, params=(), return_type=None):
+        self.kind = kind
+        self.name = name
+        self.target = target # Type a pointer points to
+        self.fields = {} if kind == STRUCT else None # Field name -> Type of a struct
+        self.params = params # Parameter types of a proc
+        self.return_type = return_type
+        self.index = None # Row and column of numeric types in the tables below
+        self.range = Syntax.numeric_data_type_ranges.get(name) if kind == PRIMITIVE else None
+        self.is_numeric = kind == PRIMITIVE and name in Syntax.numeric_data_types
+        self.is_integer = kind == PRIMITIVE and name in Syntax.none_float_numeric_data_types
+        self.is_float = kind == PRIMITIVE and name in Syntax.float_numeric_data_types
+        self.is_pointer = kind == POINTER or kind == PROC # Procedures are pointers to code
+        self.is_proc = kind == PROC
+        self.pointer_type = None
+        self.proc_types = None # Param types -> proc type, for procs that return this type
+
+    def pointer(self):
+        if self.pointer_type is None:
+            self.pointer_type = Type(POINTER, f"ptr {self.name}", target=self)
+        return self.pointer_type
+
+    def __repr__(self):
+        return self.name
+
+    def __reduce__(self):
+        # Unpickled types are the interned objects again. Structs can't be found by name,
+        # they come back as copies unless the pickler passes them by reference.
+        if self.kind == PRIMITIVE:
+            return (primitive_type, (self.name,))
+        if self.kind == POINTER:
+            return (Type.pointer, (self.target,))
+        if self.kind == PROC:
+            return (proc_type, (self.params, self.return_type))
+        return (struct_type, (self.name,), (None, {"fields": self.fields}))
+
+def proc_type(params, return_type):
+    # Proc types are cached on their return type
+    params = tuple(params)
+    if return_type.proc_types is None:
+        return_type.proc_types = {}
+    proc = return_type.proc_types.get(params)
+    if proc is None:
+        proc = Type(PROC, f"proc({', '.join(param.name for param in params)}): {return_type.name}", params=params, return_type=return_type)
+        return_type.proc_types[params] = proc
+    return proc
+
+def struct_type(name):
+    return Type(STRUCT, name)
+
+def primitive_type(name):
+    return primitive_types[name]
+
+primitive_types = {name: Type(PRIMITIVE, name) for name in Syntax.data_types}
+int_type = primitive_types["int"]
+double_type = primitive_types["double"]
+string_type = primitive_types["string"]
+void_type = primitive_types["void"]
+arena_type = primitive_types["arena"]
+
+# Types an integer literal can have without a type it is assigned to, the first that holds it
+integer_literal_types = [int_type, primitive_types["long"], primitive_types["ulong"]]
+
+# Numeric types ordered by rank, a type's index is its position here
+numeric_types = sorted((primitive_types[name] for name in Syntax.numeric_data_types), key=lambda numeric: Syntax.numeric_type_hierarchy[numeric.name])
+for index, numeric in enumerate(numeric_types):
+    numeric.index = index
+
+# promotion[a.index][b.index] is the type an arithmetic operation on a and b results in,
+# the one with the higher rank
+promotion = [[a if a.index > b.index else b for b in numeric_types] for a in numeric_types]
+
+# numeric_assignable[target.index][source.index] tells if a value can be assigned without
+# a cast: to types of equal or higher rank, but float can't hold every long or ulong
+numeric_assignable = [
+    [target.index >= source.index and not (target.name == "float" and source.name in ["long", "ulong"]) for source in numeric_types]
+    for target in numeric_types
+]
+
+# Procedures are held in 'ptr size' variables
+proc_pointer_type = primitive_types["size"].pointer()
+
+def is_assignable(target, source):
+    if target is source:
+        return True
+    if target.index is not None and source.index is not None:
+        return numeric_assignable[target.index][source.index]
+    return source.is_proc and target is proc_pointer_type
@@ -0,0 +1,64 @@
+from types import GeneratorType
+from diagnostics import CompileError
+
+def statement_list(statements):
+    # Frame of a statement list on the stack of NodeVisitor.visit, errors unwind up to here
+    for statement in statements:
+        yield statement
+
+class NodeVisitor:
+    # Base of the passes over the AST. A pass defines visit_<NodeClass> methods, the method
+    # for a node class is looked up once and then kept in the handlers dict of the pass class,
+    # so visiting a node costs one dict lookup instead of building the name and a getattr.
+    handlers = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.handlers = {} # Node class -> visit function, every pass class has its own
+
+    def resolve(self, node_class):
+        handler = getattr(type(self), f'visit_{node_class.__name__}', None) or type(self).generic_visit
+        self.handlers[node_class] = handler
+        return handler
+
+    def dispatch(self, node):
+        handler = self.handlers.get(type(node)) or self.resolve(type(node))
+        return handler(self, node)
+
+    def generic_visit(self, node):
+        raise Exception(f'No visit_{type(node).__name__} method')
+
+    def visit(self, node):
+        # Visit methods of nodes with children are generators that yield a child node and get
+        # its result sent back. They are driven from an explicit stack here, so deeply nested
+        # programs don't run into the recursion limit. A visit method yields a list of
+        # statements to have them visited one after another, a CompileError abandons only the
+        # statement it happened in and the pass goes on with the next one of the list.
+        handlers = self.handlers
+        result = self.dispatch(node)
+        if not isinstance(result, GeneratorType):
+            return result
+        stack = [result]
+        result = None
+        while stack:
+            try:
+                child = stack[-1].send(result)
+                if type(child) is list:
+                    stack.append(statement_list(child))
+                    result = None
+                    continue
+                handler = handlers.get(type(child)) or self.resolve(type(child))
+                result = handler(self, child)
+                if isinstance(result, GeneratorType):
+                    stack.append(result)
+                    result = None
+            except StopIteration as done:
+                stack.pop()
+                result = done.value
+            except CompileError:
+                while stack and stack[-1].gi_code is not statement_list.__code__:
+                    stack.pop()
+                if not stack:
+                    raise
+                result = None
+        return result
@@ -0,0 +1,76 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fastlexer import FastLexer
+from parser import Parser
+from semanter import Semanter
+
+def errors(code):
+    parser = Parser(FastLexer(code, "test.fb"))
+    program = parser.parse()
+    Semanter(parser.diagnostics).analyze(program)
+    return [diagnostic.message for diagnostic in parser.diagnostics]
+
+class NestedProcTest(unittest.TestCase):
+    # Every proc is a C function of its own, a nested one sees only globals and procs
+
+    def test_locals_of_enclosing_proc_are_reported(self):
+        code = (
+            "proc outer(a: int): int\n"
+            "    for i = 1 to 3\n"
+            "        proc inner(): int\n"
+            "            return i + a\n"
+            "        pend\n"
+            "    next\n"
+            "    return 0\n"
+            "pend\n"
+            "return outer(1)\n"
+        )
+        self.assertEqual(errors(code), [
+            "Variable 'i' of an enclosing scope can't be used in proc 'inner'",
+            "Variable 'a' of an enclosing scope can't be used in proc 'inner'",
+        ])
+
+    def test_globals_and_procs_can_be_used(self):
+        code = (
+            "let g: int = 1\n"
+            "proc outer(a: int): int\n"
+            "    proc inner(b: int): int\n"
+            "        return g + b\n"
+            "    pend\n"
+            "    proc twice(b: int): int\n"
+            "        return inner(b) * 2\n"
+            "    pend\n"
+            "    return twice(a)\n"
+            "pend\n"
+            "return outer(1)\n"
+        )
+        self.assertEqual(errors(code), [])
+
+class TypeTest(unittest.TestCase):
+
+    def test_type_that_contains_itself_is_reported(self):
+        code = (
+            "type N\n"
+            "    field n: N\n"
+            "tend\n"
+            "type A\n"
+            "    field b: B\n"
+            "tend\n"
+            "type B\n"
+            "    field a: A\n"
+            "    field link: ptr B\n"
+            "tend\n"
+            "return 0\n"
+        )
+        self.assertEqual(errors(code), [
+            "Type 'N' contains itself by value, use a ptr field",
+            "Type 'A' contains itself by value, use a ptr field",
+            "Type 'B' contains itself by value, use a ptr field",
+        ])
+
+if __name__ == "__main__":
+    unittest.main()